@@ -0,0 +1,155 @@
+from region_aware import DivisionBipartition
+from scipy import sparse
+from scipy.sparse.csgraph import depth_first_order, shortest_path
+from functools import partial
+import numpy as np
+import random
+
+
+class ArrayTree:
+    """
+    A spanning tree of a region, as arrays over the positions of the region's nodes.  Once rooted
+    (`root_at`), it holds every node's `parent` (-1 at the root), the depth-first preorder `order`
+    (in which every subtree is the contiguous run starting at its root's `position`) and the
+    population and size of every node's subtree.  Subtree totals are accumulated one depth level
+    at a time, deepest first, so the work is a NumPy operation per level rather than per node.
+    """
+    def __init__(self, heads, tails, populations) -> None:
+        num_nodes = len(populations)
+        self.populations = populations
+        self.adjacency = sparse.csr_matrix((np.ones(len(heads)), (heads, tails)), shape=(num_nodes, num_nodes))
+        self.degrees = np.bincount(heads, minlength=num_nodes) + np.bincount(tails, minlength=num_nodes)
+
+    def roots(self):
+        """
+        The nodes that may root the tree: those that aren't leaves.
+        """
+        return np.flatnonzero(self.degrees > 1)
+
+    def root_at(self, root):
+        num_nodes = len(self.populations)
+        self.root = root
+        self.order, self.parent = depth_first_order(self.adjacency, root, directed=False, return_predecessors=True)
+        self.parent[root] = -1
+        self.position = np.empty(num_nodes, dtype=np.int64)
+        self.position[self.order] = np.arange(num_nodes)
+
+        depths = shortest_path(self.adjacency, directed=False, unweighted=True, indices=root).astype(np.int64)
+        by_depth = np.argsort(depths, kind="stable")
+        bounds = np.searchsorted(depths[by_depth], np.arange(depths.max() + 2))
+        totals = np.stack([self.populations, np.ones(num_nodes)], axis=1)
+        for depth in range(depths.max(), 0, -1):
+            level = by_depth[bounds[depth]:bounds[depth + 1]]
+            np.add.at(totals, self.parent[level], totals[level])
+        self.subtree_pops = totals[:, 0]
+        self.sizes = totals[:, 1].astype(np.int64)
+        return self
+
+    def balanced_cuts(self, pop_target, epsilon, split_scores=None):
+        """
+        The nodes whose edge to their parent is a balanced cut, and for each whether its subtree
+        (rather than the rest of the tree) is the part within `epsilon` of `pop_target`.  With
+        `split_scores` (of every node's edge to its parent), only the cuts with the highest score
+        are kept.
+        """
+        total_pop = self.subtree_pops[self.root]
+        is_balanced_A = np.abs(self.subtree_pops - pop_target) <= pop_target * epsilon
+        is_balanced_B = np.abs((total_pop - self.subtree_pops) - pop_target) <= pop_target * epsilon
+        is_cut = is_balanced_A | is_balanced_B
+        is_cut[self.root] = False
+        if split_scores is not None and is_cut.any():
+            is_cut &= split_scores == split_scores[is_cut].max()
+        cuts = np.flatnonzero(is_cut)
+        return cuts, is_balanced_A[cuts]
+
+    def subtree(self, node):
+        start = self.position[node]
+        return self.order[start:start + self.sizes[node]]
+
+
+def choose_root(tree, choice=random.choice):
+    roots = tree.roots()
+    return tree.root_at(roots[choice(range(len(roots)))])
+
+class ArrayBipartition(DivisionBipartition):
+    """
+    `array_bipartition_tree` bound to the parent graph, like `DivisionBipartition`.
+    """
+    def __init__(self, graph, pop_col, division_tuples=[], first_check_division=False, columns=None,
+                 wilson=False, division_weight=0.1) -> None:
+        super().__init__(graph, pop_col, division_tuples, first_check_division, columns)
+        self.populations = self.populations.astype(np.float64)
+        self.division_cols = [tup[0] for tup in sorted(division_tuples, key=lambda x: x[1], reverse=True)]
+        if wilson:
+            self.spanning_tree = partial(self.edges.wilson_spanning_tree,
+                                         division_weight=division_weight if division_tuples else None)
+        else:
+            self.spanning_tree = self.edges.random_spanning_tree
+
+    def __call__(self, graph, pop_col, pop_target, epsilon, node_repeats=1, choice=random.choice,
+                 attempts_before_giveup=100):
+        nodes, positions, populations = self.region(graph)
+        edges = self.edges
+
+        cuts = []
+        tree = ArrayTree(*self.spanning_tree(nodes), populations)
+        restarts = 0
+        counter = 0
+        while len(cuts) == 0 and counter < attempts_before_giveup:
+            if restarts == node_repeats:
+                tree = ArrayTree(*self.spanning_tree(nodes), populations)
+                restarts = 0
+                counter += 1
+            if len(self.division_tuples) > 0 and self.first_check_division and restarts == 0:
+                choose_root(tree, choice)
+                split_scores = edges.position_split_scores(positions, positions[np.maximum(tree.parent, 0)], self.division_cols)
+                cuts, subtree_sides = tree.balanced_cuts(pop_target, epsilon, split_scores)
+            if len(cuts) == 0:
+                choose_root(tree, choice)
+                cuts, subtree_sides = tree.balanced_cuts(pop_target, epsilon)
+            restarts += 1
+
+        if counter >= attempts_before_giveup:
+            # The county-aware path gives up like `division_bipartition_tree`.  The neutral one
+            # stands in for gerrychain's `bipartition_tree`, so it raises instead of returning an
+            # empty subset, which would move the whole region into one district.
+            if len(self.division_tuples) == 0:
+                raise RuntimeError("Could not find a balanced cut after {} spanning trees".format(attempts_before_giveup))
+            return set()
+        cut = choice(range(len(cuts)))
+        in_subset = np.zeros(len(nodes), dtype=bool)
+        in_subset[tree.subtree(cuts[cut])] = True
+        if not subtree_sides[cut]:
+            in_subset = ~in_subset
+        return {nodes[i] for i in np.flatnonzero(in_subset).tolist()}
+
+def array_bipartition_tree(
+    graph,
+    pop_col,
+    pop_target,
+    epsilon,
+    division_tuples=[],
+    first_check_division=False,
+    node_repeats=1,
+    choice=random.choice,
+    attempts_before_giveup=100,
+    columns=None,
+    wilson=False,
+    division_weight=0.1):
+    """
+    `division_bipartition_tree` (or, without `division_tuples`, gerrychain's `bipartition_tree`)
+    on `ArrayTree`s.  Spanning trees are drawn from the same distribution, roots and cuts are
+    chosen uniformly from the same candidates, and the returned subsets follow the same
+    distribution, but the draws of a seeded run differ from those of the networkx code.  Where
+    gerrychain's `bipartition_tree` would keep drawing trees, the neutral path raises a
+    `RuntimeError` after `attempts_before_giveup` trees without a balanced cut.
+
+    With `wilson`, the spanning trees are instead drawn uniformly with Wilson's algorithm
+    (`DivisionEdges.wilson_spanning_tree`), or with `division_tuples`, with every edge weighted
+    `division_weight ** penalty` for the divisions it crosses.  The walk is pure Python, about
+    2-5 times slower per tree than the minimum spanning trees on a VTD graph.
+    """
+    return ArrayBipartition(graph, pop_col, division_tuples, first_check_division, columns, wilson=wilson,
+                            division_weight=division_weight)(
+        graph, pop_col, pop_target, epsilon, node_repeats=node_repeats, choice=choice,
+        attempts_before_giveup=attempts_before_giveup)
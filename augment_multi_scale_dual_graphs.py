@@ -1,8 +1,8 @@
 import click
 import warnings
-import pandas as pd
 from collections import defaultdict
-from gerrychain import Graph
+from graph_cache import load_graph
+from multi_scale import load_baf
 
 
 @click.command()
@@ -31,17 +31,14 @@ def augment(block_graph_in_file, vtd_graph_in_file, baf_file, state_fips_code,
             in_place, block_graph_out_file, vtd_graph_out_file,
             block_geoid_col, vtd_geoid_col, baf_block_col, baf_county_col,
             baf_vtd_col):
-    block_graph = Graph.from_json(block_graph_in_file)
-    vtd_graph = Graph.from_json(vtd_graph_in_file)
-    baf_df = pd.read_csv(baf_file, sep='|',
-                         dtype=str).set_index(baf_block_col)
+    block_graph = load_graph(block_graph_in_file)
+    vtd_graph = load_graph(vtd_graph_in_file)
 
     # Generate VTD IDs from BAF columns.
-    baf_df['vtd_id'] = (state_fips_code +
-                        baf_df[baf_county_col].str.zfill(3) +
-                        baf_df[baf_vtd_col].str.zfill(6))
+    vtds = load_baf(baf_file, state_fips_code, block_col=baf_block_col,
+                    county_col=baf_county_col, vtd_col=baf_vtd_col)
     blocks_by_vtd = defaultdict(set)
-    for block, vtd in baf_df['vtd_id'].items():
+    for block, vtd in vtds.items():
         blocks_by_vtd[vtd].add(block)
     block_graph_edges_by_geoid = {(block_graph.nodes[a][block_geoid_col],
                                    block_graph.nodes[b][block_geoid_col])
@@ -0,0 +1,319 @@
+from plan_metrics import PlanMetrics
+from record_chains import ChainRecorder, TREE_ENGINES
+from graph_cache import load_graph
+from gerrychain import Graph, MarkovChain, Election, constraints, accept
+from gerrychain.updaters import Tally
+from gerrychain.tree import bipartition_tree
+from pcompress import Replay
+from configuration import SUPPORTED_METRICS
+import networkx as nx
+import numpy as np
+import subprocess
+import tempfile
+import platform
+import resource
+import argparse
+import datetime
+import random
+import shutil
+import time
+import json
+import sys
+
+## Column names follow the bundled Virginia dual graph, so the defaults work for both kinds of graph.
+POP_COL = "TOTPOP20"
+COUNTY_COL = "COUNTY"
+MUNICIPALITY_COL = "MUNI"
+DEMOGRAPHIC_COLS = ["TOTPOP20", "VAP20", "BVAP20", "HVAP20"]
+ELECTIONS = ["PRS16:G16DPRS:G16RPRS", "GOV17:G17DGOV:G17RGOV", "SEN18:G18DSEN:G18RSEN"]
+
+
+def synthetic_graph(size, county_size=5, municipality_size=2, seed=0):
+    """
+    A `size` x `size` grid dual graph, with nodes labelled 0..n-1 (so plans can be recorded and
+    replayed), integer populations, counties of `county_size` x `county_size` cells,
+    municipalities of `municipality_size` x `municipality_size` cells (a tenth of the nodes
+    outside of any, marked '99999') and, for every default election, Democratic and Republican
+    votes that trend from one corner of the grid to the other.
+    """
+    rng = random.Random(seed)
+    grid = nx.grid_graph([size, size])
+    graph = Graph(nx.convert_node_labels_to_integers(grid, label_attribute="cell"))
+    for n in graph.nodes:
+        data = graph.nodes[n]
+        x, y = data.pop("cell")
+        data[POP_COL] = rng.randint(50, 150)
+        data["VAP20"] = int(data[POP_COL] * rng.uniform(0.7, 0.85))
+        data["BVAP20"] = int(data["VAP20"] * rng.uniform(0, 0.4))
+        data["HVAP20"] = int(data["VAP20"] * rng.uniform(0, 0.2))
+        data[COUNTY_COL] = "{:03d}".format((x // county_size) * (size // county_size + 1) + y // county_size)
+        data[MUNICIPALITY_COL] = "99999" if rng.random() < 0.1 else \
+                                 "{}-{}-{}".format(data[COUNTY_COL], x // municipality_size, y // municipality_size)
+        lean = (x + y) / (2 * size)
+        for election in ELECTIONS:
+            _, dem_col, rep_col = election.split(":")
+            turnout = int(data["VAP20"] * rng.uniform(0.4, 0.7))
+            data[dem_col] = int(turnout * min(max(rng.gauss(0.3 + 0.4 * lean, 0.1), 0), 1))
+            data[rep_col] = turnout - data[dem_col]
+    return graph
+
+
+def proc_status_mb(field):
+    """
+    A memory field of /proc/self/status (e.g. "VmHWM"), in MB, or None without /proc.
+    """
+    try:
+        with open("/proc/self/status") as fin:
+            for line in fin:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def begin_phase():
+    """
+    Resets the process's peak resident set size where the OS allows it (Linux), so that
+    `peak_rss_mb` is the peak of the phase that starts.  Returns the resident set size now, in MB
+    (None without /proc), for the phase's growth.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fout:
+            fout.write("5")
+    except OSError:
+        pass
+    return proc_status_mb("VmRSS")
+
+
+def peak_rss_mb():
+    """
+    The process's peak resident set size since the last `begin_phase`, in MB, or without /proc,
+    the peak of the whole process so far.
+    """
+    peak = proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+    """
+    Times chain generation, bipartitioning and scoring on one dual graph.  Every phase seeds the
+    random number generators first, so a phase makes the same moves on every run.
+    """
+    def __init__(self, graph, num_districts, epsilon, elections=ELECTIONS, pop_col=POP_COL, county_col=COUNTY_COL,
+                 municipality_col=MUNICIPALITY_COL, demographic_cols=DEMOGRAPHIC_COLS, seed=2022, tree_engine="networkx") -> None:
+        self.graph = graph
+        self.num_districts = num_districts
+        self.epsilon = epsilon
+        self.pop_col = pop_col
+        self.county_col = county_col
+        self.seed = seed
+        self.tree_engine = tree_engine
+        data = next(iter(graph.nodes.values()))
+        self.municipality_col = municipality_col if municipality_col in data else None
+        self.demographic_cols = [col for col in demographic_cols if col in data]
+        self.election_updaters = {}
+        for election in elections:
+            name, dem_col, rep_col = election.split(":")
+            self.election_updaters[name] = Election(name, {"Democratic": dem_col, "Republican": rep_col})
+        metric_ids = [m for m, kind in SUPPORTED_METRICS.items() if kind != "district_level" and
+                      (self.municipality_col is not None or "municipal" not in m) and "bunked" not in m]
+        self.metrics = [{"id": col, "name": col, "type": SUPPORTED_METRICS["col_tally"]} for col in self.demographic_cols] + \
+                       [{"id": m, "name": m, "type": SUPPORTED_METRICS[m]} for m in metric_ids]
+        self.results = {}
+
+    def seed_generators(self):
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+
+    def recorder(self, output_dir):
+        recorder = ChainRecorder(self.graph, output_dir, self.pop_col, self.county_col, tree_engine=self.tree_engine)
+        recorder.updaters.update({**self.election_updaters,
+                                  **{col: Tally(col, alias=col) for col in self.demographic_cols}})
+        return recorder
+
+    def phase(self, name, start_rss, **results):
+        """
+        Saves the results of phase `name`, with its peak memory and how much the resident set grew
+        from `start_rss` (see `begin_phase`).
+        """
+        results["peak_rss_mb"] = peak_rss_mb()
+        rss = proc_status_mb("VmRSS")
+        results["rss_growth_mb"] = None if rss is None or start_rss is None else rss - start_rss
+        self.results[name] = results
+        return results
+
+    def setup(self):
+        start_rss = begin_phase()
+        start = time.perf_counter()
+        self.scores = PlanMetrics(self.graph, list(self.election_updaters), "Democratic", self.pop_col, self.metrics,
+                                  county_col=self.county_col, demographic_cols=self.demographic_cols,
+                                  updaters=self.election_updaters, municipality_col=self.municipality_col)
+        self.seed_generators()
+        self.initial_partition = self.recorder(None)._initial_partition(self.num_districts, self.epsilon)
+        return self.phase("setup", start_rss, seconds=time.perf_counter() - start)
+
+    def chain(self, steps, county_aware=False):
+        """
+        Runs a chain from the initial plan, timing the proposals and the scoring of every plan
+        separately.
+        """
+        start_rss = begin_phase()
+        self.seed_generators()
+        recorder = self.recorder(None)
+        chain = MarkovChain(proposal=recorder._proposal(self.num_districts, self.epsilon, county_aware),
+                            constraints=[constraints.within_percent_of_ideal_population(self.initial_partition, self.epsilon)],
+                            accept=accept.always_accept, initial_state=self.initial_partition, total_steps=steps)
+        chain_seconds, scoring_seconds = 0, 0
+        plans = iter(chain)
+        for _ in range(steps):
+            start = time.perf_counter()
+            part = next(plans)
+            chain_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            json.dumps(self.scores.plan_summary(part))
+            scoring_seconds += time.perf_counter() - start
+        return self.phase("{}_chain".format("county_aware" if county_aware else "neutral"), start_rss, steps=steps,
+                          chain_seconds=chain_seconds, steps_per_second=steps / chain_seconds,
+                          scoring_seconds=scoring_seconds, plans_scored_per_second=steps / scoring_seconds)
+
+    def bipartition(self, calls, county_aware=True):
+        """
+        Times the chain's bipartition method (e.g. `division_bipartition_tree`) on the union of the
+        initial plan's first two adjacent districts, as ReCom would call it.
+        """
+        start_rss = begin_phase()
+        self.seed_generators()
+        part = self.initial_partition
+        # ReCom only merges adjacent districts, so take the first adjacent pair.
+        districts = min(sorted((part.assignment[u], part.assignment[v])) for u, v in part["cut_edges"])
+        subgraph = self.graph.subgraph(part.parts[districts[0]] | part.parts[districts[1]])
+        pop_target = sum(part["population"][d] for d in districts) / 2
+        method = self.recorder(None)._bipartition_method(county_aware) or bipartition_tree
+        start = time.perf_counter()
+        for _ in range(calls):
+            method(subgraph, pop_col=self.pop_col, pop_target=pop_target, epsilon=self.epsilon)
+        seconds = time.perf_counter() - start
+        return self.phase("bipartition", start_rss, calls=calls, nodes=len(subgraph), seconds=seconds, calls_per_second=calls / seconds)
+
+    def record_and_replay(self, steps, county_aware=False):
+        """
+        Times `ChainRecorder.record_chain`, then replaying and scoring the recorded chain, as
+        `run_ensemble.py` and `collect_scores.py` do.  Needs the pcompress binary.
+        """
+        start_rss = begin_phase()
+        output_dir = tempfile.mkdtemp()
+        try:
+            self.seed_generators()
+            start = time.perf_counter()
+            self.recorder(output_dir).record_chain(self.num_districts, self.epsilon, steps, "benchmark.chain",
+                                                   county_aware=county_aware, initial_partition=self.initial_partition)
+            record_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            num_plans = 0
+            for part in Replay(self.graph, "{}/benchmark.chain".format(output_dir),
+                               {**self.election_updaters, **{col: Tally(col, alias=col) for col in self.demographic_cols}}):
+                json.dumps(self.scores.plan_summary(part))
+                num_plans += 1
+            replay_seconds = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_dir)
+        return self.phase("record_and_replay", start_rss, steps=steps, record_seconds=record_seconds,
+                          recorded_steps_per_second=steps / record_seconds, plans=num_plans,
+                          replay_and_score_seconds=replay_seconds, plans_replayed_and_scored_per_second=num_plans / replay_seconds)
+
+
+def compare(results, baseline):
+    """
+    Prints the ratio of every throughput in `results` to the same throughput in `baseline`.
+    """
+    for phase, values in results["phases"].items():
+        for key, value in values.items():
+            if key.endswith("per_second") and key in baseline["phases"].get(phase, {}):
+                print("{:>20} {:>36}: {:8.2f} vs {:8.2f} ({:.2f}x)".format(phase, key, value, baseline["phases"][phase][key],
+                                                                           value / baseline["phases"][phase][key]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chain and Scoring Benchmark",
+                                     prog="benchmark.py")
+    parser.add_argument("--dual_graph", type=str, default=None,
+                        help="Dual graph to benchmark on (e.g. dual_graphs/va_vtds_0_indexed.json).  Default is a synthetic grid.")
+    parser.add_argument("--grid_size", type=int, default=40,
+                        help="Side length of the synthetic grid. (default 40)")
+    parser.add_argument("--county_size", type=int, default=5,
+                        help="Side length of the synthetic grid's counties. (default 5)")
+    parser.add_argument("--districts", type=int, default=11,
+                        help="Number of districts. (default 11)")
+    parser.add_argument("--epsilon", type=float, default=0.02,
+                        help="Population deviation allowed. (default 0.02)")
+    parser.add_argument("--steps", type=int, default=200,
+                        help="Steps of each chain. (default 200)")
+    parser.add_argument("--bipartitions", type=int, default=50,
+                        help="Number of timed bipartition calls. (default 50)")
+    parser.add_argument("--seed", type=int, default=2022,
+                        help="Seed of the graph and chains. (default 2022)")
+    parser.add_argument("--pop_col", type=str, default=POP_COL)
+    parser.add_argument("--county_col", type=str, default=COUNTY_COL)
+    parser.add_argument("--municipal_col", type=str, default=MUNICIPALITY_COL,
+                        help="Municipality column, ignored if the graph doesn't have it.")
+    parser.add_argument("--demographic_cols", type=str, nargs="*", default=DEMOGRAPHIC_COLS,
+                        help="Columns to tally, ignored if the graph doesn't have them.")
+    parser.add_argument("--elections", type=str, nargs="*", default=ELECTIONS,
+                        help="Elections to score, as name:democratic_col:republican_col.")
+    parser.add_argument("--record", action='store_const', const=True, default=False,
+                        help="Also time recording a chain to a file and replaying it (needs pcompress)? (default False)")
+    parser.add_argument("--output", type=str, default="benchmark_results.json",
+                        help="Where to save the results as JSON. (default benchmark_results.json)")
+    parser.add_argument("--tree_engine", type=str, choices=TREE_ENGINES, default="networkx",
+                        help="Spanning tree engine of the chains and bipartitions. (default networkx)")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="Results JSON of an earlier run to compare the throughputs with.")
+    args = parser.parse_args()
+
+    start_rss = begin_phase()
+    start = time.perf_counter()
+    if args.dual_graph is None:
+        graph = synthetic_graph(args.grid_size, county_size=args.county_size, seed=args.seed)
+    else:
+        graph = load_graph(args.dual_graph)
+    load_seconds = time.perf_counter() - start
+
+    benchmark = Benchmark(graph, args.districts, args.epsilon, elections=args.elections, pop_col=args.pop_col,
+                          county_col=args.county_col, municipality_col=args.municipal_col,
+                          demographic_cols=args.demographic_cols, seed=args.seed, tree_engine=args.tree_engine)
+    benchmark.phase("load", start_rss, seconds=load_seconds, nodes=len(graph.nodes), edges=len(graph.edges))
+    benchmark.setup()
+    benchmark.chain(args.steps)
+    benchmark.chain(args.steps, county_aware=True)
+    benchmark.bipartition(args.bipartitions)
+    if args.record:
+        if shutil.which("pcompress") is None:
+            print("pcompress is not on the PATH; skipping record_and_replay")
+        else:
+            benchmark.record_and_replay(args.steps)
+
+    results = {
+        "config": vars(args),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "phases": benchmark.results,
+    }
+    with open(args.output, "w") as fout:
+        json.dump(results, fout, indent=2)
+    print(json.dumps(results["phases"], indent=2))
+    if args.compare is not None:
+        with open(args.compare) as fin:
+            compare(results, json.load(fin))
@@ -0,0 +1,236 @@
+from chain_io import chain_deltas
+from gerrychain import Partition
+import numpy as np
+import argparse
+import json
+import os
+
+HEADER_FILE = "header.json"
+NODE_DTYPE = np.int32
+DISTRICT_DTYPE = np.int16
+
+
+def index_path(chain_path):
+    """
+    Where the index of the chain at `chain_path` lives.
+    """
+    base = chain_path[:-len(".chain")] if chain_path.endswith(".chain") else chain_path
+    return base + ".index"
+
+
+class ChainIndexWriter:
+    """
+    Writes a seekable index of a chain as a directory of arrays:
+        `offsets.npy`   (steps + 1), where step k's flips are `[offsets[k], offsets[k + 1])`
+        `nodes.npy`, `districts.npy`   the node positions flipped at each step and their new districts
+        `snapshots.npy` (steps // snapshot_every + 1) x nodes, the full assignment at every
+                        `snapshot_every`-th step
+    plus `header.json`, which lists the chain's district labels.  Step 0 flips every node.  Flips are appended to raw files as they come,
+    which become `.npy` files when the writer is closed.
+    """
+    def __init__(self, path, num_nodes, snapshot_every=100) -> None:
+        self.path = path
+        self.num_nodes = num_nodes
+        self.snapshot_every = snapshot_every
+        self.assignment = np.zeros(num_nodes, dtype=DISTRICT_DTYPE)
+        self.offsets = [0]
+        self.districts = set()
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(self._raw_path(name), "wb") for name in ["nodes", "districts", "snapshots"]}
+
+    def _raw_path(self, name):
+        return "{}/{}.raw".format(self.path, name)
+
+    def add_flips(self, nodes, districts):
+        """
+        Appends a step that moves the node positions `nodes` to `districts`.
+        """
+        nodes = np.asarray(nodes, dtype=NODE_DTYPE)
+        districts = np.asarray(districts, dtype=DISTRICT_DTYPE)
+        self.assignment[nodes] = districts
+        self.districts.update(np.unique(districts).tolist())
+        nodes.tofile(self.files["nodes"])
+        districts.tofile(self.files["districts"])
+        if (len(self.offsets) - 1) % self.snapshot_every == 0:
+            self.assignment.tofile(self.files["snapshots"])
+        self.offsets.append(self.offsets[-1] + len(nodes))
+
+    def add_delta(self, delta):
+        """
+        Appends a step given as `chain_io.chain_deltas` yields it: for each district, the nodes
+        that moved into it.
+        """
+        self.add_flips([node for nodes in delta for node in nodes],
+                       [district for district, nodes in enumerate(delta) for _ in nodes])
+
+    def add_partition(self, part, previous=None):
+        """
+        Appends a step of a chain of partitions, given the previous step's partition.  Uses the
+        partition's flips when it was proposed from `previous`, and is empty when the chain
+        stayed at `previous`.  Assumes the graph's nodes are labelled 0..n-1.
+        """
+        if part is previous:
+            return self.add_flips([], [])
+        if previous is not None and part.parent is previous and part.flips is not None:
+            flips = part.flips
+        else:
+            flips = dict(part.assignment)
+        self.add_flips(list(flips.keys()), list(flips.values()))
+
+    def close(self):
+        for fout in self.files.values():
+            fout.close()
+        num_steps = len(self.offsets) - 1
+        shapes = {"nodes": (-1,), "districts": (-1,), "snapshots": (-1, self.num_nodes)}
+        dtypes = {"nodes": NODE_DTYPE, "districts": DISTRICT_DTYPE, "snapshots": DISTRICT_DTYPE}
+        for name, shape in shapes.items():
+            np.save("{}/{}.npy".format(self.path, name), np.fromfile(self._raw_path(name), dtype=dtypes[name]).reshape(shape))
+            os.remove(self._raw_path(name))
+        np.save("{}/offsets.npy".format(self.path), np.array(self.offsets, dtype=np.int64))
+        with open("{}/{}".format(self.path, HEADER_FILE), "w") as fout:
+            json.dump({"num_steps": num_steps, "num_nodes": self.num_nodes, "num_districts": len(self.districts),
+                       "districts": sorted(self.districts), "snapshot_every": self.snapshot_every}, fout)
+
+
+class ChainIndex:
+    """
+    Random access to the steps of an indexed chain.  Step k's assignment is the nearest snapshot
+    at or before k with at most `snapshot_every - 1` steps of flips applied, all read from
+    memory-mapped arrays, so no step of the compressed chain is decoded.
+    """
+    def __init__(self, path) -> None:
+        with open("{}/{}".format(path, HEADER_FILE)) as fin:
+            self.header = json.load(fin)
+        # Indexes written before the labels were stored numbered their districts 0..k-1.
+        self.districts = self.header.get("districts", list(range(self.header["num_districts"])))
+        self.num_districts = len(self.districts)
+        self.snapshot_every = self.header["snapshot_every"]
+        self.arrays = {name: np.load("{}/{}.npy".format(path, name), mmap_mode="r")
+                       for name in ["offsets", "nodes", "districts", "snapshots"]}
+
+    def __len__(self):
+        return self.header["num_steps"]
+
+    def flips(self, step):
+        """
+        (node positions, districts) flipped at `step`.
+        """
+        start, stop = self.arrays["offsets"][step:step + 2]
+        return self.arrays["nodes"][start:stop], self.arrays["districts"][start:stop]
+
+    def _advance(self, assignment, start, stop):
+        """
+        Applies the flips of steps `(start, stop]` to `assignment`.
+        """
+        first, last = self.arrays["offsets"][start + 1], self.arrays["offsets"][stop + 1]
+        assignment[self.arrays["nodes"][first:last]] = self.arrays["districts"][first:last]
+
+    def assignment(self, step):
+        """
+        The district of every node position at `step`.
+        """
+        if not 0 <= step < len(self):
+            raise IndexError("Step {} is outside of the chain's {} steps".format(step, len(self)))
+        snapshot = step // self.snapshot_every
+        assignment = np.array(self.arrays["snapshots"][snapshot], dtype=np.int64)
+        self._advance(assignment, snapshot * self.snapshot_every, step)
+        return assignment
+
+    def assignments(self, steps):
+        """
+        Yields (step, assignment) for the increasing `steps`, moving forward from the previous
+        step rather than from a snapshot when that's closer.  The yielded array is reused.
+        """
+        assignment, current = None, None
+        for step in steps:
+            if current is None or step // self.snapshot_every > current // self.snapshot_every or step < current:
+                assignment = self.assignment(step)
+            else:
+                self._advance(assignment, current, step)
+            current = step
+            yield step, assignment
+
+    def partition(self, graph, assignment, updaters=None):
+        """
+        The partition with `assignment`, with its districts in the same order as in a replay of
+        the chain.  Assumes the graph's nodes are labelled 0..n-1.
+        """
+        order = np.argsort(assignment, kind="stable")
+        starts = np.searchsorted(assignment[order], self.districts, side="left")
+        stops = np.searchsorted(assignment[order], self.districts, side="right")
+        flips = {}
+        for district, start, stop in zip(self.districts, starts.tolist(), stops.tolist()):
+            flips.update(dict.fromkeys(order[start:stop].tolist(), district))
+        return Partition(graph, flips, updaters)
+
+    def partitions(self, graph, steps, updaters=None, chained=True):
+        """
+        Yields the partitions of the chain at the increasing `steps`.  Each partition is a flip of
+        the previous one by the nodes whose district changed in between, so that updaters and
+        `IncrementalPlanMetrics` are updated rather than recomputed, and a step that repeats the
+        previous one has no flips.  With `chained=False`, only the repeated steps are flips, and
+        every other partition is built from its assignment, so updaters that sum fractional values
+        don't depend on which steps were read before it.
+        """
+        part, previous = None, None
+        for _, assignment in self.assignments(steps):
+            if part is None:
+                part = self.partition(graph, assignment, updaters)
+            else:
+                changed = np.flatnonzero(assignment != previous)
+                if len(changed) == 0 or chained:
+                    part = part.flip(dict(zip(changed.tolist(), assignment[changed].tolist())))
+                    part.parent.parent = None
+                else:
+                    part = self.partition(graph, assignment, updaters)
+            previous = assignment.copy()
+            yield part
+
+
+def build_index(chain_path, path=None, snapshot_every=100):
+    """
+    Indexes a recorded chain, decoding it once.
+    """
+    path = index_path(chain_path) if path is None else path
+    writer = None
+    for delta in chain_deltas(chain_path):
+        if writer is None:
+            writer = ChainIndexWriter(path, sum(map(len, delta)), snapshot_every=snapshot_every)
+        writer.add_delta(delta)
+    writer.close()
+    return path
+
+
+def load_chain_index(chain_path):
+    """
+    The `ChainIndex` of the chain at `chain_path`, or None if it hasn't been indexed (or the
+    index is older than the chain).
+    """
+    path = index_path(chain_path)
+    if not os.path.exists("{}/{}".format(path, HEADER_FILE)) or \
+       os.path.getmtime("{}/{}".format(path, HEADER_FILE)) < os.path.getmtime(chain_path):
+        return None
+    return ChainIndex(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chain Indexer",
+                                     prog="chain_index.py")
+    parser.add_argument("chains", metavar="chain paths", type=str, nargs="+",
+                        help="Chains to index, or with --step, the indexed chain to read.")
+    parser.add_argument("--snapshot_every", type=int, default=100,
+                        help="Steps between full assignment snapshots. (default 100)")
+    parser.add_argument("--step", type=int, default=None,
+                        help="Instead of indexing, print the assignment at this step (node,district CSV).")
+    args = parser.parse_args()
+
+    if args.step is not None:
+        index = load_chain_index(args.chains[0])
+        if index is None:
+            raise FileNotFoundError("{} has no up-to-date index".format(args.chains[0]))
+        print("node,district")
+        for node, district in enumerate(index.assignment(args.step).tolist()):
+            print("{},{}".format(node, district))
+    else:
+        for chain_path in args.chains:
+            print(build_index(chain_path, snapshot_every=args.snapshot_every))
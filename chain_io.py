@@ -0,0 +1,103 @@
+from gerrychain import Partition
+import numpy as np
+import multiprocessing
+import subprocess
+import shlex
+import json
+import os
+
+
+def chain_deltas(chain_path, threads=None):
+    """
+    Yields the raw steps of a chain recorded with `pcompress.Record`: for each step, a list indexed
+    by district of the nodes that moved into that district (every node, for the first step).
+    This is the stream `pcompress.Replay` reads, without building a partition for every step.
+    """
+    threads = threads if threads is not None else multiprocessing.cpu_count()
+    child = subprocess.Popen(f"/bin/bash -c 'cat {chain_path} | unxz -T {threads} | pcompress -d --diff'",
+                             shell=True, stdout=subprocess.PIPE)
+    try:
+        for line in child.stdout:
+            yield json.loads(line)
+    finally:
+        child.terminate()
+        child.wait()
+
+
+def delta_flips(delta):
+    return {node: district for district, nodes in enumerate(delta) for node in nodes}
+
+
+def apply_delta(assignment, delta):
+    for district, nodes in enumerate(delta):
+        assignment[nodes] = district
+
+
+def replay_range(graph, chain_path, start=0, stop=None, updaters=None):
+    """
+    Yields the partitions for steps `start` up to (not including) `stop` of a chain, as
+    `pcompress.Replay` would.  Steps before `start` are only applied to an assignment array, so
+    fast-forwarding is cheap compared to replaying (and updating) a partition for every step.
+    Assumes, like `Replay`, that the graph's nodes are labelled 0..n-1.
+    """
+    assignment = np.zeros(len(graph.nodes), dtype=np.int64)
+    part = None
+    for step, delta in enumerate(chain_deltas(chain_path)):
+        if stop is not None and step >= stop:
+            break
+        if part is not None:
+            part = part.flip(delta_flips(delta))
+            part.parent.parent = None
+        elif step == start:
+            if step > 0:
+                apply_delta(assignment, delta)
+                # Group nodes by district, matching the district order of a replay from step 0.
+                delta = [np.flatnonzero(assignment == district).tolist() for district in range(num_districts)]
+            part = Partition(graph, delta_flips(delta), updaters)
+        else:
+            if step == 0:
+                num_districts = len(delta)
+            apply_delta(assignment, delta)
+            continue
+        yield part
+
+
+def chain_set_files(chain_file, num_chains):
+    """
+    The file names of the `num_chains` chains of a chain set recorded in place of `chain_file`.
+    """
+    base = chain_file[:-len(".chain")] if chain_file.endswith(".chain") else chain_file
+    return ["{}_{}.chain".format(base, i) for i in range(num_chains)]
+
+
+def manifest_path(chain_path):
+    """
+    Where the manifest of the chain set recorded in place of `chain_path` lives.
+    """
+    base = chain_path[:-len(".chain")] if chain_path.endswith(".chain") else chain_path
+    return base + ".manifest.json"
+
+
+def load_chain_set(chain_path):
+    """
+    The manifest of the chain set recorded in place of `chain_path`, with the chains' paths under
+    "chain_paths", or None if there's no such set.
+    """
+    path = manifest_path(chain_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fin:
+        manifest = json.load(fin)
+    manifest["chain_paths"] = [os.path.join(os.path.dirname(path), chain_file) for chain_file in manifest["chains"]]
+    return manifest
+
+
+def concatenate_chains(chain_paths, output_path, threads=None):
+    """
+    Writes the steps of the chains at `chain_paths`, one after the other, as one chain, by
+    decoding them to full assignments and encoding those again as `pcompress.Record` does.
+    """
+    threads = threads if threads is not None else multiprocessing.cpu_count()
+    decode = "; ".join(f"unxz -T {threads} < {shlex.quote(path)} | pcompress -d" for path in chain_paths)
+    subprocess.run(["/bin/bash", "-c", f"set -o pipefail; ({decode}) | pcompress -e | xz -e -T {threads} > {shlex.quote(output_path)}"],
+                   check=True)
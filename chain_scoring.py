@@ -0,0 +1,112 @@
+from scoring_service import StateScorer
+from gerrychain import Partition
+import multiprocessing
+import numpy as np
+import queue
+import json
+import gzip
+
+NODE_DTYPE = np.int32
+DISTRICT_DTYPE = np.int16
+
+
+class ChainScorer:
+    """
+    Scores the plans of a chain as it runs, in a separate process, writing the ensemble stats
+    `jsonl.gz` that `collect_scores.py` would write for the recorded chain.  The chain passes
+    each step to `add_partition`; the steps' flips are sent to the scoring process in batches of
+    `batch_size` through a queue of at most `queue_size` batches, so the chain only waits when
+    the scorer falls that far behind.  The scoring process replays the flips like `Replay` and
+    writes the previous plan's scores again for steps that repeat it.
+
+    The process is forked, so it shares the graph (and the state specification) with the chain
+    without pickling them.
+    """
+    def __init__(self, graph, state_specification, plan_type, output_path, epsilon, method, incremental=False,
+                 batch_size=100, queue_size=20) -> None:
+        self.graph = graph
+        self.node_index = {n: i for i, n in enumerate(graph.nodes)}
+        self.batch_size = batch_size
+        self.batch = []
+        self.queue = multiprocessing.get_context("fork").Queue(queue_size)
+        self.process = multiprocessing.get_context("fork").Process(
+            target=score_stream, args=(self.queue, graph, state_specification, plan_type, output_path, epsilon,
+                                       method, incremental))
+        self.process.start()
+
+    def add_partition(self, part, previous=None):
+        """
+        Queues a step of the chain, given the previous step's partition (see
+        `ChainIndexWriter.add_partition`).
+        """
+        if part is previous:
+            flips = {}
+        elif previous is not None and part.parent is previous and part.flips is not None:
+            flips = part.flips
+        else:
+            flips = dict(part.assignment)
+        self.batch.append((np.fromiter((self.node_index[n] for n in flips), dtype=NODE_DTYPE, count=len(flips)),
+                           np.fromiter(flips.values(), dtype=DISTRICT_DTYPE, count=len(flips))))
+        if len(self.batch) >= self.batch_size:
+            self._put(self.batch)
+            self.batch = []
+
+    def _put(self, item):
+        while True:
+            try:
+                return self.queue.put(item, timeout=1)
+            except queue.Full:
+                if not self.process.is_alive():
+                    raise RuntimeError("The scoring process exited with code {}".format(self.process.exitcode))
+
+    def close(self):
+        """
+        Waits for the scoring process to score every queued step.
+        """
+        if self.batch:
+            self._put(self.batch)
+            self.batch = []
+        self._put(None)
+        self.process.join()
+        if self.process.exitcode != 0:
+            raise RuntimeError("The scoring process exited with code {}".format(self.process.exitcode))
+
+    def terminate(self):
+        """
+        Stops the scoring process without scoring the queued steps, for a chain that failed.
+        """
+        self.process.terminate()
+        self.process.join()
+        # Steps still buffered for the queue would otherwise keep the interpreter from exiting.
+        self.queue.cancel_join_thread()
+
+
+def score_stream(steps, graph, state_specification, plan_type, output_path, epsilon, method, incremental):
+    """
+    The scoring process: reads batches of (node positions, districts) steps from the queue
+    `steps` until it gets None.
+    """
+    scorer = StateScorer(state_specification, plan_type, graph=graph, geoid_col=None, incremental=incremental)
+    scores = scorer.scores
+    nodes = list(graph.nodes)
+    part, plan_details = None, None
+    with gzip.open(output_path, "wt") as fout:
+        for batch in iter(steps.get, None):
+            for positions, districts in batch:
+                if part is None:
+                    # Order the nodes by district, then position, as a replay reads them.
+                    order = np.lexsort((positions, districts))
+                    part = Partition(graph, {nodes[i]: int(d) for i, d in zip(positions[order].tolist(), districts[order].tolist())},
+                                     scorer.updaters)
+                    fout.write(json.dumps(scores.summary_data(scorer.elections, districts=part.parts.keys(),
+                                                              epsilon=epsilon, method=method)) + "\n")
+                else:
+                    part = part.flip({nodes[i]: d for i, d in zip(positions.tolist(), districts.tolist())})
+                    part.parent.parent = None
+                if part.parent is not None and not part.flips:
+                    if incremental:
+                        scores.update(part)
+                    fout.write(plan_details)
+                    continue
+                plan_details = json.dumps(scores.plan_summary(part)) + "\n"
+                fout.write(plan_details)
@@ -1,102 +1,325 @@
-from plan_metrics import PlanMetrics
-from gerrychain import Graph, Election
-from gerrychain.updaters import Tally
+from plan_metrics import PlanMetrics, IncrementalPlanMetrics, MetricTimer, timing_path
 from tqdm import tqdm
 from pcompress import Replay
+from chain_io import chain_deltas, replay_range, load_chain_set
+from chain_index import load_chain_index
+from graph_cache import load_graph
+from columnar_stats import ColumnarStatsWriter, columnar_path, jsonl_to_columnar
+from shared_graph import SharedGraph
+from scoring_specification import ScoringSpecification
+import multiprocessing
+import itertools
 import argparse
+import shutil
 import json
 import gzip
-import warnings
+import os
 from configuration import *
 
-SUPPORTED_METRIC_IDS = list(SUPPORTED_METRICS.keys())
-
 parser = argparse.ArgumentParser(description="VTD Ensemble Scorer", 
                                  prog="collect_scores.py")
 parser.add_argument("st", metavar="state", type=str,
                     choices=SUPPORTED_STATES,
                     help="Which state to run the ensemble on?")
-parser.add_argument("map", metavar="map", type=str,
+parser.add_argument("map", metavar="map", type=str, nargs="+",
                     choices=SUPPORTED_PLAN_TYPES,
-                    help="the map to redistrict")
+                    help="the map(s) to redistrict.  The chains of every map are scored against one loaded graph.")
 parser.add_argument("n", metavar="iterations", type=int,
                     help="the number of steps to take")
 parser.add_argument("--county_aware", action='store_const', const=True, default=False,
                     dest="county_aware",
                     help="Chain builds districts with awareness of counties? (default False)")
+parser.add_argument("--methods", metavar="method", type=str, nargs="+", default=None,
+                    choices=["neutral", "county_aware"],
+                    help="Score the chains of each of these methods (e.g. --methods neutral county_aware). \
+                          Defaults to the method picked by --county_aware.")
 parser.add_argument('--verbose', '-v', action='count', default=0)
 parser.add_argument("--sub_sample", metavar="stride length", default=1, type=int, 
                     help="Stride length for sub-sampling the plan. Default is not to sub-sample.")
+parser.add_argument("--incremental", action='store_const', const=True, default=False,
+                    help="Update the split and traversal metrics and the district tallies from each step's flips instead of recomputing them? (default False)")
+parser.add_argument("--workers", metavar="num workers", default=1, type=int,
+                    help="Score contiguous ranges of the chain in this many processes and merge them. Default is 1 (serial). \
+                          Float-valued tally columns may differ from a serial run in the last digits at range starts.")
+parser.add_argument("--columnar", action='store_const', const=True, default=False,
+                    help="Also write the scores as memory-mappable arrays (see columnar_stats.py) next to the jsonl.gz? (default False)")
+parser.add_argument("--profile", action='store_const', const=True, default=False,
+                    help="Time each metric, the replay and the serialization, and write the totals to a .timing.json \
+                          file next to the jsonl.gz? (default False)")
 args = parser.parse_args()
 
 ## Read in args and state specifications
 state = args.st
-plan_type = args.map
+plan_types = args.map
 steps = args.n
 county_aware = args.county_aware
-method = "county_aware" if county_aware else "neutral"
+methods = args.methods if args.methods is not None else ["county_aware" if county_aware else "neutral"]
 how_verbose = args.verbose
 stride_len = args.sub_sample
+incremental = args.incremental
+num_workers = args.workers
+columnar = args.columnar
+profile = args.profile
 
 with open("{}/{}.json".format(STATE_SPECS_DIR, state)) as fin:
     state_specification = json.load(fin)
 
-k = state_specification["districts"][plan_type]
-eps = state_specification["epsilons"][plan_type]
 dual_graph_file = "{}/{}".format(DUAL_GRAPH_DIR, state_specification["dual_graph"])
 pop_col = state_specification["pop_col"]
 county_col = state_specification["county_col"]
 party = state_specification["pov_party"]
 elections = state_specification["elections"]
-demographic_cols = [m["id"] for m in state_specification["metrics"] if "type" in m and m["type"] == "col_tally"]
-state_metric_ids = set([m["id"] for m in state_specification["metrics"] if "type" not in m or m["type"] != "col_tally"])
-state_metrics = [{**m, "type": SUPPORTED_METRICS["col_tally"]} if ("type" in m and m["type"] == "col_tally") \
-                                                               else {**m, "type": SUPPORTED_METRICS[m["id"]]} \
-                    for m in filter(lambda m: m["id"] in SUPPORTED_METRIC_IDS or ("type" in m and m["type"] == "col_tally"), 
-                                    state_specification["metrics"])]
-municipality_col = state_specification["municipal_col"] if "num_municipal_pieces" in state_metric_ids or "num_split_municipalities" in state_metric_ids else None
-incumbent_col = state_specification["incumbent_cols"][plan_type] if "num_double_bunked" in state_metric_ids or "num_zero_bunked" in state_metric_ids else None
-
-if len(state_metric_ids - set(SUPPORTED_METRIC_IDS)) > 0:
-    warnings.warn("Some state metrics are not supported.  Will continue without tracking them.\n.\
-                  Unsupported metrics: {}".format(str(state_metric_ids - set(SUPPORTED_METRIC_IDS))))
-
-# path_long = "mi_chains/mi_cong_0.01_bal_10000_steps_non_county_aware.chain"
-chain_path = "{}/{}/{}_{}_{}_bal_{}_steps_{}.chain".format(state, CHAIN_DIR, state.lower(), plan_type,
-                                                           eps, steps, method)
-output_path = "{}/{}/{}_{}_{}_bal_{}_steps_{}.jsonl.gz".format(state, STATS_DIR, state.lower(), plan_type,
-                                                           eps, steps, method)
-
-election_names = [e["name"] for e in elections]
-## sort candidates alphabetically so that the "first" party is consistent.
-election_updaters = {e["name"]: Election(e["name"], {c["name"]: c["key"] for c in sorted(e["candidates"], 
-                                                                                         key=lambda c: c["name"])})
-                    for e in elections}
-demographic_updaters = {demo_col: Tally(demo_col, alias=demo_col) for demo_col in demographic_cols + [incumbent_col]}
-
-graph = Graph.from_json(dual_graph_file)
-
-scores = PlanMetrics(graph, election_names, party, pop_col, state_metrics, updaters=election_updaters, 
-                     county_col=county_col, demographic_cols=demographic_cols,
-                     municipality_col=municipality_col, incumbent_col=incumbent_col)
-
-with gzip.open(output_path, "wt") as fout:
-    plan_generator = Replay(graph, chain_path, {**demographic_updaters, **election_updaters})
-    part = next(plan_generator)
-    header = json.dumps(scores.summary_data(elections, districts=part.parts.keys(), epsilon=eps, method=method)) + "\n"
-    plan_details = json.dumps(scores.plan_summary(part)) + "\n"
-    fout.write(header)
-    fout.write(plan_details)
+scoring_spec = ScoringSpecification(state_specification)
+demographic_cols = scoring_spec.demographic_cols
+state_metrics = scoring_spec.state_metrics
+municipality_col = scoring_spec.municipality_col
+track_incumbents = scoring_spec.track_incumbents
+election_names = scoring_spec.election_names
+election_updaters = scoring_spec.election_updaters
+
+graph = load_graph(dual_graph_file)
+scorer = IncrementalPlanMetrics if incremental else PlanMetrics
+chain_index = None
+## Workers read the node attributes from one shared memory block rather than from their own copy of the graph.
+shared = None
+if num_workers > 1:
+    incumbent_cols = [scoring_spec.incumbent_col(plan_type) for plan_type in plan_types] if track_incumbents else []
+    election_cols = [col for e in election_updaters.values() for col in e.columns]
+    shared = SharedGraph.create(graph, numeric_cols=list(dict.fromkeys([pop_col] + demographic_cols + incumbent_cols + election_cols)),
+                                categorical_cols=[county_col] + ([municipality_col] if municipality_col is not None else []))
+
+def whole_sums():
+    """
+    Whether `scores` sums every tally and vote total from whole numbers, which come out the same
+    whatever order the nodes flipped in.  Otherwise some are read from the `Tally` and `Election`
+    updaters, whose fractional totals depend on the plan's path.
+    """
+    return scores.vectorized and scores.vectorized_elections and scores.whole_votes and all(scores.whole_tallies)
+
+def init_worker(spec):
+    """
+    Attaches a scoring worker to the shared graph.  When every metric is computed from the
+    shared columns (and no updater is needed for fractional tallies or votes), plans are
+    replayed over a graph that carries no node attributes at all.
+    """
+    global graph, worker_columns
+    worker_columns = SharedGraph.attach(spec)
+    if whole_sums():
+        graph = worker_columns.to_graph()
 
+def timed_replay(plan_generator):
+    """
+    Yields the plans of `plan_generator`, charging the time taken to produce each one to "replay"
+    when profiling.
+    """
+    plan_generator = iter(plan_generator)
+    while True:
+        with scores._timed("replay"):
+            part = next(plan_generator, None)
+        if part is None:
+            return
+        yield part
+
+def score_plans(plan_generator, fout, first_step=0, columnar_writer=None, steps=None):
+    """
+    Writes the scores of the plans in `plan_generator` (the chain's steps from `first_step` on,
+    or the given `steps`) that fall on the sub-sampling stride to `fout`, and to `columnar_writer`
+    if one is passed.
+    A step without flips (a rejected proposal) repeats the previous plan, so if no step since the
+    last scored plan has flipped a node, its scores are written again instead of recomputed.
+    Returns the number of plans written and how many of them reused the previous scores.
+    """
+    if profile:
+        plan_generator = timed_replay(plan_generator)
     if how_verbose >= 2:
-        for i, part in enumerate(tqdm(plan_generator)):
-            if i % stride_len == stride_len - 1:
-                plan_details = json.dumps(scores.plan_summary(part)) + "\n"
+        plan_generator = tqdm(plan_generator)
+    num_plans, num_reused = 0, 0
+    plan_summary, plan_details = None, None
+    for step, part in zip(steps, plan_generator) if steps is not None else enumerate(plan_generator, start=first_step):
+        if part.parent is None or part.flips:
+            plan_summary = None
+        if step % stride_len == 0:
+            if how_verbose == 1 and step % 100 == 0 and step > 0:
+                print("*", end="", flush=True)
+            num_plans += 1
+            if plan_summary is not None:
+                num_reused += 1
+                with scores._timed("reused_scores"):
+                    if incremental:
+                        scores.update(part)
+                    if columnar_writer is not None:
+                        columnar_writer.write(plan_summary)
+                    fout.write(plan_details)
+                continue
+            plan_summary = scores.plan_summary(part)
+            with scores._timed("serialization"):
+                if columnar_writer is not None:
+                    columnar_writer.write(plan_summary)
+                plan_details = json.dumps(plan_summary) + "\n"
                 fout.write(plan_details)
+        elif incremental:
+            with scores._timed("update"):
+                scores.update(part)
+    return num_plans, num_reused
+
+def report_reuse(chain_path, num_plans, num_reused):
+    if how_verbose >= 1:
+        print("\n{}: reused the previous scores for {} of {} plans ({:.1%}) that repeated the previous plan".format(
+              chain_path, num_reused, num_plans, num_reused / max(num_plans, 1)), flush=True)
+
+def indexed_steps(start, stop):
+    """
+    The steps on the sub-sampling stride in `[start, stop)` of the indexed chain.
+    """
+    stop = len(chain_index) if stop is None else min(stop, len(chain_index))
+    return range(-(-start // stride_len) * stride_len, stop, stride_len)
+
+def score_range(job):
+    """
+    Scores the steps in `[start, stop)` of a chain into a temporary file, fast-forwarding the
+    replay to `start` (or reading the sub-sampled steps from the chain's index).  Returns the
+    file's path, the worker's timer and the plan counts.
+    """
+    chain_path, output_path, start, stop = job
+    range_path = "{}.{}.part".format(output_path, start)
+    updaters = {**demographic_updaters, **election_updaters}
+    with open(range_path, "w") as fout:
+        if chain_index is not None:
+            steps = indexed_steps(start, stop)
+            counts = score_plans(chain_index.partitions(graph, steps, updaters, chained=whole_sums()), fout, steps=steps)
+        else:
+            counts = score_plans(replay_range(graph, chain_path, start, stop, updaters), fout, first_step=start)
+    return range_path, scores.timer, counts
+
+def score_chain(chain_path, output_path, eps, method, in_set=False, num_steps=None):
+    """
+    Scores the chain at `chain_path` (of `num_steps` steps, by default the number passed on the
+    command line) into `output_path` with the current `scores`.  Chains `in_set` leave the
+    columnar copy and the timing file to `score_chain_set`.
+    """
+    global chain_index
+    scores.timer = MetricTimer() if profile else None
+    write_columnar = columnar and not in_set
+    # Sub-sampled chains with an index (see chain_index.py) are read at the sampled steps only, each
+    # sample flipped from the last one, unless the updaters sum fractional tallies or votes (or
+    # the elections aren't vectorized): those totals depend on the order the nodes flipped in, so
+    # the samples are built from scratch and the scores don't depend on how the steps are split
+    # between workers.
+    chain_index = load_chain_index(chain_path) if stride_len > 1 else None
+    if how_verbose >= 1 and chain_index is not None:
+        print("Reading every {}th step from {}'s index".format(stride_len, chain_path), flush=True)
+    if num_workers > 1:
+        if chain_index is not None:
+            districts = chain_index.districts
+        else:
+            # The first step assigns every node, so its nonempty districts are the plan's districts.
+            deltas = chain_deltas(chain_path)
+            districts = [district for district, nodes in enumerate(next(deltas)) if nodes]
+            deltas.close()
+        header = json.dumps(scores.summary_data(elections, districts=districts, epsilon=eps, method=method)) + "\n"
+        num_steps = steps if num_steps is None else num_steps
+        bounds = [num_steps * i // num_workers for i in range(num_workers)] + [None]
+        with multiprocessing.get_context("fork").Pool(num_workers, initializer=init_worker, initargs=(shared.spec,)) as pool:
+            ranges = pool.map(score_range, [(chain_path, output_path, start, stop)
+                                                 for start, stop in zip(bounds[:-1], bounds[1:])], chunksize=1)
+
+        with gzip.open(output_path, "wt") as fout:
+            fout.write(header)
+            for range_path, timer, _ in ranges:
+                if profile:
+                    scores.timer.merge(timer)
+                with open(range_path) as fin:
+                    shutil.copyfileobj(fin, fout)
+                os.remove(range_path)
+        if write_columnar:
+            jsonl_to_columnar(output_path)
+        report_reuse(chain_path, *map(sum, zip(*[counts for _, _, counts in ranges])))
+    elif chain_index is not None:
+        with gzip.open(output_path, "wt") as fout:
+            header = json.dumps(scores.summary_data(elections, districts=chain_index.districts, epsilon=eps, method=method)) + "\n"
+            fout.write(header)
+            columnar_writer = ColumnarStatsWriter(columnar_path(output_path), json.loads(header)) if write_columnar else None
+            sampled_steps = indexed_steps(0, None)
+            counts = score_plans(chain_index.partitions(graph, sampled_steps, {**demographic_updaters, **election_updaters},
+                                                        chained=whole_sums()),
+                                 fout, columnar_writer=columnar_writer, steps=sampled_steps)
+            if write_columnar:
+                columnar_writer.close()
+        report_reuse(chain_path, *counts)
     else:
-        for i, part in enumerate(plan_generator):
-            if i % stride_len == stride_len - 1:
-                if how_verbose > 0 and i % 100 == 100 - 1:
-                    print("*", end="", flush=True)
-                plan_details = json.dumps(scores.plan_summary(part)) + "\n"
-                fout.write(plan_details)
+        with gzip.open(output_path, "wt") as fout:
+            plan_generator = Replay(graph, chain_path, {**demographic_updaters, **election_updaters})
+            part = next(plan_generator)
+            header = json.dumps(scores.summary_data(elections, districts=part.parts.keys(), epsilon=eps, method=method)) + "\n"
+            fout.write(header)
+            columnar_writer = ColumnarStatsWriter(columnar_path(output_path), json.loads(header)) if write_columnar else None
+            counts = score_plans(itertools.chain([part], plan_generator), fout, columnar_writer=columnar_writer)
+            if write_columnar:
+                columnar_writer.close()
+        report_reuse(chain_path, *counts)
+    if profile and not in_set:
+        scores.timer.write(timing_path(output_path))
+
+def score_chain_set(chain_set, output_path, eps, method):
+    """
+    Scores the chains of a chain set (see `ChainRecorder.record_chains`) as one ensemble: one
+    header, then every chain's plans in the manifest's order.  The header lists the chains and
+    how many plans each contributed ("chains" and "plans_per_chain"), for between-chain diagnostics.
+    """
+    timer = MetricTimer() if profile else None
+    part_paths = []
+    # Sets recorded before the steps were split between the chains ran every chain for all of them.
+    chain_steps = chain_set.get("chain_steps", [chain_set["steps"]] * len(chain_set["chain_paths"]))
+    for i, chain_path in enumerate(chain_set["chain_paths"]):
+        if how_verbose >= 1:
+            print("\nScoring chain {} of {}: {}".format(i + 1, len(chain_set["chain_paths"]), chain_path), flush=True)
+        part_paths.append("{}.{}.part".format(output_path, i))
+        score_chain(chain_path, part_paths[-1], eps, method, in_set=True, num_steps=chain_steps[i])
+        if profile:
+            timer.merge(scores.timer)
+
+    plans_per_chain = []
+    for part_path in part_paths:
+        with gzip.open(part_path, "rt") as fin:
+            header = json.loads(next(fin))
+            plans_per_chain.append(sum(1 for _ in fin))
+    header.update({"chains": chain_set["chains"], "plans_per_chain": plans_per_chain})
+    with gzip.open(output_path, "wt") as fout:
+        fout.write(json.dumps(header) + "\n")
+        for part_path in part_paths:
+            with gzip.open(part_path, "rt") as fin:
+                next(fin)
+                shutil.copyfileobj(fin, fout)
+            os.remove(part_path)
+    if columnar:
+        jsonl_to_columnar(output_path)
+    if profile:
+        timer.write(timing_path(output_path))
+
+## The graph is shared by every chain; the scorer (and its precomputed indices) by every chain of a plan type.
+for plan_type in plan_types:
+    eps = state_specification["epsilons"][plan_type]
+    incumbent_col = scoring_spec.incumbent_col(plan_type)
+    demographic_updaters = scoring_spec.demographic_updaters(plan_type)
+    scores = scorer(graph, election_names, party, pop_col, state_metrics, updaters=election_updaters,
+                    county_col=county_col, demographic_cols=demographic_cols,
+                    municipality_col=municipality_col, incumbent_col=incumbent_col, columns=shared)
+
+    for method in methods:
+        # path_long = "mi_chains/mi_cong_0.01_bal_10000_steps_non_county_aware.chain"
+        chain_path = "{}/{}/{}_{}_{}_bal_{}_steps_{}.chain".format(state, CHAIN_DIR, state.lower(), plan_type,
+                                                                   eps, steps, method)
+        output_path = "{}/{}/{}_{}_{}_bal_{}_steps_{}.jsonl.gz".format(state, STATS_DIR, state.lower(), plan_type,
+                                                                       eps, steps, method)
+        if how_verbose >= 1 and len(plan_types) * len(methods) > 1:
+            print("\nScoring {}".format(chain_path), flush=True)
+        ## A chain set recorded with `run_ensemble.py --num_chains` is scored as one ensemble.
+        chain_set = load_chain_set(chain_path) if not os.path.exists(chain_path) else None
+        if chain_set is not None:
+            score_chain_set(chain_set, output_path, eps, method)
+        else:
+            score_chain(chain_path, output_path, eps, method)
+
+if shared is not None:
+    shared.close()
+    shared.unlink()
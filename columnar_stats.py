@@ -0,0 +1,171 @@
+from collections.abc import Sequence
+import numpy as np
+import argparse
+import json
+import gzip
+import os
+
+HEADER_FILE = "header.json"
+INT_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def columnar_path(jsonl_path):
+    """
+    Where the columnar copy of the ensemble stats at `jsonl_path` lives.
+    """
+    base = jsonl_path[:-len(".jsonl.gz")] if jsonl_path.endswith(".jsonl.gz") else jsonl_path
+    return base + ".columns"
+
+
+class ColumnarStatsWriter:
+    """
+    Writes ensemble stats as a directory of arrays with one row per plan: a `.npy` file per metric
+    (plan-wide metrics are 1-D, election-level metrics are (plans x elections) and district-level
+    tallies are (plans x districts)) and the header from `PlanMetrics.summary_data` in `header.json`,
+    with the labels of each array's columns added under "columns".
+    Rows are buffered and appended to raw files, which become `.npy` files when the writer is closed.
+    """
+    def __init__(self, path, header, buffer_size=1000) -> None:
+        self.path = path
+        self.header = header
+        self.metric_ids = [m["id"] for m in header["metrics"]]
+        self.buffer_size = buffer_size
+        self.keys = None
+        self.buffers = {metric_id: [] for metric_id in self.metric_ids}
+        self.integral = {metric_id: True for metric_id in self.metric_ids}
+        self.num_plans = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _raw_path(self, metric_id):
+        return "{}/{}.raw".format(self.path, metric_id)
+
+    def write(self, plan):
+        """
+        Appends a plan's scores (as returned by `PlanMetrics.plan_summary`).
+        """
+        if self.keys is None:
+            # The first plan fixes each metric's layout: the keys of dictionaries, "list" or "scalar".
+            self.keys = {metric_id: list(value.keys()) if isinstance(value, dict) else
+                                    "list" if isinstance(value, list) else "scalar"
+                         for metric_id, value in ((m, plan[m]) for m in self.metric_ids)}
+        for metric_id in self.metric_ids:
+            value = plan[metric_id]
+            keys = self.keys[metric_id]
+            self.buffers[metric_id].append([value[k] for k in keys] if isinstance(keys, list) else value)
+        self.num_plans += 1
+        if len(self.buffers[self.metric_ids[0]]) >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        for metric_id, rows in self.buffers.items():
+            if len(rows) == 0:
+                continue
+            rows = np.asarray(rows)
+            self.integral[metric_id] &= rows.dtype.kind in "biu"
+            with open(self._raw_path(metric_id), "ab") as fout:
+                rows.astype(np.float64).tofile(fout)
+            self.buffers[metric_id] = []
+
+    def close(self):
+        self._flush()
+        columns = {}
+        for metric_id in self.metric_ids:
+            values = np.fromfile(self._raw_path(metric_id), dtype=np.float64).reshape(self.num_plans, -1)
+            os.remove(self._raw_path(metric_id))
+            keys = self.keys[metric_id]
+            if isinstance(keys, list):
+                columns[metric_id] = [str(k) for k in keys]
+            elif keys == "list":
+                columns[metric_id] = values.shape[1]
+            else:
+                columns[metric_id] = None
+                values = values.reshape(self.num_plans)
+            if self.integral[metric_id]:
+                values = values.astype(smallest_int_dtype(values))
+            np.save("{}/{}.npy".format(self.path, metric_id), values)
+
+        with open("{}/{}".format(self.path, HEADER_FILE), "w") as fout:
+            json.dump({**self.header, "columns": columns, "num_plans": self.num_plans}, fout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def smallest_int_dtype(values):
+    low, high = (values.min(), values.max()) if values.size > 0 else (0, 0)
+    for dtype in INT_DTYPES:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def load_columnar_stats(path, mmap_mode="r"):
+    """
+    Returns the header and a dictionary of (memory-mapped) arrays, one per metric.
+    """
+    with open("{}/{}".format(path, HEADER_FILE)) as fin:
+        header = json.load(fin)
+    columns = {metric_id: np.load("{}/{}.npy".format(path, metric_id), mmap_mode=mmap_mode)
+               for metric_id in header["columns"]}
+    return header, columns
+
+
+class ColumnarPlans(Sequence):
+    """
+    Read-only list of the plans in a columnar ensemble.  Indexing builds the plan's dictionary (as it
+    would be read from the jsonl file); `aggregate` reads whole columns instead.
+    """
+    def __init__(self, header, columns) -> None:
+        self.header = header
+        self.columns = columns
+
+    def __len__(self):
+        return self.header["num_plans"]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        plan = {"type": "ensemble_plan"}
+        for metric_id, labels in self.header["columns"].items():
+            row = self.columns[metric_id][i]
+            plan[metric_id] = dict(zip(labels, row.tolist())) if isinstance(labels, list) else row.tolist()
+        return plan
+
+    def aggregate(self, score, labels=None):
+        """
+        The values of `score` across plans: a list for plan-wide metrics, otherwise a dictionary
+        from each label (election or district, defaulting to all of them) to a list.
+        """
+        values = self.columns[score]
+        column_labels = self.header["columns"][score]
+        if not isinstance(column_labels, list):
+            return values.tolist()
+        index = {label: j for j, label in enumerate(column_labels)}
+        labels = column_labels if labels is None else labels
+        return {label: values[:, index[label]].tolist() for label in labels}
+
+
+def jsonl_to_columnar(jsonl_path, path=None):
+    """
+    Writes the columnar copy of an existing `jsonl.gz` ensemble stats file.
+    """
+    path = columnar_path(jsonl_path) if path is None else path
+    with gzip.open(jsonl_path, "rt") as fin:
+        header = json.loads(next(fin))
+        with ColumnarStatsWriter(path, header) as writer:
+            for line in fin:
+                writer.write(json.loads(line))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar Ensemble Stats Converter",
+                                     prog="columnar_stats.py")
+    parser.add_argument("paths", metavar="jsonl.gz paths", type=str, nargs="+",
+                        help="Ensemble stats files to write columnar copies of.")
+    args = parser.parse_args()
+    for jsonl_path in args.paths:
+        print(jsonl_to_columnar(jsonl_path))
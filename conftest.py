@@ -0,0 +1 @@
+# Lets the tests import the top-level scoring and chain modules (plan_metrics, region_aware, ...).
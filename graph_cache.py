@@ -0,0 +1,256 @@
+from gerrychain import Graph
+from operator import itemgetter
+import numpy as np
+import argparse
+import hashlib
+import json
+import os
+
+CACHE_VERSION = 1
+
+
+def cache_path(json_path):
+    """
+    Where the compiled copy of the dual graph at `json_path` lives.
+    """
+    return os.path.splitext(json_path)[0] + ".compiled.npz"
+
+
+def file_hash(path, chunk_size=1 << 24):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def encode_column(values):
+    """
+    Stores a list of attribute values as a typed array.  Returns (kind, array), where kind is one
+    of "bool", "int", "float", "str" or "json" (anything else, stored as one JSON string per value).
+    """
+    types = set(map(type, values))
+    if types == {bool}:
+        return "bool", np.array(values, dtype=bool)
+    if types == {int}:
+        try:
+            return "int", np.array(values, dtype=np.int64)
+        except OverflowError:
+            pass
+    if types == {float}:
+        return "float", np.array(values, dtype=np.float64)
+    if types == {str}:
+        return "str", np.array(values, dtype=str)
+    return "json", np.array([json.dumps(v) for v in values], dtype=str)
+
+
+def decode_column(kind, array):
+    """
+    The list of Python values stored by `encode_column`.
+    """
+    if kind == "json":
+        return json.loads("[{}]".format(",".join(array.tolist())))
+    return array.tolist()
+
+
+def encode_records(records, prefix, arrays):
+    """
+    Splits a list of attribute dictionaries into one typed column per key (in order of first
+    appearance), adding them to `arrays`.  Keys missing from some records get a presence mask,
+    and each record's key order is kept as an index into a list of distinct orders.
+    Returns the column specifications and the key orders.
+    """
+    keys = list(dict.fromkeys(key for record in records for key in record))
+    specs = []
+    for i, key in enumerate(keys):
+        present = np.array([key in record for record in records], dtype=bool)
+        kind, arrays["{}_{}".format(prefix, i)] = encode_column([record[key] for record in records if key in record])
+        spec = {"key": key, "kind": kind, "masked": not present.all()}
+        if spec["masked"]:
+            arrays["{}_{}_mask".format(prefix, i)] = present
+        specs.append(spec)
+    key_orders = {}
+    arrays["{}_key_order".format(prefix)] = np.array([key_orders.setdefault(tuple(record), len(key_orders))
+                                                      for record in records], dtype=np.int64)
+    return specs, [list(key_order) for key_order in key_orders]
+
+
+def compile_graph(json_path, path=None):
+    """
+    Compiles the dual graph at `json_path` (NetworkX adjacency format, as read by
+    `Graph.from_json`) into a binary cache: the adjacency in CSR form (`indptr`, `indices` as
+    node positions), typed columns for the node and edge attributes, and the size, modification
+    time and SHA-256 of the source, which decide whether the cache is fresh.
+    """
+    path = cache_path(json_path) if path is None else path
+    signature = file_signature(json_path)
+    with open(json_path) as fin:
+        data = json.load(fin)
+    if data.get("directed", False) or data.get("multigraph", False):
+        raise ValueError("Only undirected simple graphs can be compiled: {}".format(json_path))
+
+    node_data = [dict(d) for d in data["nodes"]]
+    node_ids = [d.pop("id") for d in node_data]
+    position = {node: i for i, node in enumerate(node_ids)}
+    arrays = {}
+    meta = {
+        "version": CACHE_VERSION,
+        "source": {**signature, "sha256": file_hash(json_path)},
+        "graph": data.get("graph", []),
+    }
+    meta["node_ids"], arrays["node_ids"] = encode_column(node_ids)
+    meta["node_columns"], meta["node_key_orders"] = encode_records(node_data, "node", arrays)
+    adjacency = data["adjacency"]
+    arrays["indptr"] = np.cumsum([0] + [len(targets) for targets in adjacency], dtype=np.int64)
+    arrays["indices"] = np.array([position[t["id"]] for targets in adjacency for t in targets], dtype=np.int64)
+    # Each edge is listed from both of its ends.  `adjacency_graph` adds it at its first entry
+    # and updates its attributes (including the target's "id") from every entry, so the edges
+    # are kept in order of first entry with their attributes merged the same way.
+    edges = {}
+    first_entries = []
+    for entry, (source, target) in enumerate(zip(np.repeat(np.arange(len(adjacency)), np.diff(arrays["indptr"])).tolist(),
+                                                 arrays["indices"].tolist())):
+        tdata = adjacency[source][entry - arrays["indptr"][source]]
+        edge = (min(source, target), max(source, target))
+        if edge not in edges:
+            edges[edge] = {}
+            first_entries.append(entry)
+        edges[edge].update(tdata)
+    arrays["edge_entries"] = np.array(first_entries, dtype=np.int64)
+    meta["edge_columns"], meta["edge_key_orders"] = encode_records(list(edges.values()), "edge", arrays)
+    arrays["meta"] = np.array(json.dumps(meta))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fout:
+        np.savez(fout, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+class CompiledGraph:
+    """
+    A dual graph loaded from the binary cache written by `compile_graph`.  The adjacency and
+    attribute columns are available as arrays; `to_graph` builds the gerrychain `Graph`.
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        self.arrays = np.load(path)
+        self.meta = json.loads(self.arrays["meta"].item())
+        self.indptr = self.arrays["indptr"]
+        self.indices = self.arrays["indices"]
+        self.node_column_specs = {spec["key"]: (i, spec) for i, spec in enumerate(self.meta["node_columns"])}
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def is_fresh(self, json_path):
+        """
+        Whether the cache was compiled from the current contents of `json_path`.  Only hashes the
+        source when its size matches but its modification time doesn't.
+        """
+        source = self.meta["source"]
+        if self.meta["version"] != CACHE_VERSION or not os.path.exists(json_path):
+            return False
+        signature = file_signature(json_path)
+        if signature["size"] != source["size"]:
+            return False
+        return signature["mtime_ns"] == source["mtime_ns"] or file_hash(json_path) == source["sha256"]
+
+    def node_ids(self):
+        return decode_column(self.meta["node_ids"], self.arrays["node_ids"])
+
+    def node_column(self, key):
+        """
+        The typed array of the node attribute `key`, aligned with the node positions.  Raises
+        a KeyError if some nodes lack the attribute or its values aren't of one scalar type.
+        """
+        i, spec = self.node_column_specs[key]
+        if spec["masked"] or spec["kind"] == "json":
+            raise KeyError("Node attribute {} has no array form".format(key))
+        return self.arrays["node_{}".format(i)]
+
+    def _records(self, prefix):
+        """
+        Rebuilds the attribute dictionaries split up by `encode_records`.
+        """
+        columns = {}
+        for i, spec in enumerate(self.meta["{}_columns".format(prefix)]):
+            values = decode_column(spec["kind"], self.arrays["{}_{}".format(prefix, i)])
+            if spec["masked"]:
+                mask = self.arrays["{}_{}_mask".format(prefix, i)]
+                column = [None] * len(mask)
+                for row, value in zip(np.flatnonzero(mask).tolist(), values):
+                    column[row] = value
+                values = column
+            columns[spec["key"]] = values
+        key_order_ids = self.arrays["{}_key_order".format(prefix)]
+        records = [None] * len(key_order_ids)
+        for key_order_id, keys in enumerate(self.meta["{}_key_orders".format(prefix)]):
+            rows = np.flatnonzero(key_order_ids == key_order_id).tolist()
+            if len(keys) == 0:
+                values = ([] for _ in rows)
+            elif len(rows) == len(records):
+                values = zip(*[columns[key] for key in keys])
+            else:
+                pick = itemgetter(*rows) if len(rows) > 1 else lambda column: (column[rows[0]],)
+                values = zip(*[pick(columns[key]) for key in keys])
+            for row, record_values in zip(rows, values):
+                records[row] = dict(zip(keys, record_values))
+        return records
+
+    def to_graph(self):
+        """
+        The gerrychain `Graph`, with the same nodes, edges and attributes `Graph.from_json`
+        would give for the source file.
+        """
+        node_ids = self.node_ids()
+        graph = Graph()
+        graph.graph = dict(self.meta["graph"])
+        graph.add_nodes_from(zip(node_ids, self._records("node")))
+        entries = self.arrays["edge_entries"]
+        sources = np.repeat(np.arange(len(node_ids)), np.diff(self.indptr))[entries].tolist()
+        graph.add_edges_from((node_ids[source], node_ids[target], data)
+                             for source, target, data in zip(sources, self.indices[entries].tolist(), self._records("edge")))
+        graph.issue_warnings()
+        return graph
+
+
+def load_compiled_graph(json_path):
+    """
+    The fresh `CompiledGraph` for `json_path`, or None if there is no cache or it is stale.
+    """
+    path = cache_path(json_path)
+    if not os.path.exists(path):
+        return None
+    compiled = CompiledGraph(path)
+    return compiled if compiled.is_fresh(json_path) else None
+
+
+def load_graph(json_path):
+    """
+    Drop-in replacement for `Graph.from_json` that reads the compiled cache when it is fresh.
+    """
+    compiled = load_compiled_graph(json_path)
+    if compiled is None:
+        return Graph.from_json(json_path)
+    return compiled.to_graph()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dual Graph Compiler",
+                                     prog="graph_cache.py")
+    parser.add_argument("paths", metavar="dual graph paths", type=str, nargs="+",
+                        help="Dual graph JSON files to compile.")
+    parser.add_argument("--force", action='store_const', const=True, default=False,
+                        help="Recompile even if the cache is fresh? (default False)")
+    args = parser.parse_args()
+    for json_path in args.paths:
+        if not args.force and load_compiled_graph(json_path) is not None:
+            print("{} is fresh".format(cache_path(json_path)))
+            continue
+        print(compile_graph(json_path))
@@ -0,0 +1,237 @@
+from array_tree import ArrayTree, choose_root
+from region_aware import node_array, node_values
+from gerrychain import Partition
+from gerrychain.partition.assignment import Assignment
+from gerrychain.updaters.flows import flows_from_changes
+from scipy import sparse
+from scipy.sparse.csgraph import minimum_spanning_tree, connected_components
+import pandas as pd
+import numpy as np
+import random
+
+
+def load_baf(baf_file, state_fips_code=None, block_col="BLOCKID", county_col="COUNTYFP", vtd_col="DISTRICT"):
+    """
+    The VTD of every block of a Census block assignment file (BAF), as a Series from block GEOID
+    to VTD GEOID (state, county and VTD codes, like the VTD dual graphs' GEOID20).  The state FIPS
+    code defaults to the first two digits of every block's GEOID.
+    """
+    baf_df = pd.read_csv(baf_file, sep='|', dtype=str).set_index(block_col)
+    state = pd.Series(baf_df.index.str[:2], index=baf_df.index) if state_fips_code is None else state_fips_code
+    return (state + baf_df[county_col].str.zfill(3) + baf_df[vtd_col].str.zfill(6)).rename("vtd_id")
+
+def block_vtds(graph, vtds, geoid_col="GEOID20"):
+    """
+    The VTD of every node of the block dual graph `graph`, from the `vtds` of `load_baf`.
+    """
+    return {n: vtds[geoid] for n, geoid in node_values(graph, geoid_col).items()}
+
+
+class MultiScaleReCom:
+    """
+    A ReCom proposal on a block dual graph that moves whole VTDs wherever it can.  The two merged
+    districts are contracted to a graph of units: every VTD that lies wholly in them is a single
+    unit (a VTD that isn't contiguous is one per connected piece), and only the blocks of VTDs
+    that are split with a third district are units of their own.  Spanning trees of the units are
+    searched for a balanced cut as in `ArrayBipartition`.  Once `attempts` trees have had none,
+    each following tree without a cut is refined where a cut would have to split a VTD
+    (`refinement`): the VTD's blocks replace it in the tree (`refined_tree`) and the refined tree
+    is searched again, up to `max_refinements` VTDs per tree.  The proposal flips only the blocks
+    whose district changes, so the chain is a chain of block level plans (recorded and replayed on
+    the block dual graph).  Its trees are about as small as the VTD graph's, but every step still
+    pays for the block level partition's updaters and for contracting the region.
+
+    The plans favor district lines along VTD boundaries, so the chain doesn't draw from the
+    distribution of block level ReCom.  With a `county_col`, the trees are drawn with a penalty on
+    edges between counties and cuts between counties are preferred, like `DivisionBipartition`.
+    """
+    def __init__(self, graph, vtds, pop_col, pop_target, epsilon, county_col=None, attempts=10,
+                 max_refinements=5, attempts_before_giveup=100, columns=None) -> None:
+        self.pop_target = pop_target
+        self.epsilon = epsilon
+        self.attempts = attempts
+        self.max_refinements = max_refinements
+        self.attempts_before_giveup = attempts_before_giveup
+        self.nodes = list(graph.nodes)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.heads = np.array([self.node_index[u] for u, _ in graph.edges], dtype=np.int64)
+        self.tails = np.array([self.node_index[v] for _, v in graph.edges], dtype=np.int64)
+        codes = {}
+        vtd_codes = np.array([codes.setdefault(vtds[n], len(codes)) for n in self.nodes], dtype=np.int64)
+        # A VTD in several pieces would be a unit that isn't connected, so each piece is a VTD of its own.
+        same_vtd = vtd_codes[self.heads] == vtd_codes[self.tails]
+        pieces = sparse.csr_matrix((np.ones(same_vtd.sum()), (self.heads[same_vtd], self.tails[same_vtd])),
+                                   shape=(len(self.nodes), len(self.nodes)))
+        self.num_vtds, self.vtds = connected_components(pieces, directed=False)
+        self.vtd_sizes = np.bincount(self.vtds, minlength=self.num_vtds)
+        self.populations = node_array(graph, pop_col, columns).astype(np.float64)
+        self.counties = None
+        if county_col is not None:
+            county_codes = {}
+            self.counties = np.array([county_codes.setdefault(c, len(county_codes))
+                                      for c in node_values(graph, county_col, columns).values()], dtype=np.int64)
+
+    def balanced_cut(self, tree, units):
+        """
+        A balanced cut of the spanning `tree` of `units`, preferring cuts between counties in
+        county-aware chains, as whether every unit is on the cut's side; None if it has none.
+        """
+        cuts = []
+        if self.counties is not None:
+            choose_root(tree)
+            split_scores = (units.counties != units.counties[np.maximum(tree.parent, 0)]).astype(np.int64)
+            cuts, subtree_sides = tree.balanced_cuts(self.pop_target, self.epsilon, split_scores)
+        if len(cuts) == 0:
+            choose_root(tree)
+            cuts, subtree_sides = tree.balanced_cuts(self.pop_target, self.epsilon)
+        if len(cuts) == 0:
+            return None
+        cut = random.choice(range(len(cuts)))
+        in_subset = np.zeros(len(units.populations), dtype=bool)
+        in_subset[tree.subtree(cuts[cut])] = True
+        return in_subset if subtree_sides[cut] else ~in_subset
+
+    def refinement(self, tree, units, coarse):
+        """
+        The VTD to refine after the spanning `tree` of `units` had no balanced cut: of the whole
+        VTDs of more than one block, the one with the smallest subtree of at least the lower
+        population bound, where a cut would have to split a VTD.  None if every VTD is refined.
+        """
+        unit_vtds = self.vtds[units.blocks]
+        refinable = coarse[unit_vtds] & (self.vtd_sizes[unit_vtds] > 1)
+        candidates = refinable & (tree.subtree_pops >= self.pop_target * (1 - self.epsilon))
+        if not candidates.any():
+            candidates = refinable
+        if not candidates.any():
+            return None
+        candidates = np.flatnonzero(candidates)
+        return unit_vtds[candidates[np.argmin(tree.subtree_pops[candidates])]]
+
+    def refined_tree(self, tree, units, refined, vtd):
+        """
+        A spanning tree of the `refined` units, where `vtd` is split into its blocks, that keeps the
+        edges of `tree` that don't touch the VTD: the VTD's blocks are joined to each other and to
+        the rest of the tree by a minimum spanning tree over random weights, which only uses other
+        edges if the VTD's blocks aren't connected.
+        """
+        children = np.flatnonzero(tree.parent >= 0)
+        kept = (self.vtds[units.blocks[children]] != vtd) & (self.vtds[units.blocks[tree.parent[children]]] != vtd)
+        kept_heads = refined.unit_index[units.blocks[children[kept]]]
+        kept_tails = refined.unit_index[units.blocks[tree.parent[children[kept]]]]
+        num_units = len(refined.populations)
+        kept_keys = np.minimum(kept_heads, kept_tails) * num_units + np.maximum(kept_heads, kept_tails)
+
+        touches = (self.vtds[refined.blocks[refined.heads]] == vtd) | (self.vtds[refined.blocks[refined.tails]] == vtd)
+        weights = np.where(touches, 2, 4) + refined.penalties + (1 - np.random.random_sample(len(refined.heads)))
+        weights[np.isin(refined.heads * num_units + refined.tails, kept_keys)] = 1
+        return refined.spanning_tree(weights)
+
+    def bipartition(self, region):
+        """
+        Whether every block of `region` is on the side of a balanced cut, or None if no cut was found.
+        """
+        # The VTDs that lie wholly in the merged districts can move as a whole.
+        whole = np.bincount(self.vtds[region], minlength=self.num_vtds) == self.vtd_sizes
+        for attempt in range(self.attempts_before_giveup):
+            coarse = whole.copy()
+            units = RegionUnits(self, region, coarse)
+            tree = units.spanning_tree(units.penalties + (1 - np.random.random_sample(len(units.heads))))
+            in_subset = self.balanced_cut(tree, units)
+            # After `attempts` trees of whole VTDs, the VTDs that a cut needs are split along the tree.
+            refinements = 0
+            while in_subset is None and attempt >= self.attempts - 1 and refinements < self.max_refinements:
+                vtd = self.refinement(tree, units, coarse)
+                if vtd is None:
+                    break
+                coarse[vtd] = False
+                refined = RegionUnits(self, region, coarse)
+                tree = self.refined_tree(tree, units, refined, vtd)
+                units = refined
+                in_subset = self.balanced_cut(tree, units)
+                refinements += 1
+            if in_subset is not None:
+                return in_subset[units.unit_of]
+        return None
+
+    def __call__(self, partition):
+        # The cut edges are found on arrays rather than with the partition's `cut_edges` updater, which
+        # a block level partition would have to update for every flipped block.
+        districts = np.empty(len(self.nodes), dtype=np.int64)
+        labels = list(partition.parts)
+        for i, part in enumerate(labels):
+            districts[[self.node_index[n] for n in partition.parts[part]]] = i
+        cut = np.flatnonzero(districts[self.heads] != districts[self.tails])
+        edge = random.choice(cut.tolist())
+        parts_to_merge = (labels[districts[self.heads[edge]]], labels[districts[self.tails[edge]]])
+        # The nodes of the first district come first.
+        region_nodes = list(partition.parts[parts_to_merge[0]]) + list(partition.parts[parts_to_merge[1]])
+        region = np.fromiter((self.node_index[n] for n in region_nodes), dtype=np.int64, count=len(region_nodes))
+
+        in_subset = self.bipartition(region)
+        if in_subset is None:
+            return partition.flip({})
+        was_first = np.arange(len(region_nodes)) < len(partition.parts[parts_to_merge[0]])
+        return partition.flip({region_nodes[i]: parts_to_merge[0] if in_subset[i] else parts_to_merge[1]
+                               for i in np.flatnonzero(in_subset != was_first).tolist()})
+
+
+class RegionUnits:
+    """
+    The units of the blocks `region` (positions in the graph of `proposal`) when the VTDs marked in
+    `coarse` are whole: the unit of every block (`unit_of`, and `unit_index` over all blocks), a
+    block of every unit (`blocks`), the units' populations and the edges between units, each once
+    as `heads` < `tails`, with their county `penalties`.
+    """
+    def __init__(self, proposal, region, coarse) -> None:
+        num_blocks = len(proposal.nodes)
+        in_region = np.zeros(num_blocks, dtype=bool)
+        in_region[region] = True
+        keys = np.where(coarse[proposal.vtds[region]], proposal.vtds[region], proposal.num_vtds + region)
+        _, self.unit_of = np.unique(keys, return_inverse=True)
+        num_units = self.unit_of.max() + 1
+        self.unit_index = np.full(num_blocks, -1, dtype=np.int64)
+        self.unit_index[region] = self.unit_of
+        self.blocks = np.empty(num_units, dtype=np.int64)
+        self.blocks[self.unit_of] = region
+        self.populations = np.bincount(self.unit_of, weights=proposal.populations[region], minlength=num_units)
+
+        internal = in_region[proposal.heads] & in_region[proposal.tails]
+        heads, tails = self.unit_index[proposal.heads[internal]], self.unit_index[proposal.tails[internal]]
+        between = heads != tails
+        edges = np.unique(np.minimum(heads[between], tails[between]) * num_units + np.maximum(heads[between], tails[between]))
+        self.heads, self.tails = edges // num_units, edges % num_units
+        self.penalties = np.zeros(len(edges))
+        self.counties = None
+        if proposal.counties is not None:
+            # The blocks of a unit share its VTD, and so its county.
+            self.counties = proposal.counties[self.blocks]
+            self.penalties = (self.counties[self.heads] != self.counties[self.tails]).astype(np.float64)
+
+    def spanning_tree(self, weights):
+        """
+        The minimum spanning tree of the units with the edges weighted by `weights`, as an `ArrayTree`.
+        """
+        num_units = len(self.populations)
+        mst = minimum_spanning_tree(sparse.csr_matrix((weights, (self.heads, self.tails)), shape=(num_units, num_units))).tocoo()
+        return ArrayTree(mst.row, mst.col, self.populations)
+
+
+class BlockPartition(Partition):
+    """
+    A `Partition` for multi-scale chains, whose steps flip thousands of blocks.  A flip computes
+    the flows of nodes between districts once, and doesn't compute the edge flows that only
+    `on_edge_flow` updaters (such as gerrychain's `cut_edges_by_part`) read, so those updaters
+    can't be used.  `MultiScaleReCom` doesn't read the `cut_edges` updater either, so it's only
+    computed for partitions whose cut edges are asked for.
+    """
+    def _from_parent(self, parent, flips):
+        self.parent = parent
+        self.flips = flips
+        self.flows = flows_from_changes(parent.assignment, flips)
+        parts = dict(parent.assignment.parts)
+        for part, flow in self.flows.items():
+            parts[part] = (parts[part] - flow["out"]) | flow["in"]
+        self.assignment = Assignment(parts, validate=False)
+        self.graph = parent.graph
+        self.updaters = parent.updaters
+        self.edge_flows = None
@@ -1,4 +1,8 @@
 from functools import reduce
+from contextlib import contextmanager, nullcontext
+from scipy import sparse
+import time
+import json
 import numpy as np
 import warnings
 from gerrychain import Partition, updaters, metrics
@@ -11,8 +15,17 @@ class PlanMetrics:
                  'VAP', 'WVAP', 'BVAP', 'AMINVAP', 'ASIANVAP', 'NHPIVAP', 'OTHERVAP', '2MOREVAP', 'HVAP']
 
     def __init__(self, graph, elections, party, pop_col, state_metrics, county_col="COUNTY", 
-                 demographic_cols=DEMO_COLS, updaters={}, municipality_col=None, incumbent_col=None) -> None:
+                 demographic_cols=DEMO_COLS, updaters={}, municipality_col=None, incumbent_col=None,
+                 vectorized=True, columns=None, timer=None) -> None:
+        """
+        `columns` optionally gives the node attributes as arrays aligned with `graph.nodes` (a
+        `SharedGraph`), which the precomputations then read instead of the node dictionaries.
+        `timer` optionally is a `MetricTimer` that accumulates the time spent on each metric (it
+        can also be set or swapped later through the `timer` attribute).
+        """
         self.graph = graph
+        self.columns = columns
+        self.timer = timer
         self.elections = elections
         self.pop_col = pop_col
         self.county_col = county_col
@@ -25,20 +38,199 @@ class PlanMetrics:
         self.compute_municipal_details = "num_municipal_pieces" in self.metric_ids or "num_split_municipalities" in self.metric_ids
         self.demographic_cols = demographic_cols
         self.counties = set(self.county_part.parts.keys())
-        self.nodes_by_county = {county:[n for n in self.graph.nodes if self.graph.nodes[n][county_col] == county] for county in self.counties}
+        self.vectorized = vectorized
+        self._node_precomputation()
+        self.nodes_by_county = {county: [] for county in self.county_list}
+        for n, county_id in zip(self.nodes, self.county_ids.tolist()):
+            self.nodes_by_county[self.county_list[county_id]].append(n)
+        if "num_traversals" in self.metric_ids:
+            self._traversal_precomputation()
         if self.compute_municipal_details:
             self._municipal_precomputation(municipality_col)
         self.incumbent_col = incumbent_col
+        if self.vectorized:
+            self._tally_precomputation()
+        self.vectorized_elections = self.vectorized and self._election_precomputation(updaters)
             
-    
+    def _node_precomputation(self):
+        """
+        Fixes an ordering of the graph's nodes and encodes each node's county as an integer
+        index into `self.county_list`, so split metrics can be computed from arrays.
+        """
+        self.nodes = list(self.graph.nodes)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self._nodes_are_positions = self.nodes == list(range(len(self.nodes)))
+        if self.columns is not None:
+            if self.columns.nodes != self.nodes:
+                raise ValueError("The columns' nodes don't match the graph's nodes.")
+            self.county_list = list(self.columns.categories(self.county_col))
+            self.county_ids = np.array(self.columns.node_column(self.county_col), dtype=np.int64)
+        else:
+            self.county_list = list(self.counties)
+            county_index = {county: i for i, county in enumerate(self.county_list)}
+            self.county_ids = np.array([county_index[self.graph.nodes[n][self.county_col]] for n in self.nodes], dtype=np.int64)
+        self._cached_assignment = (None, None, None)
+
+    def _timed(self, label):
+        """
+        Context manager charging the time spent in its block to `label`, when timing is on.
+        """
+        return self.timer(label) if self.timer is not None else NOT_TIMED
+
+    def _node_values(self, col):
+        """
+        The node attribute `col` in `self.nodes` order: an array if read from `self.columns`,
+        otherwise a list.
+        """
+        if self.columns is not None:
+            return self.columns.node_column(col)
+        return [self.graph.nodes[n][col] for n in self.nodes]
+
+    def _traversal_precomputation(self):
+        """
+        Indexes the edges whose endpoints lie in different counties: their endpoints (as positions
+        in `self.nodes`) and an integer id for the (sorted) pair of counties they join.
+        """
+        heads, tails, pair_ids = [], [], []
+        county_pairs = {}
+        for (n1, n2) in self.graph.edges:
+            i1, i2 = self.node_index[n1], self.node_index[n2]
+            county1, county2 = self.county_ids[i1], self.county_ids[i2]
+            if county1 != county2:
+                county_pair = (min(county1, county2), max(county1, county2))
+                heads.append(i1)
+                tails.append(i2)
+                pair_ids.append(county_pairs.setdefault(county_pair, len(county_pairs)))
+        self.county_edge_heads = np.array(heads, dtype=np.int64)
+        self.county_edge_tails = np.array(tails, dtype=np.int64)
+        self.county_edge_pairs = np.array(pair_ids, dtype=np.int64)
+        self.num_county_pairs = len(county_pairs)
+
+    def _election_precomputation(self, updaters):
+        """
+        Stacks the vote columns of every election into a (nodes x elections x parties) array, so
+        all elections can be tallied by district with one sparse product per plan.  Returns False
+        (leaving the partisan metrics to the `Election` updaters) unless every election is a
+        two-party `Election` in which the POV party runs.
+        """
+        elections = [updaters.get(e) for e in self.elections]
+        if len(elections) == 0 or not all(hasattr(e, "parties") and len(e.parties) == 2 and self.party in e.parties
+                                          for e in elections):
+            return False
+        self.election_names = [e.name for e in elections]
+        self.party_index = np.array([e.parties.index(self.party) for e in elections], dtype=np.int64)
+        self.votes = np.array([[self._node_values(column) for column in e.columns] for e in elections],
+                              dtype=np.float64).transpose(2, 0, 1)
+        # Whole vote counts sum to the same district totals in any order, but fractional (e.g.
+        # prorated) ones don't, so theirs are read from the updaters (see `district_votes`).
+        self.whole_votes = bool(np.all(self.votes == np.round(self.votes)))
+        if "eguia_county" in self.metric_ids:
+            # The county partition never changes, so neither does the ideal seat share.
+            counties = self.county_part.parts
+            county_pops = np.array([self.county_part["population"][c] for c in counties])
+            self.eguia_ideals = [np.dot(np.array([self.county_part[e].won(self.party, c) for c in counties]), county_pops) / county_pops.sum()
+                                 for e in self.elections]
+        return True
+
+    def _tally_precomputation(self):
+        """
+        Stacks the demographic columns (and the incumbent column) into one (nodes x columns) array
+        so every column is tallied by district in one sparse product.  NaNs are tallied as 0, as
+        `Tally` skips them, and columns holding only integers are reported as integers.  Columns
+        with fractional (e.g. prorated) values are tallied by their `Tally` updaters instead, as
+        their totals depend on the order the updaters added the nodes in.
+        """
+        self.tally_cols = self.demographic_cols + ([self.incumbent_col] if self.incumbent_col is not None else [])
+        columns = [self._node_values(col) for col in self.tally_cols]
+        self.tallies = np.nan_to_num(np.array(columns, dtype=np.float64).reshape(len(self.tally_cols), len(self.nodes)).T)
+        self.integral_tallies = [column.dtype.kind in "biu" if isinstance(column, np.ndarray) else
+                                 all(isinstance(value, (int, np.integer)) for value in column)
+                                 for column in columns]
+        self.whole_tallies = np.all(self.tallies == np.round(self.tallies), axis=0).tolist()
+        self._cached_tallies = (None, None)
+
+    def district_sums(self, part, values):
+        """
+        Sums the rows of the (nodes x k) array `values` by district, returning a (districts x k)
+        array with districts in `part.parts` order.
+        """
+        assignment, districts = self.assignment_array(part)
+        num_nodes = len(self.nodes)
+        indicator = sparse.csr_matrix((np.ones(num_nodes), (assignment, np.arange(num_nodes))),
+                                      shape=(len(districts), num_nodes))
+        return indicator @ values
+
+    def district_votes(self, part):
+        """
+        The plan's vote totals as a (districts x elections x parties) array.  Fractional votes are
+        taken from the `Election` updaters, as the totals of a chain's plans depend on the order the
+        updaters added and removed the flipped nodes' votes in.
+        """
+        with self._timed("district_votes"):
+            if not self.whole_votes:
+                return np.array([[part[e].counts(party) for party in part[e].election.parties] for e in self.elections],
+                                dtype=np.float64).transpose(2, 0, 1)
+            return self.district_sums(part, self.votes.reshape(len(self.nodes), -1)).reshape(-1, *self.votes.shape[1:])
+
+    def tally_sums(self, part):
+        """
+        The plan's sums of the columns of `self.tallies` as a (districts x columns) array.
+        """
+        return self.district_sums(part, self.tallies)
+
+    def district_tallies(self, part):
+        """
+        The plan's tally of each demographic (and incumbent) column as a dictionary from district
+        to total, like the `Tally` updater for that column returns.
+        """
+        cached_part, tallies = self._cached_tallies
+        if cached_part is part:
+            return tallies
+        _, districts = self.assignment_array(part)
+        with self._timed("district_tallies"):
+            sums = self.tally_sums(part).T
+            tallies = {col: dict(zip(districts, (col_sums.astype(np.int64) if integral else col_sums).tolist())) if whole
+                            else part[col]
+                       for col, col_sums, integral, whole in zip(self.tally_cols, sums, self.integral_tallies, self.whole_tallies)}
+        self._cached_tallies = (part, tallies)
+        return tallies
+
     def _municipal_precomputation(self, municipality_col):
-        municipalities = set()
-        for n in self.graph.nodes():
-            muni = self.graph.nodes()[n][municipality_col]
-            municipalities.update(muni) if type(muni) == list else municipalities.add(muni)
-        self.municipalities = municipalities - set(['99999'])
-        node_in_muni = lambda muni, node_data: muni in node_data if type(muni) == list else node_data == muni
-        self.nodes_by_municipality = {municipality:[n for n in self.graph.nodes if node_in_muni(municipality, self.graph.nodes[n][municipality_col])] for municipality in self.municipalities}
+        """
+        Builds the node -> municipality membership index in one pass over the nodes: the
+        municipalities of the node at position i are
+        `municipality_list[municipal_ids[municipal_indptr[i]:municipal_indptr[i + 1]]]`.
+        A node's attribute may be a single municipality or a list of them; '99999' marks
+        nodes outside of any municipality and is left out.
+        """
+        if self.columns is not None:
+            indptr, codes = self.columns.memberships(municipality_col)
+            labels = self.columns.categories(municipality_col)
+            kept = [muni != '99999' for muni in labels]
+            self.municipality_list = [muni for muni, keep in zip(labels, kept) if keep]
+            new_ids = np.cumsum(kept) - 1
+            entries = np.asarray(kept, dtype=bool)[codes]
+            self.municipal_ids = new_ids[codes[entries]].astype(np.int64)
+            self.municipal_nodes = np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(indptr))[entries]
+            self.municipal_indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.municipal_nodes, minlength=len(self.nodes)), out=self.municipal_indptr[1:])
+        else:
+            municipality_index = {}
+            indptr, municipal_ids = [0], []
+            for n in self.nodes:
+                munis = self.graph.nodes[n][municipality_col]
+                for muni in (munis if type(munis) == list else [munis]):
+                    if muni != '99999':
+                        municipal_ids.append(municipality_index.setdefault(muni, len(municipality_index)))
+                indptr.append(len(municipal_ids))
+            self.municipality_list = list(municipality_index)
+            self.municipal_indptr = np.array(indptr, dtype=np.int64)
+            self.municipal_ids = np.array(municipal_ids, dtype=np.int64)
+            self.municipal_nodes = np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(self.municipal_indptr))
+        self.municipalities = set(self.municipality_list)
+        self.nodes_by_municipality = {muni: [] for muni in self.municipality_list}
+        for node, muni_id in zip(self.municipal_nodes.tolist(), self.municipal_ids.tolist()):
+            self.nodes_by_municipality[self.municipality_list[muni_id]].append(self.nodes[node])
     
     def summary_data(self, elections, num_districts=0, districts=[], epsilon=None, method=None, ensemble=True):
         header = {
@@ -71,33 +263,114 @@ class PlanMetrics:
         else:
             return {county: reduce(lambda districts, node: districts | set([assignment[node]]), self.nodes_by_county[county], set()) for county in self.counties}
 
+    def _node_positions(self, nodes):
+        if self._nodes_are_positions:
+            return np.fromiter(nodes, dtype=np.int64, count=len(nodes))
+        return np.fromiter((self.node_index[n] for n in nodes), dtype=np.int64, count=len(nodes))
+
+    def assignment_array(self, part):
+        """
+        The plan's assignment as an array of district indices aligned with `self.nodes`, along
+        with the list of district ids those indices refer to (in `part.parts` order).
+        The most recent plan's array is cached, since several metrics share it.
+        """
+        cached_part, assignment, districts = self._cached_assignment
+        if cached_part is part:
+            return assignment, districts
+        with self._timed("assignment"):
+            districts = list(part.parts.keys())
+            assignment = np.empty(len(self.nodes), dtype=np.int64)
+            for i, district in enumerate(districts):
+                assignment[self._node_positions(part.parts[district])] = i
+        self._cached_assignment = (part, assignment, districts)
+        return assignment, districts
+
+    @staticmethod
+    def _split_counts(unit_ids, num_units, districts, num_districts):
+        """
+        Given the unit (county/municipality) and district index of each node (or node membership),
+        returns the number of pieces of split units and the number of split units, by counting
+        the unique (unit, district) pairs.
+        """
+        pairs = np.unique(unit_ids * num_districts + districts)
+        touches = np.bincount(pairs // num_districts, minlength=num_units)
+        split = touches > 1
+        return int(touches[split].sum()), int(split.sum())
+
+    def split_metrics(self, part, municipalities=False):
+        """
+        Returns (# pieces of split units, # split units) for counties, or for municipalities
+        if `municipalities` is set.
+        """
+        assignment, districts = self.assignment_array(part)
+        if municipalities:
+            return self._split_counts(self.municipal_ids, len(self.municipality_list),
+                                      assignment[self.municipal_nodes], len(districts))
+        return self._split_counts(self.county_ids, len(self.county_list), assignment, len(districts))
+
     def compactness_metrics(self, part):
         compactness_metrics = {}
 
         if "num_cut_edges" in self.metric_ids:
-            compactness_metrics["num_cut_edges"] = len(part["cut_edges"]) 
+            with self._timed("num_cut_edges"):
+                compactness_metrics["num_cut_edges"] = len(part["cut_edges"]) 
+        if self.vectorized:
+            compactness_metrics.update(self._vectorized_split_metrics(part))
+        else:
+            compactness_metrics.update(self._split_metrics(part))
+        if "num_double_bunked" in self.metric_ids or "num_zero_bunked" in self.metric_ids:
+            incumbents = self.district_tallies(part) if self.vectorized else part
+        if "num_double_bunked" in self.metric_ids:
+            with self._timed("num_double_bunked"):
+                compactness_metrics["num_double_bunked"] = reduce(lambda acc, n: acc + 1 if n > 1 else acc, incumbents[self.incumbent_col].values(), 0)
+        if "num_zero_bunked" in self.metric_ids:
+            with self._timed("num_zero_bunked"):
+                compactness_metrics["num_zero_bunked"] = reduce(lambda acc, n: acc + 1 if n == 0 else acc, incumbents[self.incumbent_col].values(), 0)
+        if "num_traversals" in self.metric_ids:
+            with self._timed("num_traversals"):
+                compactness_metrics["num_traversals"] = self.num_traversals(part)
+        return compactness_metrics
+
+    def _vectorized_split_metrics(self, part):
+        split_metrics = {}
         if self.compute_counties_details:
-            county_details = self.county_split_details(part)
+            with self._timed("county_splits"):
+                county_pieces, split_counties = self.split_metrics(part)
+        if "num_county_pieces" in self.metric_ids:
+            split_metrics["num_county_pieces"] = county_pieces
+        if "num_split_counties" in self.metric_ids:
+            split_metrics["num_split_counties"] = split_counties
+        if self.compute_municipal_details:
+            with self._timed("municipal_splits"):
+                municipal_pieces, split_municipalities = self.split_metrics(part, municipalities=True)
+        if "num_municipal_pieces" in self.metric_ids:
+            split_metrics["num_municipal_pieces"] = municipal_pieces
+        if "num_split_municipalities" in self.metric_ids:
+            split_metrics["num_split_municipalities"] = split_municipalities
+        return split_metrics
+
+    def _split_metrics(self, part):
+        compactness_metrics = {}
+        if self.compute_counties_details:
+            with self._timed("county_splits"):
+                county_details = self.county_split_details(part)
         if "num_county_pieces" in self.metric_ids:
             compactness_metrics["num_county_pieces"] = reduce(lambda acc, ds: acc + len(ds) if len(ds) > 1 else acc, county_details.values(), 0)
         if "num_split_counties" in self.metric_ids:
             compactness_metrics["num_split_counties"] = reduce(lambda acc, ds: acc + 1 if len(ds) > 1 else acc, county_details.values(), 0)
         if self.compute_municipal_details:
-            county_details = self.county_split_details(part, municipalities=True)
+            with self._timed("municipal_splits"):
+                county_details = self.county_split_details(part, municipalities=True)
         if "num_municipal_pieces" in self.metric_ids:
             compactness_metrics["num_municipal_pieces"] = reduce(lambda acc, ds: acc + len(ds) if len(ds) > 1 else acc, county_details.values(), 0)
         if "num_split_municipalities" in self.metric_ids:
             compactness_metrics["num_split_municipalities"] = reduce(lambda acc, ds: acc + 1 if len(ds) > 1 else acc, county_details.values(), 0)
-        if "num_double_bunked" in self.metric_ids:
-            compactness_metrics["num_double_bunked"] = reduce(lambda acc, n: acc + 1 if n > 1 else acc, part[self.incumbent_col].values(), 0)
-        if "num_zero_bunked" in self.metric_ids:
-            compactness_metrics["num_zero_bunked"] = reduce(lambda acc, n: acc + 1 if n == 0 else acc, part[self.incumbent_col].values(), 0)
-        if "num_traversals" in self.metric_ids:
-            compactness_metrics["num_traversals"] = self.num_traversals(part)
         return compactness_metrics
 
     def demographic_metrics(self, part):
-        return {demo_col: part[demo_col] for demo_col in self.demographic_cols}
+        tallies = self.district_tallies(part) if self.vectorized else part
+        with self._timed("col_tally"):
+            return {demo_col: tallies[demo_col] for demo_col in self.demographic_cols}
 
     def eguia_metric(self, part, e):
         seat_share = part[e].seats(self.party) / len(part.parts)
@@ -108,38 +381,131 @@ class PlanMetrics:
         return seat_share - ideal
 
     def partisan_metrics(self, part):
+        if self.vectorized_elections:
+            return self._vectorized_partisan_metrics(part)
         election_metrics = {}
 
         ## Plan wide
-        election_results = np.array([np.array(part[e].percents(self.party)) for e in self.elections])
-        election_stability = (election_results > 0.5).sum(axis=0)
+        with self._timed("election_results"):
+            election_results = np.array([np.array(part[e].percents(self.party)) for e in self.elections])
+            election_stability = (election_results > 0.5).sum(axis=0)
         if  "num_competitive_districts" in self.metric_ids:
-            election_metrics["num_competitive_districts"] = int(np.logical_and(election_results > 0.47, 
-                                                                               election_results < 0.53).sum())
+            with self._timed("num_competitive_districts"):
+                election_metrics["num_competitive_districts"] = int(np.logical_and(election_results > 0.47, 
+                                                                                   election_results < 0.53).sum())
         if "num_swing_districts" in self.metric_ids:
-            election_metrics["num_swing_districts"] = int(np.logical_and(election_stability != 0, 
-                                                      election_stability != len(self.elections)).sum())
+            with self._timed("num_swing_districts"):
+                election_metrics["num_swing_districts"] = int(np.logical_and(election_stability != 0, 
+                                                          election_stability != len(self.elections)).sum())
         if "num_party_districts" in self.metric_ids:
-            election_metrics["num_party_districts"] = int((election_stability == len(self.elections)).sum())
+            with self._timed("num_party_districts"):
+                election_metrics["num_party_districts"] = int((election_stability == len(self.elections)).sum())
         if "num_op_party_districts" in self.metric_ids:
-            election_metrics["num_op_party_districts"] = int((election_stability == 0).sum())
+            with self._timed("num_op_party_districts"):
+                election_metrics["num_op_party_districts"] = int((election_stability == 0).sum())
         if "num_party_wins_by_district" in self.metric_ids:
-            election_metrics["num_party_wins_by_district"] = [int(d_wins) for d_wins in election_stability]
+            with self._timed("num_party_wins_by_district"):
+                election_metrics["num_party_wins_by_district"] = [int(d_wins) for d_wins in election_stability]
         # Election level
         if "seats" in self.metric_ids:
-            election_metrics["seats"] = {part[e].election.name: part[e].seats(self.party) for e in self.elections}
+            with self._timed("seats"):
+                election_metrics["seats"] = {part[e].election.name: part[e].seats(self.party) for e in self.elections}
         if "efficiency_gap" in self.metric_ids:
-            election_metrics["efficiency_gap"] = {part[e].election.name: part[e].efficiency_gap() for e in self.elections}
+            with self._timed("efficiency_gap"):
+                election_metrics["efficiency_gap"] = {part[e].election.name: part[e].efficiency_gap() for e in self.elections}
         if "mean_median" in self.metric_ids:
-            election_metrics["mean_median"] = {part[e].election.name: part[e].mean_median() for e in self.elections}
+            with self._timed("mean_median"):
+                election_metrics["mean_median"] = {part[e].election.name: part[e].mean_median() for e in self.elections}
         if "partisan_bias" in self.metric_ids:
-            election_metrics["partisan_bias"] = {part[e].election.name: part[e].partisan_bias() for e in self.elections}
+            with self._timed("partisan_bias"):
+                election_metrics["partisan_bias"] = {part[e].election.name: part[e].partisan_bias() for e in self.elections}
         if "eguia_county" in self.metric_ids:
-            election_metrics["eguia_county"] = {part[e].election.name: self.eguia_metric(part, e) for e in self.elections}
+            with self._timed("eguia_county"):
+                election_metrics["eguia_county"] = {part[e].election.name: self.eguia_metric(part, e) for e in self.elections}
 
         return election_metrics
     
+    def _vectorized_partisan_metrics(self, part):
+        """
+        `partisan_metrics` computed for all elections at once from `district_votes`.  Follows the
+        `ElectionResults` definitions (districts in `part.parts` order, mean-median, efficiency gap
+        and partisan bias from the first party's point of view) and sums over districts in the
+        same order, so the values match the updaters'.
+        """
+        election_metrics = {}
+        votes = self.district_votes(part)
+        with self._timed("election_results"):
+            elections = np.arange(len(self.elections))
+            totals = votes.sum(axis=2)
+            shares = np.divide(votes, totals[:, :, None], out=np.full(votes.shape, np.nan), where=totals[:, :, None] > 0)
+            party_votes = votes[:, elections, self.party_index]
+            # Shares are laid out (elections x districts) so means and medians reduce each election's row.
+            party_shares = np.ascontiguousarray(shares[:, elections, self.party_index].T)
+            first_party_shares = np.ascontiguousarray(shares[:, :, 0].T)
+
+        ## Plan wide
+        election_stability = (party_shares > 0.5).sum(axis=0)
+        if  "num_competitive_districts" in self.metric_ids:
+            with self._timed("num_competitive_districts"):
+                election_metrics["num_competitive_districts"] = int(np.logical_and(party_shares > 0.47,
+                                                                                   party_shares < 0.53).sum())
+        if "num_swing_districts" in self.metric_ids:
+            with self._timed("num_swing_districts"):
+                election_metrics["num_swing_districts"] = int(np.logical_and(election_stability != 0,
+                                                          election_stability != len(self.elections)).sum())
+        if "num_party_districts" in self.metric_ids:
+            with self._timed("num_party_districts"):
+                election_metrics["num_party_districts"] = int((election_stability == len(self.elections)).sum())
+        if "num_op_party_districts" in self.metric_ids:
+            with self._timed("num_op_party_districts"):
+                election_metrics["num_op_party_districts"] = int((election_stability == 0).sum())
+        if "num_party_wins_by_district" in self.metric_ids:
+            with self._timed("num_party_wins_by_district"):
+                election_metrics["num_party_wins_by_district"] = election_stability.tolist()
+        # Election level
+        with self._timed("seats"):
+            seats = (party_votes[:, :, None] >= votes).all(axis=2).sum(axis=0).tolist()
+        if "seats" in self.metric_ids:
+            with self._timed("seats"):
+                election_metrics["seats"] = dict(zip(self.election_names, seats))
+        if "efficiency_gap" in self.metric_ids:
+            with self._timed("efficiency_gap"):
+                first, second = votes[:, :, 0], votes[:, :, 1]
+                half = (first + second) / 2
+                first_wins = first > second
+                wasted = np.where(first_wins, second, second - half) - np.where(first_wins, first - half, first)
+                # Summed district by district (`cumsum` doesn't sum pairwise), as the updaters do.
+                efficiency_gap = np.cumsum(wasted, axis=0)[-1] / np.cumsum(totals, axis=0)[-1]
+                election_metrics["efficiency_gap"] = dict(zip(self.election_names, efficiency_gap.tolist()))
+        if "mean_median" in self.metric_ids:
+            with self._timed("mean_median"):
+                mean_median = np.median(first_party_shares, axis=1) - np.mean(first_party_shares, axis=1)
+                election_metrics["mean_median"] = dict(zip(self.election_names, mean_median.tolist()))
+        if "partisan_bias" in self.metric_ids:
+            with self._timed("partisan_bias"):
+                above_mean = (first_party_shares > np.mean(first_party_shares, axis=1)[:, None]).sum(axis=1)
+                partisan_bias = above_mean / len(part.parts) - 0.5
+                election_metrics["partisan_bias"] = dict(zip(self.election_names, partisan_bias.tolist()))
+        if "eguia_county" in self.metric_ids:
+            with self._timed("eguia_county"):
+                election_metrics["eguia_county"] = {name: num_seats / len(part.parts) - ideal
+                                                    for name, num_seats, ideal in zip(self.election_names, seats, self.eguia_ideals)}
+
+        return election_metrics
+
     def num_traversals(self, part):
+        """
+        Number of distinct (district, county pair) combinations joined by an edge inside a district,
+        computed over the inter-county edge index only.
+        """
+        if not self.vectorized:
+            return self._num_traversals(part)
+        assignment, districts = self.assignment_array(part)
+        heads = assignment[self.county_edge_heads]
+        intra = heads == assignment[self.county_edge_tails]
+        return len(np.unique(heads[intra] * self.num_county_pairs + self.county_edge_pairs[intra]))
+
+    def _num_traversals(self, part):
         unique_county_pairs = {district: set() for district in part.assignment.values()}
         for (n1, n2) in part.graph.edges:
             if (n1, n2) not in part.cut_edges:
@@ -173,3 +539,221 @@ class PlanMetrics:
             plan_metrics["plan_id"] = plan_name
         return plan_metrics
 
+
+NOT_TIMED = nullcontext()
+
+
+class MetricTimer:
+    """
+    Cumulative wall time and number of calls per label (a metric id, or a stage such as
+    "assignment" or "district_tallies" whose work several metrics share).  Timed blocks may
+    nest; each block is only charged for its own time, excluding the blocks nested in it, so the
+    totals add up to the time spent in timed blocks.
+    """
+    def __init__(self) -> None:
+        self.seconds = {}
+        self.calls = {}
+        self._nested = []
+
+    @contextmanager
+    def __call__(self, label):
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            own = elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            self.seconds[label] = self.seconds.get(label, 0.0) + own
+            self.calls[label] = self.calls.get(label, 0) + 1
+
+    def merge(self, other):
+        """
+        Adds the totals of another `MetricTimer` (e.g. from a worker process) to this one.
+        """
+        for label, seconds in other.seconds.items():
+            self.seconds[label] = self.seconds.get(label, 0.0) + seconds
+            self.calls[label] = self.calls.get(label, 0) + other.calls[label]
+
+    def summary(self):
+        """
+        The totals as a dictionary, labels sorted from most to least time spent.
+        """
+        total = sum(self.seconds.values())
+        return {
+            "total_seconds": total,
+            "labels": {label: {"calls": self.calls[label],
+                               "seconds": seconds,
+                               "mean_ms": 1000 * seconds / self.calls[label],
+                               "share": seconds / total if total > 0 else 0.0}
+                       for label, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])}
+        }
+
+    def write(self, path):
+        with open(path, "w") as fout:
+            json.dump(self.summary(), fout, indent=2)
+
+
+def timing_path(stats_path):
+    """
+    Where the timing summary of the ensemble stats at `stats_path` is written.
+    """
+    base = stats_path[:-len(".jsonl.gz")] if stats_path.endswith(".jsonl.gz") else stats_path
+    return base + ".timing.json"
+
+
+def csr_index(rows, num_rows):
+    """
+    Groups positions 0..len(rows)-1 by their row.  Returns (indptr, indices) such that
+    `indices[indptr[r]:indptr[r + 1]]` are the positions whose row is `r`.
+    """
+    indices = np.argsort(rows, kind="stable")
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+    return indptr, indices
+
+def csr_gather(indptr, indices, rows):
+    """
+    Concatenation of the CSR rows `rows` (see `csr_index`).
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(lengths.sum())]
+
+
+class IncrementalPlanMetrics(PlanMetrics):
+    """
+    PlanMetrics for scoring the consecutive plans of a chain.  Keeps per-district state (how many
+    nodes of each county/municipality each district holds and how many intra-district edges join
+    each pair of counties) and, when a plan is a flip of the last plan it saw, only updates the
+    nodes that moved and the edges touching them.  Any other plan (e.g. the first) is a full
+    recompute.  The demographic and incumbent tallies and the election vote totals are kept by
+    district too, moving the votes and counts of the flipped nodes from their old district to their
+    new one.  That is exact for whole numbers only, so fractional tally columns and votes are read
+    from the updaters (`district_tallies`, `district_votes`).
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # Only the whole columns' sums are read (see `district_tallies`), so the fractional ones may drift.
+        self._incremental_tallies = self.vectorized
+        self._incremental_votes = self.vectorized_elections and self.whole_votes
+        if "num_traversals" in self.metric_ids:
+            nodes = np.concatenate([self.county_edge_heads, self.county_edge_tails])
+            self._node_edge_indptr, edges = csr_index(nodes, len(self.nodes))
+            self._node_edge_ids = edges % len(self.county_edge_heads) if len(edges) > 0 else edges
+        self._state_part = None
+
+    def update(self, part):
+        """
+        Brings the per-district state up to date with `part`.  Should be called with every plan
+        of the chain (including those that aren't scored) to keep the updates incremental.
+        """
+        if part is self._state_part:
+            return
+        if part.parent is not None and part.parent is self._state_part and part.flips is not None:
+            self._apply_flips(part.flips)
+        else:
+            self._initialize_state(part)
+        self._state_part = part
+
+    def _initialize_state(self, part):
+        assignment, districts = PlanMetrics.assignment_array(self, part)
+        self._assignment = assignment.copy()
+        self._districts = districts
+        self._district_index = {district: i for i, district in enumerate(districts)}
+        num_districts = len(districts)
+
+        if self.compute_counties_details:
+            self._county_counts = np.zeros((len(self.county_list), num_districts), dtype=np.int64)
+            np.add.at(self._county_counts, (self.county_ids, assignment), 1)
+            self._county_touches = (self._county_counts > 0).sum(axis=1)
+        if self.compute_municipal_details:
+            self._muni_counts = np.zeros((len(self.municipality_list), num_districts), dtype=np.int64)
+            np.add.at(self._muni_counts, (self.municipal_ids, assignment[self.municipal_nodes]), 1)
+            self._muni_touches = (self._muni_counts > 0).sum(axis=1)
+        if "num_traversals" in self.metric_ids:
+            self._pair_counts = np.zeros((num_districts, self.num_county_pairs), dtype=np.int64)
+            self._add_traversals(np.arange(len(self.county_edge_heads)), 1)
+        if self._incremental_tallies:
+            self._tally_sums = np.zeros((num_districts, self.tallies.shape[1]))
+            np.add.at(self._tally_sums, assignment, self.tallies)
+        if self._incremental_votes:
+            self._vote_sums = np.zeros((num_districts, *self.votes.shape[1:]))
+            np.add.at(self._vote_sums, assignment, self.votes)
+
+    def _add_traversals(self, edges, sign):
+        heads = self._assignment[self.county_edge_heads[edges]]
+        intra = heads == self._assignment[self.county_edge_tails[edges]]
+        np.add.at(self._pair_counts, (heads[intra], self.county_edge_pairs[edges][intra]), sign)
+
+    @staticmethod
+    def _move(counts, touches, rows, old, new):
+        np.add.at(counts, (rows, old), -1)
+        np.add.at(counts, (rows, new), 1)
+        rows = np.unique(rows)
+        touches[rows] = (counts[rows] > 0).sum(axis=1)
+
+    @staticmethod
+    def _shift(sums, values, old, new):
+        """
+        Moves the `values` of the flipped nodes from the sums of their `old` districts to their `new` ones.
+        """
+        np.subtract.at(sums, old, values)
+        np.add.at(sums, new, values)
+
+    def _apply_flips(self, flips):
+        nodes = self._node_positions(flips.keys())
+        new = np.fromiter((self._district_index[d] for d in flips.values()), dtype=np.int64, count=len(flips))
+        old = self._assignment[nodes]
+        moved = old != new
+        nodes, old, new = nodes[moved], old[moved], new[moved]
+        if len(nodes) == 0:
+            return
+
+        if "num_traversals" in self.metric_ids:
+            edges = np.unique(csr_gather(self._node_edge_indptr, self._node_edge_ids, nodes))
+            self._add_traversals(edges, -1)
+        self._assignment[nodes] = new
+        if "num_traversals" in self.metric_ids:
+            self._add_traversals(edges, 1)
+
+        if self.compute_counties_details:
+            self._move(self._county_counts, self._county_touches, self.county_ids[nodes], old, new)
+        if self.compute_municipal_details:
+            counts = self.municipal_indptr[nodes + 1] - self.municipal_indptr[nodes]
+            self._move(self._muni_counts, self._muni_touches, csr_gather(self.municipal_indptr, self.municipal_ids, nodes),
+                       np.repeat(old, counts), np.repeat(new, counts))
+        if self._incremental_tallies:
+            self._shift(self._tally_sums, self.tallies[nodes], old, new)
+        if self._incremental_votes:
+            self._shift(self._vote_sums, self.votes[nodes], old, new)
+
+    def assignment_array(self, part):
+        self.update(part)
+        return self._assignment, self._districts
+
+    def tally_sums(self, part):
+        if not self._incremental_tallies:
+            return super().tally_sums(part)
+        self.update(part)
+        return self._tally_sums.copy()
+
+    def district_votes(self, part):
+        if not self._incremental_votes:
+            return super().district_votes(part)
+        with self._timed("district_votes"):
+            self.update(part)
+            return self._vote_sums.copy()
+
+    def split_metrics(self, part, municipalities=False):
+        self.update(part)
+        touches = self._muni_touches if municipalities else self._county_touches
+        split = touches > 1
+        return int(touches[split].sum()), int(split.sum())
+
+    def num_traversals(self, part):
+        self.update(part)
+        return int(np.count_nonzero(self._pair_counts))
@@ -1,4 +1,5 @@
 from plotting_configuration import *
+from columnar_stats import ColumnarPlans, columnar_path, load_columnar_stats
 import matplotlib.pyplot as plt
 import numpy as np
 import random
@@ -48,10 +49,16 @@ class PlotFactory:
         if output_dir is None:
             output_dir = f"{state}/plots"
 
-        with gzip.open(f"{ensemble_dir}/{state.lower()}_{plan_type}_{eps}_bal_{steps}_steps_{method}.jsonl.gz", "rb") as fe:
-            ensemble_list = list(fe)
-        ensemble_summary = json.loads(ensemble_list[0])
-        self.ensemble_plans = [json.loads(j) for j in ensemble_list if json.loads(j)["type"] == "ensemble_plan"]
+        ensemble_file = f"{ensemble_dir}/{state.lower()}_{plan_type}_{eps}_bal_{steps}_steps_{method}.jsonl.gz"
+        if os.path.isdir(columnar_path(ensemble_file)):
+            # Memory-map the columnar copy written by `collect_scores.py --columnar` instead of parsing the jsonl.
+            ensemble_summary, ensemble_columns = load_columnar_stats(columnar_path(ensemble_file))
+            self.ensemble_plans = ColumnarPlans(ensemble_summary, ensemble_columns)
+        else:
+            with gzip.open(ensemble_file, "rb") as fe:
+                ensemble_list = [json.loads(j) for j in fe]
+            ensemble_summary = ensemble_list[0]
+            self.ensemble_plans = [plan for plan in ensemble_list if plan["type"] == "ensemble_plan"]
         def get_maxpopdev(plan):
             totpop = plan["TOTPOP"]
             population = sum(totpop.values())
@@ -125,6 +132,10 @@ class PlotFactory:
         plans = getattr(self, f"{kind}_plans")
 
         elections = self.election_names if kind=="ensemble" or kind=="citizen" else self.proposed_election_names
+        if isinstance(plans, ColumnarPlans):
+            if self.ensemble_metrics[score]["type"] == "election_level":
+                return plans.aggregate(score, labels=elections)
+            return plans.aggregate(score)
         if self.ensemble_metrics[score]["type"] == "plan_wide":
             aggregation = []
             for plan in plans:
@@ -3,29 +3,138 @@ from gerrychain.updaters import Tally
 from gerrychain.tree import recursive_tree_part
 from gerrychain.proposals import ReCom
 from pcompress import Record
-from functools import partial
+from chain_index import ChainIndexWriter, index_path, build_index
+from chain_io import chain_set_files, manifest_path, concatenate_chains
+import itertools
+import multiprocessing
+import numpy as np
 import warnings
+import hashlib
+import random
+import shutil
+import json
+import os
 from region_aware import *
+from array_tree import ArrayBipartition
+from multi_scale import MultiScaleReCom, BlockPartition
 import tqdm
 
+## Spanning tree engines of the ReCom proposal: "networkx" (gerrychain's and `region_aware`'s
+## bipartitions), "array" (`array_tree`, the same distribution computed on arrays) or "wilson"
+## (`array_tree` with uniform spanning trees drawn by Wilson's algorithm).
+TREE_ENGINES = ["networkx", "array", "wilson"]
+
+
+def checkpoint_path(chain_path):
+    base = chain_path[:-len(".chain")] if chain_path.endswith(".chain") else chain_path
+    return base + ".checkpoint.json"
+
+def segments_dir(chain_path):
+    base = chain_path[:-len(".chain")] if chain_path.endswith(".chain") else chain_path
+    return base + ".segments"
+
+def segment_path(chain_path, segment):
+    return "{}/{:05d}.chain".format(segments_dir(chain_path), segment)
+
+def rng_state():
+    """
+    The states of `random` and of NumPy's global generator, as JSON.
+    """
+    version, internal, gauss_next = random.getstate()
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {"random": [version, list(internal), gauss_next],
+            "numpy": [name, keys.tolist(), pos, has_gauss, cached_gaussian]}
+
+def set_rng_state(state):
+    version, internal, gauss_next = state["random"]
+    random.setstate((version, tuple(internal), gauss_next))
+    name, keys, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+def seed_numpy_from_random():
+    """
+    Seeds NumPy's global generator, which jitters the region-aware and array spanning trees, with
+    a draw from `random`, so that a chain seeded with `random.seed` alone is reproducible.
+    """
+    np.random.seed(random.getrandbits(32))
+
+def write_checkpoint(path, checkpoint):
+    """
+    Replaces the checkpoint at `path` atomically, so a job killed while writing it leaves the
+    previous one.
+    """
+    with open(path + ".tmp", "w") as fout:
+        json.dump(checkpoint, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(path + ".tmp", path)
+
+def vtds_digest(graph, vtds):
+    """
+    A digest of the VTD of every node of `graph`, for checking that a multi-scale chain resumes
+    with the VTDs it was checkpointed with.
+    """
+    return hashlib.sha256(json.dumps([str(vtds[n]) for n in graph.nodes]).encode()).hexdigest()
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as fin:
+        return json.load(fin)
+
 class ChainRecorder:
-    def __init__(self, graph, output_dir, pop_col, county_col=None, verbose_freq=None) -> None:
+    def __init__(self, graph, output_dir, pop_col, county_col=None, verbose_freq=None, columns=None,
+                 tree_engine="networkx", vtds=None, division_weight=0.1) -> None:
+        """
+        `columns` optionally gives the population and county columns as a `SharedGraph` of `graph`,
+        which the county-aware proposal then reads instead of the node attributes.  `tree_engine`
+        is one of `TREE_ENGINES`: "networkx" (gerrychain's trees), "array" (`array_tree.py`, the
+        same trees with NumPy) or "wilson" (`array_tree.py` with uniform spanning trees drawn by
+        Wilson's algorithm, whose walks step across county lines `division_weight` times as often
+        in county-aware chains).  With `vtds` (the VTD of every node of a block dual graph `graph`,
+        see `multi_scale.block_vtds`), the chains are multi-scale: their proposal is a
+        `MultiScaleReCom`, which moves whole VTDs and splits them into blocks only where a balanced
+        cut needs it, their partitions are `BlockPartition`s, and the tree engine isn't used.
+        """
+        if tree_engine not in TREE_ENGINES:
+            raise ValueError("Unknown tree engine {}; expected one of {}".format(tree_engine, TREE_ENGINES))
         self.graph = graph
+        self.columns = columns
         self.output_dir = output_dir
         self.pop_col = pop_col
         self.county_col = county_col
         self.verbose_freq = verbose_freq
+        self.tree_engine = tree_engine
+        self.division_weight = division_weight
+        self.vtds = vtds
 
         ## Set up pop info
-        self.tot_pop = sum([graph.nodes()[n][pop_col] for n in graph.nodes()])
+        if columns is not None:
+            self.tot_pop = sum(columns.node_column(pop_col).tolist())
+        else:
+            self.tot_pop = sum([graph.nodes()[n][pop_col] for n in graph.nodes()])
         self.updaters = {"population": Tally(pop_col, alias="population")}
 
     def _initial_partition(self, num_districts, epsilon):
         ideal_pop = self.tot_pop / num_districts
         cddict = recursive_tree_part(self.graph, range(num_districts), ideal_pop, self.pop_col,
                                      epsilon)
-        part = Partition(self.graph, assignment=cddict, updaters=self.updaters)
-        return part
+        return self.get_partition(cddict)
+
+    def _bipartition_method(self, county_aware):
+        """
+        The bipartition method of the ReCom proposal, or None for gerrychain's default.
+        """
+        county_aware = county_aware and self.county_col is not None
+        division_tuples = [(self.county_col, 1)] if county_aware else []
+        if self.tree_engine in ["array", "wilson"]:
+            return ArrayBipartition(self.graph, self.pop_col, division_tuples, first_check_division=county_aware,
+                                    columns=self.columns, wilson=self.tree_engine == "wilson",
+                                    division_weight=self.division_weight)
+        if county_aware:
+            return DivisionBipartition(self.graph, self.pop_col, division_tuples, first_check_division=True,
+                                       columns=self.columns)
+        return None
 
     def _proposal(self, num_districts, epsilon, county_aware):
         ideal_pop = self.tot_pop / num_districts
@@ -34,19 +143,32 @@ class ChainRecorder:
             warnings.warn("County column needs to be specified to run county aware chains.  Defaulting\
                           to running neutral chain with other settings.")
 
-        if county_aware and self.county_col is not None:
-            return ReCom(self.pop_col, ideal_pop, epsilon,
-                         method=partial(division_bipartition_tree, division_tuples=[(self.county_col, 1)],
-                                        first_check_division=True))
+        if self.vtds is not None:
+            return MultiScaleReCom(self.graph, self.vtds, self.pop_col, ideal_pop, epsilon,
+                                   county_col=self.county_col if county_aware else None, columns=self.columns)
+
+        method = self._bipartition_method(county_aware)
+        if method is not None:
+            return ReCom(self.pop_col, ideal_pop, epsilon, method=method)
         else:
             return ReCom(self.pop_col, ideal_pop, epsilon)
 
     def get_partition(self, ddict):
-        part = Partition(self.graph, assignment=ddict, updaters=self.updaters)
+        ## Multi-scale chains step with a BlockPartition, which is cheaper to flip on a block dual graph.
+        partition_class = Partition if self.vtds is None else BlockPartition
+        part = partition_class(self.graph, assignment=ddict, updaters=self.updaters)
         return part
 
     def record_chain(self, num_districts, epsilon, steps, file_name, county_aware=False,
-                     initial_partition=None):
+                     initial_partition=None, index=False, snapshot_every=100, scorer=None, record=True):
+        """
+        Records a chain to `output_dir/file_name`.  With `index`, also writes the chain's index
+        (see `chain_index.py`) next to it, so its steps can be read without replaying the chain.
+        With a `scorer` (a `chain_scoring.ChainScorer`), every step is also passed to it to be
+        scored as the chain runs; then `record=False` skips writing the chain itself.  If the
+        chain fails, the scorer is stopped before the error is raised.
+        """
+        seed_numpy_from_random()
         if initial_partition is None:
             initial_partition = self._initial_partition(num_districts, epsilon)
 
@@ -58,6 +180,174 @@ class ChainRecorder:
                             accept=accept_func, initial_state=initial_partition,
                             total_steps=steps)
 
-        for i, part in  enumerate(Record(tqdm.tqdm(chain), "{}/{}".format(self.output_dir, file_name))):
-            if self.verbose_freq is not None and i % self.verbose_freq == self.verbose_freq - 1:
-                print("*", end="", flush=True)
+        chain_path = "{}/{}".format(self.output_dir, file_name)
+        writer = ChainIndexWriter(index_path(chain_path), len(self.graph.nodes), snapshot_every) if index and record else None
+        previous = None
+        plans = Record(tqdm.tqdm(chain), chain_path) if record else tqdm.tqdm(chain)
+        try:
+            for i, part in  enumerate(plans):
+                if writer is not None:
+                    writer.add_partition(part, previous)
+                if scorer is not None:
+                    scorer.add_partition(part, previous)
+                previous = part
+                if self.verbose_freq is not None and i % self.verbose_freq == self.verbose_freq - 1:
+                    print("*", end="", flush=True)
+        except BaseException:
+            # The scoring process would otherwise wait for more steps, and the job would hang at exit.
+            if scorer is not None:
+                scorer.terminate()
+            raise
+        if writer is not None:
+            writer.close()
+        if scorer is not None:
+            scorer.close()
+
+    def record_checkpointed_chain(self, num_districts, epsilon, steps, file_name, checkpoint_every=None,
+                                  county_aware=False, initial_partition=None, index=False, snapshot_every=100,
+                                  resume=False):
+        """
+        Records a chain to `output_dir/file_name` like `record_chain`, in segments of
+        `checkpoint_every` steps.  After each segment, the current assignment, step, random number
+        generator states and proposal settings (with a digest of the `vtds` of a multi-scale chain)
+        are written atomically to a `.checkpoint.json` next to the chain.  Every segment is a
+        complete chain in a `.segments` directory, and the next segment starts over from a new
+        partition with the checkpointed assignment.  Once the last segment is recorded, the
+        segments are joined into the chain, and the checkpoint and then the segments are removed.
+
+        With `resume`, the chain continues from its checkpoint, dropping any unfinished segment,
+        so a run killed at any point and resumed records the same chain as one that wasn't
+        (with the same `checkpoint_every`, which defaults to the checkpointed one when resuming).
+        """
+        chain_path = "{}/{}".format(self.output_dir, file_name)
+        nodes = list(self.graph.nodes)
+        saved = load_checkpoint(checkpoint_path(chain_path)) if resume else None
+        if resume and saved is None:
+            raise FileNotFoundError("{} has no checkpoint to resume from".format(chain_path))
+        if checkpoint_every is None:
+            if saved is None:
+                raise ValueError("checkpoint_every is needed to start a checkpointed chain")
+            checkpoint_every = saved["settings"]["checkpoint_every"]
+        settings = {"num_districts": num_districts, "epsilon": epsilon, "steps": steps, "county_aware": county_aware,
+                    "checkpoint_every": checkpoint_every, "tree_engine": self.tree_engine,
+                    "division_weight": self.division_weight, "pop_col": self.pop_col,
+                    "county_col": self.county_col,
+                    "vtds": None if self.vtds is None else vtds_digest(self.graph, self.vtds)}
+        if resume:
+            if saved["settings"] != settings:
+                raise ValueError("The chain was checkpointed with different settings: {}".format(saved["settings"]))
+            step, segment, assignment = saved["step"], saved["segments"], saved["assignment"]
+            set_rng_state(saved["rng"])
+            os.makedirs(segments_dir(chain_path), exist_ok=True)
+            for segment_file in os.listdir(segments_dir(chain_path)):
+                if int(segment_file.split(".")[0]) >= segment:
+                    os.remove("{}/{}".format(segments_dir(chain_path), segment_file))
+        else:
+            seed_numpy_from_random()
+            if initial_partition is None:
+                initial_partition = self._initial_partition(num_districts, epsilon)
+            shutil.rmtree(segments_dir(chain_path), ignore_errors=True)
+            os.makedirs(segments_dir(chain_path))
+            step, segment, assignment = 0, 0, [int(initial_partition.assignment[n]) for n in nodes]
+
+        def checkpoint():
+            write_checkpoint(checkpoint_path(chain_path), {"settings": settings, "step": step, "segments": segment,
+                                                           "assignment": assignment, "rng": rng_state()})
+        if not resume:
+            checkpoint()
+
+        proposal = self._proposal(num_districts, epsilon, county_aware)
+        accept_func = accept.always_accept
+        progress = tqdm.tqdm(total=steps, initial=step)
+        while step < steps:
+            part = self.get_partition(dict(zip(nodes, assignment)))
+            cs = [constraints.within_percent_of_ideal_population(part, epsilon)]
+            segment_steps = min(checkpoint_every, steps - step)
+            # After the first segment, the segment's initial state is the previous segment's last step.
+            chain = MarkovChain(proposal=proposal, constraints=cs, accept=accept_func, initial_state=part,
+                                total_steps=segment_steps + (step > 0))
+            for part in Record(itertools.islice(chain, int(step > 0), None), segment_path(chain_path, segment)):
+                progress.update()
+                step += 1
+                if self.verbose_freq is not None and step % self.verbose_freq == 0:
+                    print("*", end="", flush=True)
+            segment += 1
+            assignment = [int(part.assignment[n]) for n in nodes]
+            checkpoint()
+        progress.close()
+
+        # A resumed chain may have been killed while joining the segments, so they're joined again.
+        concatenate_chains([segment_path(chain_path, i) for i in range(segment)], chain_path)
+        if index:
+            build_index(chain_path, snapshot_every=snapshot_every)
+        # Without its checkpoint the chain counts as finished, so the segments are removed after it.
+        os.remove(checkpoint_path(chain_path))
+        shutil.rmtree(segments_dir(chain_path))
+
+    def record_chains(self, num_districts, epsilon, steps, file_name, num_chains, workers=1, seed=None,
+                      county_aware=False, initial_partition=None, independent_starts=False, index=False,
+                      snapshot_every=100, checkpoint_every=None, resume=False):
+        """
+        Records a set of `num_chains` independent chains in place of `output_dir/file_name`, in up
+        to `workers` processes.  The `steps` of the ensemble are split between the chains, the
+        first `steps % num_chains` chains taking one step more.  With `checkpoint_every` or
+        `resume`, each chain is recorded with `record_checkpointed_chain`; resuming skips the
+        finished chains, resumes the checkpointed ones and starts any others over with
+        `checkpoint_every`, which resuming a set therefore needs.  Chain i is written to
+        `file_name` with `_i` before `.chain`, with `random` and NumPy seeded by the i-th seed
+        spawned from `seed`.  Every chain starts from `initial_partition` (or one drawn with
+        `seed`), unless `independent_starts`, in which case each draws its own.  Once every chain
+        is recorded, a manifest listing them, their seeds and their steps is written next to them
+        (see `chain_io.load_chain_set`).  Returns the manifest's path.
+        """
+        if resume and checkpoint_every is None:
+            raise ValueError("checkpoint_every is needed to resume a chain set, for chains that never started")
+        seed = random.SystemRandom().randrange(2 ** 32) if seed is None else seed
+        seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(num_chains)]
+        if initial_partition is None and not independent_starts:
+            random.seed(seed)
+            np.random.seed(seed)
+            initial_partition = self._initial_partition(num_districts, epsilon)
+        chain_files = chain_set_files(file_name, num_chains)
+        chain_steps = [steps // num_chains + (i < steps % num_chains) for i in range(num_chains)]
+
+        ## The forked workers read the recorder and the settings from here rather than having them pickled.
+        global _chain_set
+        _chain_set = (self, dict(num_districts=num_districts, epsilon=epsilon, county_aware=county_aware,
+                                 initial_partition=initial_partition, index=index, snapshot_every=snapshot_every,
+                                 checkpoint_every=checkpoint_every, resume=resume))
+        jobs = list(zip(chain_files, seeds, chain_steps))
+        if workers > 1:
+            with multiprocessing.get_context("fork").Pool(min(workers, num_chains)) as pool:
+                pool.map(_record_chain_of_set, jobs, chunksize=1)
+        else:
+            for job in jobs:
+                _record_chain_of_set(job)
+        _chain_set = None
+
+        manifest = {"chains": chain_files, "seeds": seeds, "seed": seed, "steps": steps, "chain_steps": chain_steps,
+                    "num_districts": num_districts,
+                    "epsilon": epsilon, "county_aware": county_aware, "independent_starts": independent_starts,
+                    "tree_engine": self.tree_engine, "division_weight": self.division_weight}
+        path = manifest_path("{}/{}".format(self.output_dir, file_name))
+        with open(path, "w") as fout:
+            json.dump(manifest, fout, indent=2)
+        return path
+
+_chain_set = None
+
+def _record_chain_of_set(job):
+    file_name, seed, steps = job
+    recorder, settings = _chain_set
+    random.seed(seed)
+    np.random.seed(seed)
+    settings = dict(settings)
+    checkpoint_every, resume = settings.pop("checkpoint_every"), settings.pop("resume")
+    args = (settings.pop("num_districts"), settings.pop("epsilon"), steps, file_name)
+    if checkpoint_every is None and not resume:
+        return recorder.record_chain(*args, **settings)
+    chain_path = "{}/{}".format(recorder.output_dir, file_name)
+    has_checkpoint = os.path.exists(checkpoint_path(chain_path))
+    if resume and not has_checkpoint and os.path.exists(chain_path):
+        return
+    recorder.record_checkpointed_chain(*args, checkpoint_every=checkpoint_every, resume=resume and has_checkpoint, **settings)
@@ -1,19 +1,218 @@
-from networkx.algorithms import tree
 from collections import deque
+from bisect import bisect_right
+from scipy import sparse
+from scipy.sparse.csgraph import minimum_spanning_tree, connected_components
+from plan_metrics import csr_gather
+import networkx as nx
+import numpy as np
+from functools import cached_property
+import weakref
 import random
 from gerrychain.tree import (
-    PopulatedGraph,
     predecessors,
     successors,
-    Cut
 )
 
 
-def division_random_spanning_tree(graph, division_tuples=[("COUNTYFP10", 1)]):
+def node_values(graph, col, columns=None):
+    """
+    The attribute `col` of every node of `graph`, as a dictionary.  Read from `columns` (a
+    `SharedGraph` of the parent graph) when one is passed.
+    """
+    nodes = list(graph.nodes)
+    values = columns.values(col, nodes) if columns is not None else [graph.nodes[n][col] for n in nodes]
+    return dict(zip(nodes, values))
+
+def root_graph(graph):
+    """
+    The graph that `graph` is a (possibly nested) subgraph view of, or `graph` itself.
+    """
+    while hasattr(graph, "_graph"):
+        graph = graph._graph
+    return graph
+
+class DivisionEdges:
+    """
+    The adjacency of a graph as arrays of node positions (in CSR form, so each edge appears once
+    from each end), with the integer codes of every node's divisions and the penalty of every edge
+    for the divisions it crosses.  Built once per graph; `induced` then gives the edges of any
+    node-induced subgraph (e.g. two merged districts) without looking at node attributes.
+    """
+    def __init__(self, graph, division_tuples, columns=None) -> None:
+        self.nodes = list(graph.nodes)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.degrees = np.array([len(graph.adj[n]) for n in self.nodes], dtype=np.int64)
+        self.indptr = np.concatenate([[0], np.cumsum(self.degrees)])
+        self.neighbors = np.array([self.node_index[m] for n in self.nodes for m in graph.adj[n]], dtype=np.int64)
+        self.entries = np.arange(len(self.neighbors))
+        sources = np.repeat(np.arange(len(self.nodes)), self.degrees)
+        self.penalties = np.zeros(len(self.neighbors))
+        self.codes = {}
+        for (division_col, penalty) in division_tuples:
+            codes = {}
+            values = node_values(graph, division_col, columns)
+            # Divisions may be lists (e.g. nodes in several municipalities), compared as a whole.
+            self.codes[division_col] = np.array([codes.setdefault(tuple(v) if type(v) == list else v, len(codes))
+                                                 for v in (values[n] for n in self.nodes)], dtype=np.int64)
+            self.penalties += penalty * (self.codes[division_col][sources] != self.codes[division_col][self.neighbors])
+
+    def positions(self, nodes):
+        return np.fromiter((self.node_index[n] for n in nodes), dtype=np.int64, count=len(nodes))
+
+    def _induced_entries(self, nodes):
+        """
+        The adjacency entries of `nodes` as (heads, tails, entries), with heads and tails given as
+        positions in the list `nodes` (-1 for neighbors outside of `nodes`), in CSR order.
+        """
+        positions = self.positions(nodes)
+        local = np.full(len(self.nodes), -1, dtype=np.int64)
+        local[positions] = np.arange(len(positions))
+        entries = csr_gather(self.indptr, self.entries, positions)
+        heads = np.repeat(np.arange(len(positions)), self.degrees[positions])
+        return heads, local[self.neighbors[entries]], entries
+
+    def induced(self, nodes):
+        """
+        The edges between `nodes`, each once, as (heads, tails, penalties) with heads and tails
+        given as positions in the list `nodes`.
+        """
+        heads, tails, entries = self._induced_entries(nodes)
+        # Neighbors outside of `nodes` have a tail of -1; the rest are kept from their lower end.
+        keep = tails > heads
+        return heads[keep], tails[keep], self.penalties[entries[keep]]
+
+    def adjacency(self, nodes):
+        """
+        The subgraph induced by `nodes` in CSR form, as (indptr, neighbors, penalties) over
+        positions in the list `nodes`.
+        """
+        heads, tails, entries = self._induced_entries(nodes)
+        keep = tails >= 0
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(heads[keep], minlength=len(nodes)))])
+        return indptr, tails[keep], self.penalties[entries[keep]]
+
+    def random_spanning_tree(self, nodes):
+        """
+        A minimum spanning tree of the subgraph induced by `nodes`, with each edge weighted by its
+        penalty plus uniform noise, as (heads, tails) positions in the list `nodes`.
+        """
+        heads, tails, penalties = self.induced(nodes)
+        # The weights must be positive, since the sparse MST treats zero weights as missing edges.
+        weights = penalties + (1 - np.random.random_sample(len(heads)))
+        mst = minimum_spanning_tree(sparse.csr_matrix((weights, (heads, tails)), shape=(len(nodes), len(nodes)))).tocoo()
+        return mst.row, mst.col
+
+    def wilson_spanning_tree(self, nodes, division_weight=None):
+        """
+        A uniformly random spanning tree of the subgraph induced by `nodes`, drawn with Wilson's
+        algorithm: from every node not yet in the tree, a random walk runs until it hits the tree,
+        and the walk with its loops erased joins the tree.  With a `division_weight`, every edge is
+        weighted `division_weight ** penalty` and the walks step along edges in proportion to their
+        weights, so that a tree is drawn in proportion to the product of its edge weights and trees
+        crossing fewer divisions are more likely.  A disconnected subgraph gets a spanning forest.
+        Returns (heads, tails) positions in the list `nodes`, from every node to its parent.
+        """
+        indptr, neighbors, penalties = self.adjacency(nodes)
+        num_nodes = len(nodes)
+        degrees = np.diff(indptr)
+        _, components = connected_components(
+            sparse.csr_matrix((np.ones(len(neighbors)), neighbors, indptr), shape=(num_nodes, num_nodes)), directed=False)
+        # The root doesn't change the distribution of the tree, but walks hit a well connected
+        # root sooner, so each component is rooted at its node of highest degree.
+        order = np.argsort(-degrees, kind="stable")
+        in_tree = [False] * num_nodes
+        for root in order[np.unique(components[order], return_index=True)[1]].tolist():
+            in_tree[root] = True
+        parent = [-1] * num_nodes
+        starts, neighbors = indptr.tolist(), neighbors.tolist()
+        adjacent = [neighbors[first:last] for first, last in zip(starts[:-1], starts[1:])]
+        weighted = division_weight is not None and penalties.any()
+        if weighted:
+            # The upper bounds of every neighbor's share of the node's total weight, but the last.
+            prefix = np.concatenate([[0], np.cumsum(division_weight ** penalties)])
+            rows = np.repeat(np.arange(num_nodes), degrees)
+            bounds = ((prefix[1:] - prefix[indptr[rows]]) / (prefix[indptr[rows + 1]] - prefix[indptr[rows]])).tolist()
+            bounds = [bounds[first:last - 1] for first, last in zip(starts[:-1], starts[1:])]
+        draw = uniform_samples().__next__
+
+        for start in range(num_nodes):
+            node = start
+            while not in_tree[node]:
+                choices = adjacent[node]
+                if weighted:
+                    parent[node] = choices[bisect_right(bounds[node], draw())]
+                else:
+                    parent[node] = choices[int(draw() * len(choices))]
+                node = parent[node]
+            # Following the parents from `start` now traces the walk with its loops erased.
+            node = start
+            while not in_tree[node]:
+                in_tree[node] = True
+                node = parent[node]
+
+        parent = np.array(parent, dtype=np.int64)
+        heads = np.flatnonzero(parent >= 0)
+        return heads, parent[heads]
+
+    def split_scores(self, heads, tails, division_cols):
+        """
+        The split score of the edges between the node labels `heads` and `tails`: a bit mask of the
+        `division_cols` that each edge crosses, the first column being the highest bit, so that
+        edges crossing higher ranked divisions score higher ([8, 4, 2, 1] with 4 divisions).
+        """
+        return self.position_split_scores(self.positions(heads), self.positions(tails), division_cols)
+
+    def position_split_scores(self, heads, tails, division_cols):
+        """
+        `split_scores` of the edges between the node positions `heads` and `tails`.
+        """
+        scores = np.zeros(len(heads), dtype=np.int64)
+        for i, division_col in enumerate(division_cols):
+            codes = self.codes[division_col]
+            scores += (codes[heads] != codes[tails]) << (len(division_cols) - i - 1)
+        return scores
+
+def uniform_samples(batch_size=4096):
+    """
+    An endless stream of `np.random` uniform samples in [0, 1), drawn in batches.
+    """
+    while True:
+        yield from np.random.random_sample(batch_size).tolist()
+
+_division_edges = weakref.WeakKeyDictionary()
+
+def division_edges(graph, division_tuples, columns=None):
+    """
+    The `DivisionEdges` of the graph that `graph` is a subgraph of, cached for the life of that graph.
+    """
+    root = root_graph(graph)
+    cached = _division_edges.setdefault(root, {})
+    key = (tuple(sorted(map(tuple, division_tuples))), id(columns))
+    if key not in cached:
+        cached[key] = DivisionEdges(root, division_tuples, columns)
+    return cached[key]
+
+_node_arrays = weakref.WeakKeyDictionary()
+
+def node_array(graph, col, columns=None):
+    """
+    The attribute `col` of every node of the graph that `graph` is a subgraph of, as an array in
+    the order of its nodes (that of `DivisionEdges.nodes`), cached for the life of that graph.
+    """
+    root = root_graph(graph)
+    cached = _node_arrays.setdefault(root, {})
+    key = (col, id(columns))
+    if key not in cached:
+        cached[key] = np.array(list(node_values(root, col, columns).values()))
+    return cached[key]
+
+def division_random_spanning_tree(graph, division_tuples=[("COUNTYFP10", 1)], columns=None):
     """
     Generates a spanning tree that discourages edges that cross divisions (counties, municipalities, etc).
     We probabilistically assign weights to every edge, and then draw a minumum spanning
     tree over the graph. This means that edges with lower weights will be preferred as the tree is drawn.
+    The division penalty of every edge is computed once per parent graph (see `DivisionEdges`);
+    only the random part of the weights is drawn here, and the graph's edges aren't modified.
 
     Parameters:
     ----------
@@ -22,20 +221,60 @@ def division_random_spanning_tree(graph, division_tuples=[("COUNTYFP10", 1)]):
     division_tuples: list of (str, float)
         A list of tuples where the first element is the division column and the second element is
         the weight penalty added to any edge that spans two divisions of that type.
+    columns: SharedGraph, optional
+        Where to read the division columns from, instead of the graph's node attributes.
     """
-    weights = {edge:0 for edge in graph.edges}
-    for edge in graph.edges:
-        for (division_col, penalty) in division_tuples:
-            if graph.nodes[edge[0]][division_col] != graph.nodes[edge[1]][division_col]:
-                weights[edge] += penalty
-        graph.edges[edge]["weight"] = weights[edge] + random.random()
+    nodes = list(graph.nodes)
+    return spanning_tree_graph(nodes, *division_edges(graph, division_tuples, columns).random_spanning_tree(nodes))
 
-    spanning_tree = tree.minimum_spanning_tree(
-        graph, algorithm="kruskal", weight="weight"
-    )
+def spanning_tree_graph(nodes, heads, tails):
+    """
+    The tree with the edges between the positions `heads` and `tails` of the list `nodes`, as a networkx graph.
+    """
+    spanning_tree = nx.Graph()
+    spanning_tree.add_nodes_from(nodes)
+    spanning_tree.add_edges_from((nodes[head], nodes[tail]) for head, tail in zip(heads.tolist(), tails.tolist()))
     return spanning_tree
 
-def division_find_balanced_edge_cuts_memoization(h, choice=random.choice, division_tuples=None):
+def subtree_nodes(succ, start):
+    """
+    The nodes of the subtree below `start`, given the `successors` of every node of the tree.
+    """
+    nodes = set()
+    queue = deque([start])
+    while queue:
+        next_node = queue.pop()
+        if next_node not in nodes:
+            nodes.add(next_node)
+            if next_node in succ:
+                for c in succ[next_node]:
+                    if c not in nodes:
+                        queue.append(c)
+    return nodes
+
+class LazyCut:
+    """
+    A `Cut` whose subset (the subtree below the cut edge, or the rest of the tree) is only built
+    when it's read, so that of all the balanced cuts found, only the chosen one is materialized.
+    """
+    def __init__(self, edge, succ, tree_nodes, complement=False) -> None:
+        self.edge = edge
+        self.succ = succ
+        self.tree_nodes = tree_nodes
+        self.complement = complement
+
+    @cached_property
+    def subset(self):
+        part_nodes = subtree_nodes(self.succ, self.edge[0])
+        return set(self.tree_nodes) - part_nodes if self.complement else part_nodes
+
+def division_find_balanced_edge_cuts_memoization(h, choice=random.choice, division_tuples=None, columns=None,
+                                                 graph=None):
+    """
+    The balanced cuts of the spanning tree of `h`, as `LazyCut`s.  With `division_tuples`, only
+    the cuts with the highest split score are kept; the split scores are read from the division
+    codes of `graph` (the region the tree spans, or the tree itself if not given).
+    """
     root = choice([x for x in h if h.degree(x) > 1])
     pred = predecessors(h.graph, root)
     succ = successors(h.graph, root)
@@ -60,48 +299,108 @@ def division_find_balanced_edge_cuts_memoization(h, choice=random.choice, divisi
     cuts = []
     
     best_split_score = 0 
-    for node, tree_pop in subtree_pops.items():
-        def part_nodes(start):
-            nodes = set()
-            queue = deque([start])
-            while queue:
-                next_node = queue.pop()
-                if next_node not in nodes:
-                    nodes.add(next_node)
-                    if next_node in succ:
-                        for c in succ[next_node]:
-                            if c not in nodes:
-                                queue.append(c)
-            return nodes
-
+    if division_tuples is not None:
+        edges = division_edges(h.graph if graph is None else graph, division_tuples, columns)
+        split_scores = edges.split_scores(list(subtree_pops), [pred[node] for node in subtree_pops],
+                                          [tup[0] for tup in division_tuples]).tolist()
+    for i, (node, tree_pop) in enumerate(subtree_pops.items()):
         is_balanced_A = abs(tree_pop - h.ideal_pop) <= h.ideal_pop * h.epsilon
         is_balanced_B = abs((total_pop - tree_pop) - h.ideal_pop) <= h.ideal_pop * h.epsilon
 
-        parent = pred[node]
         if division_tuples is not None:
-            division_cols = [tup[0] for tup in division_tuples]
-            # score function to prefer higher ranked divisions:
-            # [8, 4, 2, 1] — example with 4 divisions
-            split_score = 0
-            for i, division_col in enumerate(division_cols):
-                if h.graph.nodes[parent][division_col] != h.graph.nodes[node][division_col]:
-                    split_score += 2 ** (len(division_cols) - i - 1) # descending powers starting at len(division_cols) - 1
+            split_score = split_scores[i]
             if split_score > best_split_score and (is_balanced_A or is_balanced_B):
                 best_split_score = split_score
                 cuts = []
-                part_subset = part_nodes(node) if is_balanced_A else set(h.graph.nodes) - part_nodes(node)
-                cuts.append(Cut(edge=(node, pred[node]), subset=part_subset))
+                cuts.append(LazyCut((node, pred[node]), succ, h.graph.nodes, complement=not is_balanced_A))
             elif split_score == best_split_score and (is_balanced_A or is_balanced_B):
-                part_subset = part_nodes(node) if is_balanced_A else set(h.graph.nodes) - part_nodes(node)
-                cuts.append(Cut(edge=(node, pred[node]), subset=part_subset))
+                cuts.append(LazyCut((node, pred[node]), succ, h.graph.nodes, complement=not is_balanced_A))
         else:
             if is_balanced_A:
-                cuts.append(Cut(edge=(node, pred[node]), subset=part_nodes(node)))
+                cuts.append(LazyCut((node, pred[node]), succ, h.graph.nodes))
             elif is_balanced_B:
-                cuts.append(Cut(edge=(node, pred[node]), subset=set(h.graph.nodes) - part_nodes(node)))
+                cuts.append(LazyCut((node, pred[node]), succ, h.graph.nodes, complement=True))
 
     return cuts
 
+class PopulatedTree:
+    """
+    What `division_find_balanced_edge_cuts_memoization` reads of gerrychain's `PopulatedGraph`, for
+    a spanning tree of a region with the region's `populations`, without copying them or building
+    the subsets and degrees that `PopulatedGraph` keeps for contracting the tree.
+    """
+    def __init__(self, graph, populations, tot_pop, ideal_pop, epsilon) -> None:
+        self.graph = graph
+        self.population = populations
+        self.tot_pop = tot_pop
+        self.ideal_pop = ideal_pop
+        self.epsilon = epsilon
+
+    def __iter__(self):
+        return iter(self.graph)
+
+    def degree(self, node):
+        return self.graph.degree(node)
+
+class DivisionBipartition:
+    """
+    `division_bipartition_tree` bound to the graph whose regions (e.g. two merged districts) it
+    bipartitions.  The division edges and codes (`DivisionEdges`) and the population of every
+    node are read once per parent graph, as arrays over its nodes, and every region's are
+    gathered from them by node position rather than read from the region's node attributes on
+    every call.  Can be passed as the `method` of a `ReCom` proposal; its `pop_col` is the one
+    it was bound to.
+    """
+    def __init__(self, graph, pop_col, division_tuples=[("COUNTYFP10", 1)], first_check_division=False,
+                 columns=None) -> None:
+        if first_check_division and len(division_tuples) == 0:
+            raise ValueError("first_check_division is True but no divisions are provided in division_tuples.")
+        self.pop_col = pop_col
+        self.division_tuples = division_tuples
+        self.first_check_division = first_check_division
+        self.columns = columns
+        self.edges = division_edges(graph, division_tuples, columns)
+        self.populations = node_array(graph, pop_col, columns)
+
+    def region(self, graph):
+        """
+        The nodes of the region `graph`, their positions in the parent graph and their populations.
+        """
+        nodes = list(graph.nodes)
+        positions = self.edges.positions(nodes)
+        return nodes, positions, self.populations[positions]
+
+    def __call__(self, graph, pop_col, pop_target, epsilon, node_repeats=1, spanning_tree=None,
+                 choice=random.choice, attempts_before_giveup=100):
+        nodes, _, populations = self.region(graph)
+        populations = dict(zip(nodes, populations.tolist()))
+        tot_pop = sum(populations.values())
+        division_tuples = self.division_tuples
+        sorted_division_tuples = sorted(division_tuples, key=lambda x:x[1], reverse=True)
+
+        possible_cuts = []
+        if spanning_tree is None:
+            spanning_tree = spanning_tree_graph(nodes, *self.edges.random_spanning_tree(nodes))
+        h = PopulatedTree(spanning_tree, populations, tot_pop, pop_target, epsilon)
+        restarts = 0
+        counter = 0
+        while len(possible_cuts) == 0 and counter < attempts_before_giveup:
+            if restarts == node_repeats:
+                spanning_tree = spanning_tree_graph(nodes, *self.edges.random_spanning_tree(nodes))
+                h = PopulatedTree(spanning_tree, populations, tot_pop, pop_target, epsilon)
+                restarts = 0
+                counter +=1
+            if len(division_tuples) > 0 and self.first_check_division and restarts == 0:
+                possible_cuts = division_find_balanced_edge_cuts_memoization(h, choice=choice, division_tuples=sorted_division_tuples,
+                                                                               columns=self.columns, graph=graph)
+            if len(possible_cuts) == 0:
+                possible_cuts = division_find_balanced_edge_cuts_memoization(h, choice=choice)
+            restarts += 1
+
+        if counter >= attempts_before_giveup:
+            return set()
+        return choice(possible_cuts).subset
+
 def division_bipartition_tree(
     graph,
     pop_col,
@@ -112,44 +411,22 @@ def division_bipartition_tree(
     node_repeats=1,
     spanning_tree=None,
     choice=random.choice,
-    attempts_before_giveup = 100):
-
-    if first_check_division and len(division_tuples) == 0:
-        raise ValueError("first_check_division is True but no divisions are provided in division_tuples.")
-
-    populations = {node: graph.nodes[node][pop_col] for node in graph}
-
-    possible_cuts = []
-    if spanning_tree is None:
-        spanning_tree = division_random_spanning_tree(graph, division_tuples=division_tuples)
-    restarts = 0
-    counter = 0
-    while len(possible_cuts) == 0 and counter < attempts_before_giveup:
-        # print(counter)
-        if restarts == node_repeats:
-            spanning_tree = division_random_spanning_tree(graph, division_tuples=division_tuples)
-            restarts = 0
-            counter +=1
-        h = PopulatedGraph(spanning_tree, populations, pop_target, epsilon)
-        if len(division_tuples) > 0 and first_check_division and restarts == 0:
-            sorted_division_tuples = sorted(division_tuples, key=lambda x:x[1], reverse=True)
-            possible_cuts = division_find_balanced_edge_cuts_memoization(h, choice=choice, division_tuples=sorted_division_tuples)
-        if len(possible_cuts) == 0:
-            h = PopulatedGraph(spanning_tree, populations, pop_target, epsilon)
-            possible_cuts = division_find_balanced_edge_cuts_memoization(h, choice=choice)
-        restarts += 1
-
-    if counter >= attempts_before_giveup:
-        return set()
-    return choice(possible_cuts).subset
-
-def get_regions(graph, region_col):
-    regions = set([graph.nodes[n][region_col] for n in graph.nodes])
-    nodes_by_region = {
-            region:[n for n in graph.nodes if graph.nodes[n][region_col] == region] \
-            for region in regions
-    }
-    return regions, nodes_by_region
+    attempts_before_giveup = 100,
+    columns=None):
+    """
+    Bipartitions `graph` with a spanning tree drawn by `division_random_spanning_tree`, preferring
+    (with `first_check_division`) the balanced cuts that split the highest ranked divisions.
+    See `DivisionBipartition`, which binds these settings to the parent graph once.
+    """
+    return DivisionBipartition(graph, pop_col, division_tuples, first_check_division, columns)(
+        graph, pop_col, pop_target, epsilon, node_repeats=node_repeats, spanning_tree=spanning_tree, choice=choice,
+        attempts_before_giveup=attempts_before_giveup)
+
+def get_regions(graph, region_col, columns=None):
+    nodes_by_region = {}
+    for n, region in node_values(graph, region_col, columns).items():
+        nodes_by_region.setdefault(region, []).append(n)
+    return set(nodes_by_region), nodes_by_region
 
 def num_region_splits(partition, regions, nodes_by_region):
     """
@@ -1,7 +1,11 @@
-from gerrychain import Graph
+from graph_cache import load_graph
 import pandas as pd
-from record_chains import ChainRecorder
+from record_chains import ChainRecorder, TREE_ENGINES
+from chain_scoring import ChainScorer
+from multi_scale import load_baf, block_vtds
+import numpy as np
 import argparse
+import random
 import json
 from configuration import *
 
@@ -21,7 +25,44 @@ parser.add_argument("--county_aware", action='store_const', const=True, default=
                     help="Chain builds districts with awareness of counties? (default False)")
 parser.add_argument("--quiet", dest="verbosity", action="store_const", const=None, default=100,
                     help="Silence * tracker of chain position?")
+parser.add_argument("--index", action='store_const', const=True, default=False,
+                    help="Also write the chain's index (see chain_index.py), for reading its steps without a replay? (default False)")
+parser.add_argument("--tree_engine", type=str, choices=TREE_ENGINES, default="networkx",
+                    help="Spanning tree engine of the ReCom proposal (\"array\" draws from the same distribution with NumPy, \
+                          \"wilson\" draws uniform spanning trees with Wilson's algorithm, slower than \"array\"). (default networkx)")
+parser.add_argument("--division_weight", type=float, default=0.1,
+                    help="With --tree_engine wilson in county-aware chains, how often the walks cross county lines relative to \
+                          other edges. (default 0.1)")
+parser.add_argument("--num_chains", type=int, default=1,
+                    help="Record this many independent, separately seeded chains (plus a manifest listing them) instead of one, \
+                          splitting the steps between them. (default 1)")
+parser.add_argument("--workers", type=int, default=1,
+                    help="With --num_chains, record the chains in this many processes. (default 1)")
+parser.add_argument("--seed", type=int, default=None,
+                    help="Seed of the chain, or that the chains' seeds are spawned from. (default random)")
+parser.add_argument("--independent_starts", action='store_const', const=True, default=False,
+                    help="With --num_chains and no seed plan, draw each chain's initial plan separately? (default False)")
+parser.add_argument("--checkpoint_every", type=int, default=None,
+                    help="Checkpoint the chain every this many steps, so that it can be resumed with --resume. (default no checkpoints)")
+parser.add_argument("--resume", action='store_const', const=True, default=False,
+                    help="Continue the chain (or chain set) from its last checkpoint? (default False)")
+parser.add_argument("--score", action='store_const', const=True, default=False,
+                    help="Also score the plans as the chain runs, in a separate process, writing the ensemble stats \
+                          collect_scores.py would write? (default False)")
+parser.add_argument("--no_chain", dest="record", action='store_const', const=False, default=True,
+                    help="With --score, don't write the chain itself.")
+parser.add_argument("--incremental", action='store_const', const=True, default=False,
+                    help="With --score, update the split and traversal metrics and the district tallies from each step's flips. (default False)")
+parser.add_argument("--multi_scale", type=str, default=None, metavar="BAF_FILE",
+                    help="Run a multi-scale chain on the state's block dual graph, moving whole VTDs (read from this Census \
+                          block assignment file) and splitting them into blocks only where needed.")
 args = parser.parse_args()
+if args.score and (args.num_chains > 1 or args.checkpoint_every is not None or args.resume):
+    parser.error("--score records a single chain without checkpoints")
+if args.num_chains > 1 and args.resume and args.checkpoint_every is None:
+    parser.error("--resume with --num_chains needs --checkpoint_every, for the chains that never started")
+if not args.record and not args.score:
+    parser.error("--no_chain needs --score")
 
 ## Read in args and state specifications
 state = args.st
@@ -44,8 +85,10 @@ county_col = state_specification["county_col"]
 
 
 ## Run and Record Chain
-graph = Graph.from_json(dual_graph_file)
-rec = ChainRecorder(graph, output_dir, pop_col, county_col, verbose_freq=verbose_freq)
+graph = load_graph(dual_graph_file)
+vtds = block_vtds(graph, load_baf(args.multi_scale)) if args.multi_scale is not None else None
+rec = ChainRecorder(graph, output_dir, pop_col, county_col, verbose_freq=verbose_freq, tree_engine=args.tree_engine,
+                    vtds=vtds, division_weight=args.division_weight)
 
 if "seed_plans" in state_specification and plan_type in state_specification["seed_plans"]:
     seed_plan_path = state_specification["seed_plans"][plan_type] 
@@ -56,6 +99,23 @@ if "seed_plans" in state_specification and plan_type in state_specification["see
 else:
     seed_plan = None
 
-rec.record_chain(k, eps, steps,"{}_{}_{}_bal_{}_steps_{}.chain".format(state.lower(), plan_type,
-                                                                       eps, steps, county_aware_str),
-                         county_aware=county_aware, initial_partition=seed_plan)
+chain_file = "{}_{}_{}_bal_{}_steps_{}.chain".format(state.lower(), plan_type, eps, steps, county_aware_str)
+if args.seed is not None:
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+if args.num_chains > 1:
+    print(rec.record_chains(k, eps, steps, chain_file, args.num_chains, workers=args.workers, seed=args.seed,
+                            county_aware=county_aware, initial_partition=seed_plan,
+                            independent_starts=args.independent_starts, index=args.index,
+                            checkpoint_every=args.checkpoint_every, resume=args.resume))
+elif args.checkpoint_every is not None or args.resume:
+    rec.record_checkpointed_chain(k, eps, steps, chain_file, checkpoint_every=args.checkpoint_every, county_aware=county_aware,
+                                  initial_partition=seed_plan, index=args.index, resume=args.resume)
+else:
+    scorer = None
+    if args.score:
+        stats_path = "{}/{}/{}.jsonl.gz".format(state, STATS_DIR, chain_file[:-len(".chain")])
+        scorer = ChainScorer(graph, state_specification, plan_type, stats_path, eps, county_aware_str,
+                             incremental=args.incremental)
+    rec.record_chain(k, eps, steps, chain_file, county_aware=county_aware, initial_partition=seed_plan, index=args.index,
+                     scorer=scorer, record=args.record)
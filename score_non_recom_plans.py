@@ -1,17 +1,16 @@
 from plan_metrics import PlanMetrics
-from gerrychain import Graph, Election, Partition
-from gerrychain.updaters import Tally
+from gerrychain import Partition
+from graph_cache import load_graph
+from scoring_specification import ScoringSpecification
 import pandas as pd
 from tqdm import tqdm
 import argparse
 import json
-import warnings
 from configuration import *
 from glob import glob
 from functools import reduce
 import os
 
-SUPPORTED_METRIC_IDS = list(SUPPORTED_METRICS.keys())
 HOMEDIR = os.path.expanduser('~')
 
 parser = argparse.ArgumentParser(description="VTD Plan Scorer", 
@@ -46,27 +45,16 @@ pop_col = state_specification["pop_col"]
 county_col = state_specification["county_col"]
 party = state_specification["pov_party"]
 elections = state_specification["elections"]
-demographic_cols = [m["id"] for m in state_specification["metrics"] if "type" in m and m["type"] == "col_tally"]
-state_metric_ids = set([m["id"] for m in state_specification["metrics"] if "type" not in m or m["type"] != "col_tally"])
-state_metrics = [{**m, "type": SUPPORTED_METRICS["col_tally"]} if ("type" in m and m["type"] == "col_tally") \
-                                                               else {**m, "type": SUPPORTED_METRICS[m["id"]]} \
-                    for m in filter(lambda m: m["id"] in SUPPORTED_METRIC_IDS or ("type" in m and m["type"] == "col_tally"), 
-                                    state_specification["metrics"])]
-municipality_col = state_specification["municipal_col"] if "num_municipal_pieces" in state_metric_ids or "num_split_municipalities" in state_metric_ids else None
-incumbent_col = state_specification["incumbent_cols"][PLAN_TYPE] if "num_double_bunked" in state_metric_ids or "num_zero_bunked" in state_metric_ids else None
+scoring_spec = ScoringSpecification(state_specification)
+demographic_cols = scoring_spec.demographic_cols
+state_metrics = scoring_spec.state_metrics
+municipality_col = scoring_spec.municipality_col
+incumbent_col = scoring_spec.incumbent_col(PLAN_TYPE)
+election_names = scoring_spec.election_names
+election_updaters = scoring_spec.election_updaters
+demographic_updaters = scoring_spec.demographic_updaters(PLAN_TYPE)
 
-if len(state_metric_ids - set(SUPPORTED_METRIC_IDS)) > 0:
-    warnings.warn("Some state metrics are not supported.  Will continue without tracking them.\n.\
-                  Unsupported metrics: {}".format(str(state_metric_ids - set(SUPPORTED_METRIC_IDS))))
-
-election_names = [e["name"] for e in elections]
-## sort candidates alphabetically so that the "first" party is consistent.
-election_updaters = {e["name"]: Election(e["name"], {c["name"]: c["key"] for c in sorted(e["candidates"], 
-                                                                                         key=lambda c: c["name"])})
-                    for e in elections}
-demographic_updaters = {demo_col: Tally(demo_col, alias=demo_col) for demo_col in demographic_cols + [incumbent_col]}
-
-graph = Graph.from_json(dual_graph_file)
+graph = load_graph(dual_graph_file)
 
 scores = PlanMetrics(graph, election_names, party, pop_col, state_metrics, updaters=election_updaters, 
                      county_col=county_col, demographic_cols=demographic_cols,
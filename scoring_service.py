@@ -0,0 +1,252 @@
+from plan_metrics import PlanMetrics, IncrementalPlanMetrics
+from scoring_specification import ScoringSpecification
+from gerrychain import Partition
+from graph_cache import load_graph
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from collections import OrderedDict
+import threading
+import argparse
+import socket
+import json
+import time
+import csv
+import io
+import os
+from configuration import *
+
+
+class PlanError(ValueError):
+    """
+    A submitted plan can't be scored (bad format or GEOIDs that don't match the dual graph).
+    """
+
+
+class StateScorer:
+    """
+    Everything needed to score plans of one state and plan type, built once: the dual graph, the
+    election and tally updaters, the `PlanMetrics` and the GEOID of every node.  Scores plans like
+    `score_non_recom_plans.py`.  `score` is not thread safe; the service holds `lock` around it.
+    With `incremental`, the metrics are an `IncrementalPlanMetrics` (for scoring the plans of a chain);
+    without a `geoid_col`, only partitions can be scored (`scores.plan_summary`), not GEOID plans.
+    """
+    def __init__(self, state_specification, plan_type, graph=None, geoid_col="GEOID20", incremental=False) -> None:
+        spec = state_specification
+        self.state_specification = spec
+        self.plan_type = plan_type
+        self.num_districts = spec["districts"][plan_type]
+        scoring_spec = ScoringSpecification(spec)
+        self.elections = scoring_spec.elections
+        self.updaters = {**scoring_spec.election_updaters, **scoring_spec.demographic_updaters(plan_type)}
+        self.graph = load_graph("{}/{}".format(DUAL_GRAPH_DIR, spec["dual_graph"])) if graph is None else graph
+        scorer = IncrementalPlanMetrics if incremental else PlanMetrics
+        self.scores = scorer(self.graph, scoring_spec.election_names, spec["pov_party"], spec["pop_col"],
+                             scoring_spec.state_metrics, updaters=scoring_spec.election_updaters,
+                             county_col=spec["county_col"], demographic_cols=scoring_spec.demographic_cols,
+                             municipality_col=scoring_spec.municipality_col,
+                             incumbent_col=scoring_spec.incumbent_col(plan_type))
+        self.nodes = list(self.graph.nodes)
+        self.geoids = [str(self.graph.nodes[n][geoid_col]) for n in self.nodes] if geoid_col is not None else None
+        self.lock = threading.Lock()
+
+    def summary_data(self):
+        return self.scores.summary_data(self.elections, num_districts=self.num_districts, ensemble=False)
+
+    def score(self, plan, plan_type="proposed_plan", plan_name=""):
+        """
+        The `plan_summary` of a plan given as a dictionary from GEOID to district.
+        """
+        try:
+            ddict = {n: int(plan[geoid]) for n, geoid in zip(self.nodes, self.geoids)}
+        except KeyError:
+            missing = [geoid for geoid in self.geoids if geoid not in plan]
+            raise PlanError("The plan assigns no district to {} GEOIDs of the dual graph (e.g. {})".format(len(missing), missing[0]))
+        except (TypeError, ValueError) as e:
+            raise PlanError("Districts must be integers: {}".format(e))
+        part = Partition(self.graph, ddict, self.updaters)
+        return self.scores.plan_summary(part, plan_type=plan_type, plan_name=plan_name)
+
+
+def parse_plan(body):
+    """
+    Reads a plan from a request body: a JSON object from GEOID to district (optionally wrapped
+    as {"assignment": {...}}), or a CSV whose first column is the GEOID and whose "assignment"
+    column (or else second column) is the district.
+    """
+    text = body.decode("utf-8-sig").strip()
+    if text.startswith("{"):
+        try:
+            plan = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise PlanError("Invalid JSON: {}".format(e))
+        return plan.get("assignment", plan) if isinstance(plan.get("assignment"), dict) else plan
+    rows = list(csv.reader(io.StringIO(text)))
+    if len(rows) < 2 or len(rows[0]) < 2:
+        raise PlanError("A CSV plan needs a header and a GEOID and district column")
+    district_col = rows[0].index("assignment") if "assignment" in rows[0] else 1
+    return {row[0]: row[district_col] for row in rows[1:] if len(row) > district_col}
+
+
+class ScoringService:
+    """
+    Keeps the `StateScorer`s of the most recently used (state, plan type) pairs loaded, evicting
+    the least recently used beyond `max_loaded`, and lets at most `max_concurrent` requests score
+    at once.
+    """
+    def __init__(self, max_loaded=2, max_concurrent=4, wait_timeout=60) -> None:
+        self.max_loaded = max_loaded
+        self.wait_timeout = wait_timeout
+        self.scorers = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.started = time.time()
+        self.num_scored = 0
+
+    def load_scorer(self, state, plan_type):
+        with open("{}/{}.json".format(STATE_SPECS_DIR, state)) as fin:
+            state_specification = json.load(fin)
+        return StateScorer(state_specification, plan_type)
+
+    def scorer(self, state, plan_type):
+        """
+        The loaded scorer for `state` and `plan_type`, loading it (once, even if several requests
+        ask for it at the same time) if needed.
+        """
+        key = (state, plan_type)
+        with self.lock:
+            if key in self.scorers:
+                self.scorers.move_to_end(key)
+                return self.scorers[key]
+            loading = self.loading.setdefault(key, threading.Lock())
+        with loading:
+            with self.lock:
+                if key in self.scorers:
+                    return self.scorers[key]
+            scorer = self.load_scorer(state, plan_type)
+            with self.lock:
+                self.scorers[key] = scorer
+                while len(self.scorers) > self.max_loaded:
+                    self.scorers.popitem(last=False)
+                self.loading.pop(key, None)
+        return scorer
+
+    def score(self, state, plan_type, plan, kind="proposed_plan", name=""):
+        if not self.slots.acquire(timeout=self.wait_timeout):
+            raise TimeoutError("Too many plans are being scored")
+        try:
+            scorer = self.scorer(state, plan_type)
+            with scorer.lock:
+                summary = scorer.score(plan, plan_type=kind, plan_name=name)
+            with self.lock:
+                self.num_scored += 1
+            return summary
+        finally:
+            self.slots.release()
+
+    def status(self):
+        with self.lock:
+            return {"loaded": ["{}/{}".format(*key) for key in self.scorers], "plans_scored": self.num_scored,
+                    "uptime_seconds": time.time() - self.started}
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /status
+    GET /summary?state=Virginia&plan_type=congress      (the header line of the plan stats)
+    POST /score?state=Virginia&plan_type=congress[&name=...][&kind=citizen_plan]
+        with a CSV or JSON plan as the body; responds with its `plan_summary`.
+    """
+    service = None
+
+    def address_string(self):
+        # Clients of a Unix socket have no address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def respond(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def state_and_plan_type(self, query):
+        state, plan_type = query.get("state", [None])[0], query.get("plan_type", [None])[0]
+        if state not in SUPPORTED_STATES or plan_type not in SUPPORTED_PLAN_TYPES:
+            raise PlanError("state must be one of {} and plan_type one of {}".format(SUPPORTED_STATES, SUPPORTED_PLAN_TYPES))
+        return state, plan_type
+
+    def handle_request(self, score):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if not score and url.path == "/status":
+                return self.respond(200, self.service.status())
+            if not score and url.path == "/summary":
+                return self.respond(200, self.service.scorer(*self.state_and_plan_type(query)).summary_data())
+            if score and url.path == "/score":
+                state, plan_type = self.state_and_plan_type(query)
+                kind = query.get("kind", ["proposed_plan"])[0]
+                plan = parse_plan(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                return self.respond(200, self.service.score(state, plan_type, plan, kind=kind,
+                                                            name=query.get("name", [""])[0]))
+            return self.respond(404, {"error": "No such endpoint: {} {}".format(self.command, url.path)})
+        except (PlanError, KeyError) as e:
+            return self.respond(400, {"error": str(e)})
+        except TimeoutError as e:
+            return self.respond(503, {"error": str(e)})
+        except Exception as e:
+            return self.respond(500, {"error": "{}: {}".format(type(e).__name__, e)})
+
+    def do_GET(self):
+        self.handle_request(score=False)
+
+    def do_POST(self):
+        self.handle_request(score=True)
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def make_server(service, host="127.0.0.1", port=8765, unix_socket=None):
+    handler = type("Handler", (ScoringRequestHandler,), {"service": service})
+    if unix_socket is not None:
+        return UnixHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan Scoring Service",
+                                     prog="scoring_service.py")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="Port to listen on, on localhost. (default 8765)")
+    parser.add_argument("--socket", type=str, default=None,
+                        help="Listen on this Unix socket instead of a port.")
+    parser.add_argument("--max_loaded", type=int, default=2,
+                        help="How many (state, plan type) scorers to keep loaded. (default 2)")
+    parser.add_argument("--max_concurrent", type=int, default=4,
+                        help="How many plans may be scored at once. (default 4)")
+    parser.add_argument("--preload", type=str, nargs="*", default=[], metavar="state/plan_type",
+                        help="Scorers to load at startup, e.g. Virginia/congress.")
+    args = parser.parse_args()
+
+    service = ScoringService(max_loaded=args.max_loaded, max_concurrent=args.max_concurrent)
+    for key in args.preload:
+        service.scorer(*key.split("/"))
+    server = make_server(service, port=args.port, unix_socket=args.socket)
+    print("Scoring plans on {}".format(args.socket if args.socket is not None else "http://127.0.0.1:{}".format(args.port)),
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,47 @@
+from gerrychain import Election
+from gerrychain.updaters import Tally
+import warnings
+from configuration import *
+
+SUPPORTED_METRIC_IDS = list(SUPPORTED_METRICS.keys())
+
+
+class ScoringSpecification:
+    """
+    The scoring settings of a state specification, as `collect_scores.py`,
+    `score_non_recom_plans.py` and `StateScorer` read them: the demographic tally columns, the
+    supported metrics with their types, the municipality column (when a municipal metric is
+    tracked), whether incumbents are tracked and the election updaters.  Warns about the metrics
+    that aren't supported.
+    """
+    def __init__(self, state_specification) -> None:
+        spec = state_specification
+        self.state_specification = spec
+        self.demographic_cols = [m["id"] for m in spec["metrics"] if "type" in m and m["type"] == "col_tally"]
+        self.state_metric_ids = set([m["id"] for m in spec["metrics"] if "type" not in m or m["type"] != "col_tally"])
+        self.state_metrics = [{**m, "type": SUPPORTED_METRICS["col_tally"]} if ("type" in m and m["type"] == "col_tally") \
+                                                                            else {**m, "type": SUPPORTED_METRICS[m["id"]]} \
+                                 for m in filter(lambda m: m["id"] in SUPPORTED_METRIC_IDS or ("type" in m and m["type"] == "col_tally"),
+                                                 spec["metrics"])]
+        self.municipality_col = spec["municipal_col"] if "num_municipal_pieces" in self.state_metric_ids or \
+                                                         "num_split_municipalities" in self.state_metric_ids else None
+        self.track_incumbents = "num_double_bunked" in self.state_metric_ids or "num_zero_bunked" in self.state_metric_ids
+        if len(self.state_metric_ids - set(SUPPORTED_METRIC_IDS)) > 0:
+            warnings.warn("Some state metrics are not supported.  Will continue without tracking them.\n.\
+                          Unsupported metrics: {}".format(str(self.state_metric_ids - set(SUPPORTED_METRIC_IDS))))
+
+        self.elections = spec["elections"]
+        self.election_names = [e["name"] for e in self.elections]
+        ## sort candidates alphabetically so that the "first" party is consistent.
+        self.election_updaters = {e["name"]: Election(e["name"], {c["name"]: c["key"] for c in sorted(e["candidates"],
+                                                                                                      key=lambda c: c["name"])})
+                                  for e in self.elections}
+
+    def incumbent_col(self, plan_type):
+        return self.state_specification["incumbent_cols"][plan_type] if self.track_incumbents else None
+
+    def demographic_updaters(self, plan_type):
+        """
+        The `Tally` updaters of the demographic columns and of `plan_type`'s incumbent column.
+        """
+        return {demo_col: Tally(demo_col, alias=demo_col) for demo_col in self.demographic_cols + [self.incumbent_col(plan_type)]}
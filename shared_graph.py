@@ -0,0 +1,166 @@
+from multiprocessing import shared_memory, resource_tracker
+from gerrychain import Graph
+import multiprocessing
+import numpy as np
+
+ALIGNMENT = 8
+
+
+class SharedGraph:
+    """
+    The adjacency (in CSR form) and selected node attributes of a dual graph, stored in one block
+    of shared memory that worker processes attach to without copying.  Numeric attributes are
+    stored as arrays aligned with the node positions; categorical attributes (strings, or lists of
+    strings such as multi-municipality nodes) as integer codes into a list of labels, with a CSR
+    index of each node's codes.
+
+    The creating process owns the block and should `unlink` it when the workers are done; workers
+    get the picklable `spec` and call `SharedGraph.attach(spec)`.
+    """
+    def __init__(self, spec, shm, owner=False) -> None:
+        self.spec = spec
+        self.shm = shm
+        self.owner = owner
+        self.arrays = {}
+        for name, (dtype, shape, offset) in spec["arrays"].items():
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            self.arrays[name] = array
+        self.indptr = self.arrays["indptr"]
+        self.indices = self.arrays["indices"]
+        self.num_nodes = len(self.indptr) - 1
+        node_ids = spec["node_ids"]
+        self.nodes = list(range(self.num_nodes)) if node_ids is None else node_ids
+        self.node_index = None if node_ids is None else {n: i for i, n in enumerate(node_ids)}
+
+    @classmethod
+    def create(cls, graph, numeric_cols=(), categorical_cols=()):
+        """
+        Copies the adjacency of `graph` and the listed node attributes into a new shared memory block.
+        """
+        nodes = list(graph.nodes)
+        positions_are_labels = nodes == list(range(len(nodes)))
+        node_index = {n: i for i, n in enumerate(nodes)}
+        arrays = {
+            "indptr": np.cumsum([0] + [len(graph.adj[n]) for n in nodes], dtype=np.int64),
+            "indices": np.array([node_index[m] for n in nodes for m in graph.adj[n]], dtype=np.int64),
+        }
+        for col in numeric_cols:
+            arrays["values/" + col] = np.array([graph.nodes[n][col] for n in nodes])
+        categories = {}
+        for col in categorical_cols:
+            labels = {}
+            indptr, codes, is_list = [0], [], []
+            for n in nodes:
+                values = graph.nodes[n][col]
+                is_list.append(type(values) == list)
+                for value in (values if is_list[-1] else [values]):
+                    codes.append(labels.setdefault(value, len(labels)))
+                indptr.append(len(codes))
+            arrays["indptr/" + col] = np.array(indptr, dtype=np.int64)
+            arrays["codes/" + col] = np.array(codes, dtype=np.int64)
+            arrays["is_list/" + col] = np.array(is_list, dtype=bool)
+            categories[col] = list(labels)
+
+        layout, size = {}, 0
+        for name, array in arrays.items():
+            layout[name] = (array.dtype.str, array.shape, size)
+            size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, array in arrays.items():
+            _, shape, offset = layout[name]
+            np.ndarray(shape, dtype=array.dtype, buffer=shm.buf, offset=offset)[...] = array
+        spec = {"name": shm.name, "arrays": layout, "categories": categories,
+                "node_ids": None if positions_are_labels else nodes}
+        return cls(spec, shm, owner=True)
+
+    @classmethod
+    def attach(cls, spec):
+        shm = shared_memory.SharedMemory(name=spec["name"])
+        # Only the creating process may unlink the block.  Child processes share their parent's
+        # resource tracker, but an unrelated process's own tracker would unlink it on exit.
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(spec, shm)
+
+    def positions(self, nodes):
+        """
+        The positions of the node labels `nodes` in the columns.
+        """
+        if self.node_index is None:
+            return np.fromiter(nodes, dtype=np.int64, count=len(nodes))
+        return np.fromiter((self.node_index[n] for n in nodes), dtype=np.int64, count=len(nodes))
+
+    def categories(self, col):
+        return self.spec["categories"][col]
+
+    def memberships(self, col):
+        """
+        (indptr, codes) such that the labels of the node at position i are
+        `categories(col)[codes[indptr[i]:indptr[i + 1]]]`.
+        """
+        return self.arrays["indptr/" + col], self.arrays["codes/" + col]
+
+    def node_column(self, col):
+        """
+        The array of a numeric attribute, or of the codes of a categorical attribute that has
+        exactly one label per node.
+        """
+        if "values/" + col in self.arrays:
+            return self.arrays["values/" + col]
+        indptr, codes = self.memberships(col)
+        if self.arrays["is_list/" + col].any():
+            raise KeyError("Node attribute {} is a list of labels on some nodes".format(col))
+        return codes
+
+    def values(self, col, nodes):
+        """
+        The values of `col` on the node labels `nodes`, as a list (labels for categorical attributes).
+        """
+        values = self.node_column(col)[self.positions(nodes)].tolist()
+        if col in self.spec["categories"]:
+            labels = self.categories(col)
+            return [labels[code] for code in values]
+        return values
+
+    def to_graph(self, attributes=()):
+        """
+        A gerrychain `Graph` with the shared adjacency, carrying only the listed node attributes.
+        Partitions over this graph work as over the full graph for anything that only needs the
+        assignment and the edges (e.g. `PlanMetrics` built with `columns=`).
+        """
+        graph = Graph()
+        records = [{} for _ in range(self.num_nodes)]
+        for col in attributes:
+            if col in self.spec["categories"]:
+                labels = self.categories(col)
+                indptr, codes = (a.tolist() for a in self.memberships(col))
+                is_list = self.arrays["is_list/" + col].tolist()
+                for i, record in enumerate(records):
+                    node_labels = [labels[code] for code in codes[indptr[i]:indptr[i + 1]]]
+                    record[col] = node_labels if is_list[i] else node_labels[0]
+            else:
+                for record, value in zip(records, self.node_column(col).tolist()):
+                    record[col] = value
+        graph.add_nodes_from(zip(self.nodes, records))
+        sources = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+        forward = sources < self.indices
+        graph.add_edges_from((self.nodes[u], self.nodes[v])
+                             for u, v in zip(sources[forward].tolist(), self.indices[forward].tolist()))
+        return graph
+
+    def close(self):
+        self.arrays = {}
+        self.indptr = self.indices = None
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        self.unlink()
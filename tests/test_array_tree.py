@@ -0,0 +1,110 @@
+from array_tree import ArrayTree, array_bipartition_tree, choose_root
+from region_aware import division_random_spanning_tree, division_find_balanced_edge_cuts_memoization, division_edges
+from record_chains import ChainRecorder
+from test_plan_metrics import grid_graph
+from gerrychain import Graph, MarkovChain, constraints, accept
+from gerrychain.tree import PopulatedGraph
+import networkx as nx
+import numpy as np
+import random
+import pytest
+
+def test_same_cuts_as_networkx_engine():
+    graph = grid_graph(10)
+    nodes = list(graph.nodes)
+    populations = {n: graph.nodes[n]["TOTPOP"] for n in nodes}
+    ideal_pop = sum(populations.values()) / 2
+    edges = division_edges(graph, [("COUNTY", 1)])
+    positions = edges.positions(nodes)
+    for seed in range(20):
+        for division_tuples in [[("COUNTY", 1)], None]:
+            np.random.seed(seed)
+            random.seed(seed)
+            h = PopulatedGraph(division_random_spanning_tree(graph, [("COUNTY", 1)]), populations, ideal_pop, 0.05)
+            expected = {(cut.edge, frozenset(cut.subset)) for cut in
+                        division_find_balanced_edge_cuts_memoization(h, division_tuples=division_tuples, graph=graph)}
+
+            # The same draws give the same tree and root.
+            np.random.seed(seed)
+            random.seed(seed)
+            tree = choose_root(ArrayTree(*edges.random_spanning_tree(nodes), np.array(list(populations.values()), dtype=float)))
+            split_scores = None if division_tuples is None else \
+                           edges.position_split_scores(positions, positions[np.maximum(tree.parent, 0)], ["COUNTY"])
+            cuts, subtree_sides = tree.balanced_cuts(ideal_pop, 0.05, split_scores)
+            found = set()
+            for node, subtree_side in zip(cuts.tolist(), subtree_sides.tolist()):
+                subtree = {nodes[i] for i in tree.subtree(node)}
+                found.add(((nodes[node], nodes[tree.parent[node]]), frozenset(subtree if subtree_side else set(nodes) - subtree)))
+            assert found == expected
+
+def test_array_bipartition_tree():
+    graph = grid_graph()
+    region = graph.subgraph([n for n in graph.nodes if n[1] < 6])
+    pop_target = sum(region.nodes[n]["TOTPOP"] for n in region.nodes) / 2
+    np.random.seed(2022)
+    random.seed(2022)
+    for division_tuples in [[], [("COUNTY", 1)]]:
+        subset = array_bipartition_tree(region, "TOTPOP", pop_target, 0.05, division_tuples=division_tuples,
+                                        first_check_division=len(division_tuples) > 0)
+        assert abs(sum(region.nodes[n]["TOTPOP"] for n in subset) - pop_target) <= 0.05 * pop_target
+        assert nx.is_connected(region.subgraph(subset)) and nx.is_connected(region.subgraph(set(region.nodes) - subset))
+
+def test_array_bipartition_gives_up():
+    # No subset of the region comes within 0.1% of a target above its population.
+    graph = grid_graph()
+    pop_target = sum(graph.nodes[n]["TOTPOP"] for n in graph.nodes) * 2
+    with pytest.raises(RuntimeError, match="balanced cut"):
+        array_bipartition_tree(graph, "TOTPOP", pop_target, 0.001, attempts_before_giveup=5)
+    assert array_bipartition_tree(graph, "TOTPOP", pop_target, 0.001, division_tuples=[("COUNTY", 1)],
+                                  first_check_division=True, attempts_before_giveup=5) == set()
+
+def test_wilson_spanning_trees():
+    np.random.seed(2022)
+    # Every one of the 16 spanning trees of K4 is equally likely.
+    graph = nx.complete_graph(4)
+    edges = division_edges(graph, [])
+    counts = {}
+    for _ in range(3200):
+        heads, tails = edges.wilson_spanning_tree(list(graph.nodes))
+        tree = frozenset(frozenset(edge) for edge in zip(heads.tolist(), tails.tolist()))
+        assert len(tree) == 3 and nx.is_tree(nx.Graph(list(tree)))
+        counts[tree] = counts.get(tree, 0) + 1
+    assert len(counts) == 16
+    assert all(abs(count - 200) < 60 for count in counts.values())
+
+    # On a 4-cycle split into two divisions, a tree is drawn in proportion to 0.1 ** (crossing edges).
+    graph = nx.cycle_graph(4)
+    nx.set_node_attributes(graph, {0: "a", 1: "a", 2: "b", 3: "b"}, "COUNTY")
+    edges = division_edges(graph, [("COUNTY", 1)])
+    dropped = {}
+    for _ in range(2000):
+        heads, tails = edges.wilson_spanning_tree(list(graph.nodes), division_weight=0.1)
+        missing = {frozenset(edge) for edge in graph.edges} - {frozenset(edge) for edge in zip(heads.tolist(), tails.tolist())}
+        dropped[tuple(sorted(*missing))] = dropped.get(tuple(sorted(*missing)), 0) + 1
+    # Dropping a crossing edge has probability 0.1 / (2 * 0.1 + 2 * 0.01) = 5 / 11.
+    assert abs(dropped[(1, 2)] / 2000 - 5 / 11) < 0.04
+    assert abs(dropped[(0, 3)] / 2000 - 5 / 11) < 0.04
+
+def test_wilson_bipartition():
+    random.seed(2022)
+    np.random.seed(2022)
+    graph = grid_graph(10)
+    ideal_pop = sum(graph.nodes[n]["TOTPOP"] for n in graph.nodes) / 2
+    for division_tuples in [[], [("COUNTY", 1)]]:
+        subset = array_bipartition_tree(graph, "TOTPOP", ideal_pop, 0.05, division_tuples=division_tuples,
+                                        first_check_division=len(division_tuples) > 0, wilson=True)
+        assert abs(sum(graph.nodes[n]["TOTPOP"] for n in subset) - ideal_pop) <= ideal_pop * 0.05
+        assert nx.is_connected(graph.subgraph(subset))
+
+def test_wilson_chain():
+    random.seed(2022)
+    np.random.seed(2022)
+    graph = Graph(nx.convert_node_labels_to_integers(grid_graph(10)))
+    recorder = ChainRecorder(graph, None, "TOTPOP", "COUNTY", tree_engine="wilson", division_weight=0.5)
+    initial_partition = recorder._initial_partition(4, 0.1)
+    for county_aware in [False, True]:
+        chain = MarkovChain(proposal=recorder._proposal(4, 0.1, county_aware),
+                            constraints=[constraints.within_percent_of_ideal_population(initial_partition, 0.1)],
+                            accept=accept.always_accept, initial_state=initial_partition, total_steps=10)
+        plans = [dict(part.assignment) for part in chain]
+        assert plans[-1] != plans[0]
@@ -0,0 +1,17 @@
+from benchmark import Benchmark, synthetic_graph, ELECTIONS
+
+def test_synthetic_benchmark():
+    graph = synthetic_graph(12, county_size=4, seed=1)
+    assert sorted(graph.nodes) == list(range(144))
+    assert len({graph.nodes[n]["COUNTY"] for n in graph.nodes}) == 9
+
+    runs = []
+    for _ in range(2):
+        benchmark = Benchmark(graph, 4, 0.1, seed=1)
+        benchmark.setup()
+        benchmark.chain(3, county_aware=True)
+        runs.append(benchmark.scores.plan_summary(benchmark.initial_partition))
+    assert runs[0] == runs[1]
+    assert set(runs[0]["seats"]) == {e.split(":")[0] for e in ELECTIONS}
+    assert benchmark.results["county_aware_chain"]["steps"] == 3
+    assert all(phase["peak_rss_mb"] > 0 and "rss_growth_mb" in phase for phase in benchmark.results.values())
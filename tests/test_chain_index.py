@@ -0,0 +1,57 @@
+from chain_index import ChainIndex, ChainIndexWriter
+from gerrychain import Graph, Partition
+from gerrychain.updaters import Tally
+import networkx as nx
+import random
+
+def test_chain_index(tmp_path):
+    rng = random.Random(2022)
+    graph = Graph(nx.convert_node_labels_to_integers(nx.grid_graph([6, 6])))
+    part = Partition(graph, {n: rng.randrange(4) for n in graph.nodes})
+    writer = ChainIndexWriter(str(tmp_path / "chain.index"), len(graph.nodes), snapshot_every=7)
+    expected, previous = [], None
+    for step in range(40):
+        if step > 0 and step % 5 != 0:
+            # Every fifth step repeats the previous plan, like a rejected proposal.
+            part = part.flip({n: rng.randrange(4) for n in rng.sample(list(graph.nodes), 3)})
+        writer.add_partition(part, previous)
+        expected.append([part.assignment[n] for n in sorted(graph.nodes)])
+        previous = part
+    writer.close()
+
+    index = ChainIndex(str(tmp_path / "chain.index"))
+    assert len(index) == 40 and index.num_districts == 4
+    assert [index.assignment(step).tolist() for step in range(40)] == expected
+    assert [(step, assignment.tolist()) for step, assignment in index.assignments(range(3, 40, 4))] == \
+           [(step, expected[step]) for step in range(3, 40, 4)]
+    replayed = index.partition(graph, index.assignment(39))
+    assert list(replayed.parts) == [0, 1, 2, 3]
+    assert dict(replayed.assignment) == dict(part.assignment)
+
+    # Sampled partitions are flips of the previous sample, with no flips for a repeated step.
+    for n in graph.nodes:
+        graph.nodes[n]["TOTPOP"] = n
+    updaters = {"population": Tally("TOTPOP", alias="population")}
+    steps = [0, 4, 5, 9, 10, 23, 39]
+    for chained in [True, False]:
+        flipped = []
+        for step, p in zip(steps, index.partitions(graph, steps, updaters, chained=chained)):
+            assert [p.assignment[n] for n in sorted(graph.nodes)] == expected[step]
+            assert p["population"] == index.partition(graph, index.assignment(step), updaters)["population"]
+            flipped.append(None if p.parent is None else len(p.flips))
+        assert flipped[2] == flipped[4] == 0
+        assert all(flips is not None for flips in flipped[1:]) == chained
+
+def test_district_labels(tmp_path):
+    # A chain numbering its districts from 1 keeps those labels in the index.
+    graph = Graph(nx.convert_node_labels_to_integers(nx.grid_graph([4, 4])))
+    part = Partition(graph, {n: 1 + n % 4 for n in graph.nodes})
+    writer = ChainIndexWriter(str(tmp_path / "chain.index"), len(graph.nodes))
+    writer.add_partition(part)
+    writer.close()
+
+    index = ChainIndex(str(tmp_path / "chain.index"))
+    assert index.districts == [1, 2, 3, 4] and index.num_districts == 4
+    replayed = index.partition(graph, index.assignment(0))
+    assert list(replayed.parts) == [1, 2, 3, 4]
+    assert dict(replayed.assignment) == dict(part.assignment)
@@ -0,0 +1,53 @@
+from chain_scoring import ChainScorer
+from record_chains import ChainRecorder
+from scoring_service import StateScorer
+from test_scoring_service import SPEC
+from test_plan_metrics import grid_graph, flip_chain
+from gerrychain import Graph
+import networkx as nx
+import itertools
+import pytest
+import gzip
+import json
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_chain_scorer(tmp_path, incremental):
+    graph = grid_graph()
+    output_path = str(tmp_path / "stats.jsonl.gz")
+    scorer = ChainScorer(graph, SPEC, "congress", output_path, 0.01, "neutral", incremental=incremental, batch_size=4)
+    reference = StateScorer(SPEC, "congress", graph=graph, geoid_col=None)
+    expected, previous = [], None
+    for i, part in enumerate(flip_chain(graph, num_plans=12)):
+        # Every third step the chain stays where it was.
+        for step in [part, part] if i % 3 == 0 else [part]:
+            scorer.add_partition(step, previous)
+            expected.append(json.loads(json.dumps(reference.scores.plan_summary(step))))
+            previous = step
+    scorer.close()
+
+    with gzip.open(output_path, "rt") as fin:
+        header, *plans = [json.loads(line) for line in fin]
+    assert header["epsilon"] == 0.01 and header["chain_type"] == "neutral"
+    assert plans == expected
+
+class FailingRecorder(ChainRecorder):
+    """
+    A recorder whose proposal fails on its sixth step.
+    """
+    def _proposal(self, num_districts, epsilon, county_aware):
+        proposal = super()._proposal(num_districts, epsilon, county_aware)
+        steps = itertools.count()
+        def failing_proposal(partition):
+            if next(steps) == 5:
+                raise RuntimeError("proposal failed")
+            return proposal(partition)
+        return failing_proposal
+
+def test_chain_scorer_failed_chain(tmp_path):
+    graph = Graph(nx.convert_node_labels_to_integers(grid_graph()))
+    recorder = FailingRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY", tree_engine="array")
+    scorer = ChainScorer(graph, SPEC, "congress", str(tmp_path / "stats.jsonl.gz"), 0.1, "neutral", batch_size=1)
+    with pytest.raises(RuntimeError, match="proposal failed"):
+        recorder.record_chain(4, 0.1, 20, "chain.chain", scorer=scorer, record=False)
+    # The scoring process is stopped rather than left waiting for the rest of the chain.
+    assert not scorer.process.is_alive()
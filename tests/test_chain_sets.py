@@ -0,0 +1,65 @@
+from record_chains import ChainRecorder, checkpoint_path
+from chain_index import ChainIndex, index_path
+from chain_io import load_chain_set
+from test_plan_metrics import grid_graph
+from gerrychain import Graph
+import networkx as nx
+import shutil
+import pytest
+import json
+
+@pytest.mark.skipif(shutil.which("pcompress") is None, reason="needs the pcompress binary")
+def test_record_chain_set(tmp_path):
+    graph = Graph(nx.convert_node_labels_to_integers(grid_graph()))
+    recorder = ChainRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY", tree_engine="array")
+    first_steps = []
+    for workers in [1, 2]:
+        recorder.record_chains(4, 0.1, 15, "set_{}.chain".format(workers), 3, workers=workers, seed=2022, index=True)
+        chain_set = load_chain_set(str(tmp_path / "set_{}.chain".format(workers)))
+        assert chain_set["chains"] == ["set_{}_{}.chain".format(workers, i) for i in range(3)]
+        assert len(set(chain_set["seeds"])) == 3
+        indices = [ChainIndex(index_path(path)) for path in chain_set["chain_paths"]]
+        assert [len(index) for index in indices] == [5, 5, 5]
+        # The chains share their initial plan and then move independently.
+        assert all((index.assignment(0) == indices[0].assignment(0)).all() for index in indices)
+        assert any((index.assignment(4) != indices[0].assignment(4)).any() for index in indices[1:])
+        first_steps.append([index.assignment(4).tolist() for index in indices])
+    # The same seed gives the same chains, whether they're recorded serially or in parallel.
+    assert first_steps[0] == first_steps[1]
+
+
+class LoggingRecorder(ChainRecorder):
+    """
+    A recorder that logs the chains it's asked to record instead of recording them.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def record_chain(self, num_districts, epsilon, steps, file_name, **kwargs):
+        self.calls.append((file_name, steps, None, False))
+
+    def record_checkpointed_chain(self, num_districts, epsilon, steps, file_name, checkpoint_every=None, resume=False, **kwargs):
+        self.calls.append((file_name, steps, checkpoint_every, resume))
+
+def test_chain_set_resume(tmp_path):
+    graph = Graph(nx.convert_node_labels_to_integers(grid_graph()))
+    recorder = LoggingRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY")
+    # The ensemble's steps are split between the chains.
+    path = recorder.record_chains(4, 0.1, 10, "set.chain", 3, seed=2022)
+    assert recorder.calls == [("set_0.chain", 4, None, False), ("set_1.chain", 3, None, False), ("set_2.chain", 3, None, False)]
+    with open(path) as fin:
+        manifest = json.load(fin)
+    assert manifest["chains"] == ["set_{}.chain".format(i) for i in range(3)]
+    assert manifest["steps"] == 10 and manifest["chain_steps"] == [4, 3, 3] and len(set(manifest["seeds"])) == 3
+
+    # The first chain finished, the second was checkpointed and the third never started.
+    (tmp_path / "set_0.chain").touch()
+    (tmp_path / "set_1.chain").touch()
+    (tmp_path / checkpoint_path("set_1.chain")).touch()
+    recorder.calls = []
+    recorder.record_chains(4, 0.1, 10, "set.chain", 3, seed=2022, checkpoint_every=2, resume=True)
+    assert recorder.calls == [("set_1.chain", 3, 2, True), ("set_2.chain", 3, 2, False)]
+    assert load_chain_set(str(tmp_path / "set.chain"))["seeds"] == manifest["seeds"]
+    with pytest.raises(ValueError, match="checkpoint_every"):
+        recorder.record_chains(4, 0.1, 10, "set.chain", 3, seed=2022, resume=True)
@@ -0,0 +1,61 @@
+from record_chains import ChainRecorder, checkpoint_path, load_checkpoint
+from chain_io import chain_deltas
+from test_plan_metrics import grid_graph
+from gerrychain import Graph
+import record_chains
+import networkx as nx
+import numpy as np
+import itertools
+import shutil
+import random
+import pytest
+
+class Interrupted(Exception):
+    pass
+
+@pytest.mark.skipif(shutil.which("pcompress") is None, reason="needs the pcompress binary")
+def test_resume_matches_uninterrupted_chain(tmp_path, monkeypatch):
+    graph = Graph(nx.convert_node_labels_to_integers(grid_graph()))
+    recorder = ChainRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY")
+    random.seed(2022)
+    np.random.seed(2022)
+    recorder.record_checkpointed_chain(4, 0.1, 25, "full.chain", checkpoint_every=7, county_aware=True)
+    assert load_checkpoint(checkpoint_path(str(tmp_path / "full.chain"))) is None
+
+    # Kill the chain partway through its third segment.
+    steps_left = itertools.count(17, -1)
+    record = record_chains.Record
+    def interrupted_record(chain, path):
+        for part in record(chain, path):
+            if next(steps_left) == 0:
+                raise Interrupted()
+            yield part
+    monkeypatch.setattr(record_chains, "Record", interrupted_record)
+    random.seed(2022)
+    np.random.seed(2022)
+    with pytest.raises(Interrupted):
+        recorder.record_checkpointed_chain(4, 0.1, 25, "resumed.chain", checkpoint_every=7, county_aware=True)
+    assert load_checkpoint(checkpoint_path(str(tmp_path / "resumed.chain")))["step"] == 14
+    monkeypatch.setattr(record_chains, "Record", record)
+
+    random.seed(0)
+    with pytest.raises(ValueError):
+        recorder.record_checkpointed_chain(4, 0.1, 25, "resumed.chain", county_aware=False, resume=True)
+    multi_scale = ChainRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY", vtds={n: n // 2 for n in graph.nodes})
+    with pytest.raises(ValueError, match="different settings"):
+        multi_scale.record_checkpointed_chain(4, 0.1, 25, "resumed.chain", county_aware=True, resume=True)
+    recorder.record_checkpointed_chain(4, 0.1, 25, "resumed.chain", county_aware=True, resume=True)
+    full = list(chain_deltas(str(tmp_path / "full.chain")))
+    assert len(full) == 25
+    assert list(chain_deltas(str(tmp_path / "resumed.chain"))) == full
+
+@pytest.mark.skipif(shutil.which("pcompress") is None, reason="needs the pcompress binary")
+def test_random_seed_reproduces_chain(tmp_path):
+    # The spanning trees draw from NumPy too, but seeding `random` alone fixes the chain.
+    graph = Graph(nx.convert_node_labels_to_integers(grid_graph()))
+    recorder = ChainRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY")
+    for i, numpy_seed in enumerate([1, 2]):
+        random.seed(2022)
+        np.random.seed(numpy_seed)
+        recorder.record_chain(4, 0.1, 15, "chain_{}.chain".format(i), county_aware=True)
+    assert list(chain_deltas(str(tmp_path / "chain_0.chain"))) == list(chain_deltas(str(tmp_path / "chain_1.chain")))
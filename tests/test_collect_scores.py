@@ -0,0 +1,92 @@
+from chain_index import ChainIndexWriter, build_index, index_path
+from test_scoring_service import SPEC
+from test_plan_metrics import grid_graph, flip_chain
+from gerrychain import Graph, Partition
+from pcompress import Record
+import networkx as nx
+import subprocess
+import shutil
+import pytest
+import pathlib
+import gzip
+import json
+import sys
+import os
+
+REPO = pathlib.Path(__file__).resolve().parents[1]
+
+def chain_dirs(tmp_path, **spec):
+    """
+    The spec (`SPEC`, updated with `spec`), dual graph and directories collect_scores.py expects
+    of a Virginia congress chain, in `tmp_path`.  Returns the dual graph.
+    """
+    graph = Graph(nx.convert_node_labels_to_integers(grid_graph()))
+    for directory in ["state_specifications", "dual_graphs", "Virginia/raw_chains", "Virginia/ensemble_stats"]:
+        (tmp_path / directory).mkdir(parents=True)
+    graph.to_json(str(tmp_path / "dual_graphs" / "grid.json"))
+    with open(tmp_path / "state_specifications" / "Virginia.json", "w") as fout:
+        json.dump({**SPEC, "dual_graph": "grid.json", "epsilons": {"congress": 0.01}, **spec}, fout)
+    return graph
+
+def stats_path(tmp_path, steps):
+    return tmp_path / "Virginia/ensemble_stats/virginia_congress_0.01_bal_{}_steps_neutral.jsonl.gz".format(steps)
+
+def indexed_chain(tmp_path, steps, **spec):
+    """
+    A Virginia congress chain laid out as collect_scores.py expects it (spec, dual graph and
+    an indexed .chain file) in `tmp_path`.  Returns the path of its stats file.
+    """
+    graph = chain_dirs(tmp_path, **spec)
+    chain_path = tmp_path / "Virginia/raw_chains/virginia_congress_0.01_bal_{}_steps_neutral.chain".format(steps)
+    chain_path.touch()
+    writer = ChainIndexWriter(index_path(str(chain_path)), len(graph.nodes), snapshot_every=7)
+    previous = None
+    for part in flip_chain(graph, num_plans=steps - 1):
+        writer.add_partition(part, previous)
+        previous = part
+    writer.close()
+    return stats_path(tmp_path, steps)
+
+def collect_scores(cwd, *args):
+    subprocess.run([sys.executable, str(REPO / "collect_scores.py"), "Virginia", "congress", *map(str, args)],
+                   cwd=cwd, env={**os.environ, "PYTHONPATH": str(REPO)}, check=True)
+
+def test_indexed_workers(tmp_path):
+    output_path = indexed_chain(tmp_path, steps=30)
+    outputs = []
+    for workers in [1, 3]:
+        collect_scores(tmp_path, 30, "--sub_sample", 4, "--workers", workers)
+        with gzip.open(output_path, "rt") as fin:
+            outputs.append([json.loads(line) for line in fin])
+    # Steps 0, 4, ..., 28 of the index, whether they're scored serially or in ranges.
+    assert len(outputs[0]) == 1 + 8
+    assert outputs[1] == outputs[0]
+
+def test_indexed_without_elections(tmp_path):
+    # Without (vectorized) elections there are no vote totals to check, and the samples are built from scratch.
+    metrics = [m for m in SPEC["metrics"] if m["id"] not in ["seats", "efficiency_gap"]]
+    output_path = indexed_chain(tmp_path, steps=12, elections=[], metrics=metrics)
+    for workers in [1, 2]:
+        collect_scores(tmp_path, 12, "--sub_sample", 4, "--workers", workers)
+        with gzip.open(output_path, "rt") as fin:
+            assert len([json.loads(line) for line in fin]) == 1 + 3
+
+@pytest.mark.skipif(shutil.which("pcompress") is None, reason="needs the pcompress binary")
+def test_one_indexed_workers(tmp_path):
+    graph = chain_dirs(tmp_path)
+    chain_path = tmp_path / "Virginia/raw_chains/virginia_congress_0.01_bal_20_steps_neutral.chain"
+    one_indexed = (Partition(graph, {n: district + 1 for n, district in part.assignment.items()})
+                   for part in flip_chain(graph, num_plans=19))
+    for _ in Record(one_indexed, str(chain_path)):
+        pass
+    for sub_sample in [1, 4]:
+        if sub_sample > 1:
+            build_index(str(chain_path), snapshot_every=7)
+        outputs = []
+        for workers in [1, 3]:
+            collect_scores(tmp_path, 20, "--sub_sample", sub_sample, "--workers", workers)
+            with gzip.open(stats_path(tmp_path, 20), "rt") as fin:
+                outputs.append([json.loads(line) for line in fin])
+        assert outputs[0][0]["num_districts"] == 4
+        assert outputs[0][0]["district_ids"] == [1, 2, 3, 4]
+        assert outputs[1] == outputs[0]
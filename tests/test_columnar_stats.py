@@ -0,0 +1,36 @@
+from columnar_stats import ColumnarStatsWriter, ColumnarPlans, load_columnar_stats
+import random
+
+HEADER = {"type": "ensemble_summary",
+          "metrics": [{"id": "num_cut_edges", "type": "plan_wide"},
+                      {"id": "seats", "type": "election_level"},
+                      {"id": "efficiency_gap", "type": "election_level"},
+                      {"id": "TOTPOP", "type": "district_level"},
+                      {"id": "num_party_wins_by_district", "type": "district_level"}]}
+
+def random_plans(num_plans=25, seed=2022):
+    rng = random.Random(seed)
+    for _ in range(num_plans):
+        yield {"type": "ensemble_plan",
+               "num_cut_edges": rng.randint(0, 500),
+               "seats": {"SEN18": rng.randint(0, 4), "GOV17": rng.randint(0, 4)},
+               "efficiency_gap": {"SEN18": rng.random() - 0.5, "GOV17": rng.random() - 0.5},
+               "TOTPOP": {d: rng.randint(0, 10 ** 6) for d in range(4)},
+               "num_party_wins_by_district": [rng.randint(0, 2) for _ in range(4)]}
+
+def test_columnar_round_trip(tmp_path):
+    path = str(tmp_path / "stats.columns")
+    plans = list(random_plans())
+    with ColumnarStatsWriter(path, HEADER, buffer_size=10) as writer:
+        for plan in plans:
+            writer.write(plan)
+
+    header, columns = load_columnar_stats(path)
+    columnar_plans = ColumnarPlans(header, columns)
+    json_plans = [{**plan, "TOTPOP": {str(d): pop for d, pop in plan["TOTPOP"].items()}} for plan in plans]
+
+    assert len(columnar_plans) == len(plans)
+    assert list(columnar_plans) == json_plans
+    assert columnar_plans.aggregate("num_cut_edges") == [plan["num_cut_edges"] for plan in plans]
+    assert columnar_plans.aggregate("efficiency_gap", labels=["GOV17"]) == \
+           {"GOV17": [plan["efficiency_gap"]["GOV17"] for plan in plans]}
@@ -0,0 +1,46 @@
+from graph_cache import compile_graph, load_compiled_graph, load_graph
+from gerrychain import Graph
+from networkx.readwrite import json_graph
+import networkx as nx
+import json
+
+def write_graph(path):
+    graph = nx.convert_node_labels_to_integers(nx.grid_graph([4, 5]))
+    for n in graph.nodes:
+        data = graph.nodes[n]
+        data["TOTPOP"] = 10 * n
+        data["area"] = n / 3
+        data["boundary_node"] = n % 4 == 0
+        data["GEOID20"] = str(51000 + n)
+        data["MUNI"] = ["a", "b"] if n % 5 == 0 else "a"
+        if n % 2 == 0:
+            data["INC"] = 1
+    for u, v in graph.edges:
+        graph.edges[u, v]["shared_perim"] = u + v / 7
+    graph.add_node(20)
+    with open(path, "w") as fout:
+        json.dump(json_graph.adjacency_data(graph), fout)
+
+def test_compiled_graph_matches_json(tmp_path):
+    path = str(tmp_path / "graph.json")
+    write_graph(path)
+    compile_graph(path)
+    expected, compiled = Graph.from_json(path), load_graph(path)
+
+    assert list(compiled.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(compiled.edges(data=True)) == list(expected.edges(data=True))
+    for n in expected.nodes:
+        assert list(compiled.nodes[n].items()) == list(expected.nodes[n].items())
+        assert all(type(compiled.nodes[n][key]) == type(value) for key, value in expected.nodes[n].items())
+        assert list(compiled.adj[n]) == list(expected.adj[n])
+    arrays = load_compiled_graph(path)
+    assert (arrays.indptr[1:] - arrays.indptr[:-1]).tolist() == [expected.degree(n) for n in expected.nodes]
+
+def test_stale_cache_is_ignored(tmp_path):
+    path = str(tmp_path / "graph.json")
+    write_graph(path)
+    compile_graph(path)
+    with open(path, "a") as fout:
+        fout.write(" ")
+
+    assert load_compiled_graph(path) is None
@@ -0,0 +1,132 @@
+from record_chains import ChainRecorder
+from multi_scale import MultiScaleReCom, BlockPartition, load_baf, block_vtds
+from chain_index import ChainIndex, ChainIndexWriter
+from gerrychain import Graph, MarkovChain, constraints, accept
+from pcompress import Replay
+import networkx as nx
+import numpy as np
+import shutil
+import random
+import pytest
+
+def block_graph(size=24, vtd_size=3, seed=2022):
+    """
+    A `size` x `size` grid of blocks in `vtd_size` x `vtd_size` VTDs, in counties of 2 x 2 VTDs.
+    """
+    rng = random.Random(seed)
+    graph = Graph(nx.grid_graph([size, size]))
+    for (x, y) in graph.nodes:
+        graph.nodes[(x, y)]["TOTPOP"] = rng.randint(20, 40)
+        graph.nodes[(x, y)]["COUNTY"] = "{:03d}".format((x // (2 * vtd_size)) * 10 + y // (2 * vtd_size))
+        graph.nodes[(x, y)]["GEOID20"] = "49{}{:02d}{:02d}".format(graph.nodes[(x, y)]["COUNTY"], x, y)
+    vtds = {(x, y): "{}-{}".format(x // vtd_size, y // vtd_size) for (x, y) in graph.nodes}
+    return graph, vtds
+
+def split_vtds(part, vtds):
+    districts = {}
+    for node, district in part.assignment.items():
+        districts.setdefault(vtds[node], set()).add(district)
+    return sum(len(d) > 1 for d in districts.values())
+
+def test_multi_scale_chain():
+    graph, vtds = block_graph()
+    quadrants = {(x, y): 2 * (x >= 12) + (y >= 12) for (x, y) in graph.nodes}
+    for county_aware, epsilon in [(False, 0.05), (True, 0.05)]:
+        random.seed(2022)
+        np.random.seed(2022)
+        recorder = ChainRecorder(graph, None, "TOTPOP", "COUNTY", vtds=vtds)
+        initial = recorder.get_partition(quadrants)
+        proposal = recorder._proposal(4, epsilon, county_aware)
+        assert isinstance(proposal, MultiScaleReCom)
+        chain = MarkovChain(proposal, [constraints.within_percent_of_ideal_population(initial, epsilon)],
+                            accept.always_accept, initial, 20)
+        ideal_pop = recorder.tot_pop / 4
+        moved = 0
+        for part in chain:
+            assert all(abs(pop - ideal_pop) <= epsilon * ideal_pop for pop in part["population"].values())
+            assert all(nx.is_connected(graph.subgraph(nodes)) for nodes in part.parts.values())
+            moved += part.parent is not None and len(part.flips) > 0
+            # Whole VTDs move, and at most the odd one is split.
+            assert split_vtds(part, vtds) <= 2
+        assert moved > 10
+
+def test_multi_scale_splits_vtds_when_needed():
+    graph, vtds = block_graph()
+    halves = {(x, y): int(x >= 12) for (x, y) in graph.nodes}
+    recorder = ChainRecorder(graph, None, "TOTPOP", "COUNTY", vtds=vtds)
+    ideal_pop = recorder.tot_pop / 2
+    random.seed(2022)
+    np.random.seed(2022)
+    # Whole VTDs are rarely within 0.1% of half of the population, so the VTDs a cut needs are split.
+    proposal = MultiScaleReCom(graph, vtds, "TOTPOP", ideal_pop, 0.001)
+    splits = []
+    for _ in range(5):
+        part = proposal(recorder.get_partition(halves))
+        assert all(abs(pop - ideal_pop) <= 0.001 * ideal_pop for pop in part["population"].values())
+        assert all(nx.is_connected(graph.subgraph(nodes)) for nodes in part.parts.values())
+        splits.append(split_vtds(part, vtds))
+    assert max(splits) <= proposal.max_refinements and sum(splits) > 0
+
+@pytest.mark.skipif(shutil.which("pcompress") is None, reason="needs the pcompress binary")
+def test_multi_scale_chain_replays_at_block_level(tmp_path):
+    graph, vtds = block_graph(12)
+    labels = {n: i for i, n in enumerate(graph.nodes)}
+    graph = Graph(nx.relabel_nodes(graph, labels))
+    vtds = {labels[n]: vtd for n, vtd in vtds.items()}
+    recorder = ChainRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY", vtds=vtds)
+    random.seed(2022)
+    np.random.seed(2022)
+    halves = {n: int(graph.nodes[n]["GEOID20"][5:7] >= "06") for n in graph.nodes}
+    recorder.record_chain(2, 0.02, 10, "multi_scale.chain", initial_partition=recorder.get_partition(halves))
+
+    ideal_pop = recorder.tot_pop / 2
+    plans = list(Replay(graph, str(tmp_path / "multi_scale.chain"), recorder.updaters))
+    assert len(plans) == 10
+    for part in plans:
+        assert all(abs(pop - ideal_pop) <= 0.02 * ideal_pop for pop in part["population"].values())
+
+def test_noncontiguous_vtds_are_split_into_pieces():
+    graph, vtds = block_graph(12)
+    # Two VTDs in opposite corners share a code, as a VTD with an exclave would.
+    vtds = {n: "0-0" if vtd == "3-3" else vtd for n, vtd in vtds.items()}
+    proposal = MultiScaleReCom(graph, vtds, "TOTPOP", 1, 0.1)
+    assert proposal.num_vtds == 16
+    assert proposal.vtds[proposal.node_index[(0, 0)]] != proposal.vtds[proposal.node_index[(11, 11)]]
+    assert set(proposal.vtd_sizes.tolist()) == {9}
+
+def test_multi_scale_chain_indexes_at_block_level(tmp_path):
+    graph, vtds = block_graph(12)
+    labels = {n: i for i, n in enumerate(graph.nodes)}
+    graph = Graph(nx.relabel_nodes(graph, labels))
+    vtds = {labels[n]: vtd for n, vtd in vtds.items()}
+    recorder = ChainRecorder(graph, str(tmp_path), "TOTPOP", "COUNTY", vtds=vtds)
+    random.seed(2022)
+    np.random.seed(2022)
+    halves = recorder.get_partition({n: int(graph.nodes[n]["GEOID20"][5:7] >= "06") for n in graph.nodes})
+    assert isinstance(halves, BlockPartition)
+    chain = MarkovChain(recorder._proposal(2, 0.02, False), [constraints.within_percent_of_ideal_population(halves, 0.02)],
+                        accept.always_accept, halves, 10)
+    writer = ChainIndexWriter(str(tmp_path / "multi_scale.index"), len(graph.nodes), snapshot_every=4)
+    previous, plans = None, []
+    for part in chain:
+        writer.add_partition(part, previous)
+        previous = part
+        plans.append((dict(part.assignment), part["population"]))
+    writer.close()
+
+    # The block level flips of the steps rebuild their plans, and the tallies the chain updated match.
+    ideal_pop = recorder.tot_pop / 2
+    replayed = ChainIndex(str(tmp_path / "multi_scale.index")).partitions(graph, range(10), recorder.updaters)
+    for (assignment, population), part in zip(plans, replayed):
+        assert dict(part.assignment) == assignment
+        assert part["population"] == population
+        assert all(abs(pop - ideal_pop) <= 0.02 * ideal_pop for pop in population.values())
+
+def test_load_baf(tmp_path):
+    graph, _ = block_graph(6)
+    with open(tmp_path / "baf.txt", "w") as fout:
+        fout.write("BLOCKID|COUNTYFP|DISTRICT\n")
+        for n in graph.nodes:
+            fout.write("{}|{}|{}\n".format(graph.nodes[n]["GEOID20"], int(graph.nodes[n]["COUNTY"]), n[0] // 3))
+    vtds = block_vtds(graph, load_baf(str(tmp_path / "baf.txt")))
+    assert vtds[(4, 1)] == "49" + graph.nodes[(4, 1)]["COUNTY"] + "000001"
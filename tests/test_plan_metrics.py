@@ -0,0 +1,199 @@
+from plan_metrics import PlanMetrics, IncrementalPlanMetrics, MetricTimer
+from gerrychain import Graph, Partition, Election
+from gerrychain.updaters import Tally
+import networkx as nx
+import random
+import json
+
+METRICS = [{"id": m, "name": m, "type": "plan_wide"} for m in
+           ["num_cut_edges", "num_county_pieces", "num_split_counties",
+            "num_municipal_pieces", "num_split_municipalities", "num_traversals"]]
+
+def grid_graph(size=8, seed=2022):
+    """
+    A `size` x `size` grid with population, counties (3x3 blocks), municipalities (some shared,
+    some lists of two, some excluded with '99999') and a two-party election.
+    """
+    rng = random.Random(seed)
+    graph = Graph(nx.grid_graph([size, size]))
+    for (x, y) in graph.nodes:
+        data = graph.nodes[(x, y)]
+        data["TOTPOP"] = rng.randint(50, 150)
+        data["COUNTY"] = "{}-{}".format(x // 3, y // 3)
+        r = rng.random()
+        data["MUNI"] = "99999" if r < 0.1 else \
+                       ["{}a".format(data["COUNTY"]), "{}b".format(data["COUNTY"])] if r < 0.2 else \
+                       "{}{}".format(data["COUNTY"], rng.choice("ab"))
+        data["DEM"] = rng.randint(0, 100)
+        data["REP"] = rng.randint(0, 100)
+    return graph
+
+def random_partitions(graph, num_plans=10, num_districts=4, seed=2022):
+    rng = random.Random(seed)
+    nodes = sorted(graph.nodes)
+    for _ in range(num_plans):
+        yield Partition(graph, {n: rng.randrange(num_districts) for n in nodes})
+
+def flip_chain(graph, num_plans=30, num_districts=4, seed=2022, updaters=None):
+    """
+    A sequence of partitions where each is a flip of a few nodes from the previous one.
+    """
+    rng = random.Random(seed)
+    nodes = sorted(graph.nodes)
+    part = Partition(graph, {n: rng.randrange(num_districts) for n in nodes}, updaters=updaters)
+    yield part
+    for _ in range(num_plans):
+        part = part.flip({n: rng.randrange(num_districts) for n in rng.sample(nodes, 5)})
+        yield part
+
+def plan_metrics(graph, cls=PlanMetrics, **kwargs):
+    election = Election("ELEC", {"Democratic": "DEM", "Republican": "REP"})
+    return cls(graph, ["ELEC"], "Democratic", "TOTPOP", METRICS, updaters={"ELEC": election},
+                       demographic_cols=[], municipality_col="MUNI", **kwargs)
+
+def test_municipal_index():
+    graph = grid_graph()
+    scores = plan_metrics(graph)
+
+    for i, n in enumerate(scores.nodes):
+        munis = graph.nodes[n]["MUNI"]
+        expected = [] if munis == "99999" else munis if type(munis) == list else [munis]
+        indexed = scores.municipal_ids[scores.municipal_indptr[i]:scores.municipal_indptr[i + 1]]
+        assert [scores.municipality_list[m] for m in indexed] == expected
+        assert all(n in scores.nodes_by_municipality[muni] for muni in expected)
+
+def test_multi_municipality_nodes():
+    # A node in two municipalities counts toward both of their splits.
+    graph = Graph(nx.path_graph(4))
+    for n, muni in zip(graph.nodes, ["A", ["A", "B"], "B", "99999"]):
+        graph.nodes[n].update({"TOTPOP": 100, "COUNTY": "C", "MUNI": muni, "DEM": 50, "REP": 50})
+    part = Partition(graph, {0: 0, 1: 1, 2: 1, 3: 0})
+    for scores in [plan_metrics(graph), plan_metrics(graph, vectorized=False), plan_metrics(graph, cls=IncrementalPlanMetrics)]:
+        assert scores.nodes_by_municipality == {"A": [0, 1], "B": [1, 2]}
+        metrics = scores.compactness_metrics(part)
+        assert metrics["num_split_municipalities"] == 1
+        assert metrics["num_municipal_pieces"] == 2
+
+def test_vectorized_split_metrics():
+    graph = grid_graph()
+    vectorized = plan_metrics(graph)
+    reference = plan_metrics(graph, vectorized=False)
+
+    for part in random_partitions(graph):
+        assert vectorized.compactness_metrics(part) == reference.compactness_metrics(part)
+
+def test_incremental_split_metrics():
+    graph = grid_graph()
+    incremental = plan_metrics(graph, cls=IncrementalPlanMetrics)
+    reference = plan_metrics(graph, vectorized=False)
+
+    for i, part in enumerate(flip_chain(graph)):
+        if i % 4 == 3:
+            # Plans that aren't scored still need to advance the state.
+            incremental.update(part)
+            continue
+        assert incremental.compactness_metrics(part) == reference.compactness_metrics(part)
+
+def test_incremental_tallies():
+    graph = grid_graph()
+    for n in graph.nodes:
+        graph.nodes[n]["INC"] = int(graph.nodes[n]["TOTPOP"] > 145)
+    elections = {"ELEC": Election("ELEC", {"Democratic": "DEM", "Republican": "REP"})}
+    updaters = {col: Tally(col, alias=col) for col in ["TOTPOP", "INC"]}
+    metrics = METRICS + [{"id": m, "name": m, "type": "plan_wide"} for m in
+                         ["num_double_bunked", "num_zero_bunked", "num_party_wins_by_district"]] + \
+              [{"id": m, "name": m, "type": "election_level"} for m in ["seats", "efficiency_gap", "mean_median"]]
+    incremental, reference = [cls(graph, ["ELEC"], "Democratic", "TOTPOP", metrics, updaters=elections,
+                                  demographic_cols=["TOTPOP"], municipality_col="MUNI", incumbent_col="INC")
+                              for cls in [IncrementalPlanMetrics, PlanMetrics]]
+    assert incremental._incremental_tallies and incremental._incremental_votes
+
+    for i, part in enumerate(flip_chain(graph, num_districts=6, updaters={**updaters, **elections})):
+        if i % 4 == 3:
+            incremental.update(part)
+            continue
+        assert json.dumps(incremental.plan_summary(part)) == json.dumps(reference.plan_summary(part))
+
+def test_vectorized_partisan_metrics():
+    graph = grid_graph()
+    for n in graph.nodes:
+        graph.nodes[n]["DEM2"], graph.nodes[n]["REP2"] = graph.nodes[n]["REP"], graph.nodes[n]["DEM"] // 2
+    elections = {"ELEC": Election("ELEC", {"Democratic": "DEM", "Republican": "REP"}),
+                 "ELEC2": Election("ELEC2", {"Republican": "REP2", "Democratic": "DEM2"})}
+    metrics = [{"id": m, "name": m, "type": "election_level"} for m in
+               ["seats", "efficiency_gap", "mean_median", "partisan_bias", "eguia_county"]] + \
+              [{"id": m, "name": m, "type": "plan_wide"} for m in
+               ["num_competitive_districts", "num_swing_districts", "num_party_districts",
+                "num_op_party_districts", "num_party_wins_by_district"]]
+    vectorized, reference = [PlanMetrics(graph, list(elections), "Democratic", "TOTPOP", metrics, updaters=elections,
+                                         demographic_cols=[], vectorized=v) for v in [True, False]]
+    assert vectorized.vectorized_elections
+
+    for part in random_partitions(graph, num_districts=6):
+        part = Partition(graph, part.assignment, updaters=elections)
+        assert vectorized.partisan_metrics(part) == reference.partisan_metrics(part)
+
+def test_fractional_votes():
+    graph = grid_graph()
+    rng = random.Random(2022)
+    for n in graph.nodes:
+        graph.nodes[n]["DEM"] += rng.random()
+        graph.nodes[n]["REP"] *= 0.37
+    elections = {"ELEC": Election("ELEC", {"Democratic": "DEM", "Republican": "REP"})}
+    metrics = [{"id": m, "name": m, "type": "election_level"} for m in
+               ["seats", "efficiency_gap", "mean_median", "partisan_bias"]]
+    vectorized, reference = [PlanMetrics(graph, list(elections), "Democratic", "TOTPOP", metrics, updaters=elections,
+                                         demographic_cols=[], vectorized=v) for v in [True, False]]
+    assert vectorized.vectorized_elections and not vectorized.whole_votes
+
+    # The chain's vote totals depend on the order of its flips, which the scores must follow to the last digit.
+    for part in flip_chain(graph, num_districts=12, updaters=elections):
+        assert json.dumps(vectorized.partisan_metrics(part)) == json.dumps(reference.partisan_metrics(part))
+
+def test_fractional_tallies():
+    graph = grid_graph()
+    rng = random.Random(2022)
+    for n in graph.nodes:
+        graph.nodes[n]["PRORATED"] = graph.nodes[n]["TOTPOP"] * rng.random()
+    columns = ["TOTPOP", "PRORATED"]
+    updaters = {col: Tally(col, alias=col) for col in columns}
+    for cls in [PlanMetrics, IncrementalPlanMetrics]:
+        scores = cls(graph, [], "Democratic", "TOTPOP", [], demographic_cols=columns)
+        assert scores.whole_tallies == [True, False]
+        # The chain's prorated totals depend on the order of its flips, which the tallies must follow to the last digit.
+        for part in flip_chain(graph, num_districts=12, updaters=updaters):
+            tallies = scores.district_tallies(part)
+            assert {col: dict(tally) for col, tally in tallies.items()} == {col: dict(part[col]) for col in columns}
+
+def test_batched_tallies():
+    graph = grid_graph()
+    for n in graph.nodes:
+        graph.nodes[n]["INC"] = int(graph.nodes[n]["TOTPOP"] > 145)
+        graph.nodes[n]["HALF"] = graph.nodes[n]["TOTPOP"] / 2
+    columns = ["TOTPOP", "HALF", "INC"]
+    metrics = [{"id": m, "name": m, "type": "plan_wide"} for m in ["num_double_bunked", "num_zero_bunked"]]
+    batched, reference = [PlanMetrics(graph, [], "Democratic", "TOTPOP", metrics, demographic_cols=columns[:2],
+                                      incumbent_col="INC", vectorized=v) for v in [True, False]]
+
+    for part in random_partitions(graph, num_districts=6):
+        part = Partition(graph, part.assignment, updaters={col: Tally(col, alias=col) for col in columns})
+        # Compared as strings so integer tallies must stay integers.
+        assert str(batched.demographic_metrics(part)) == str(reference.demographic_metrics(part))
+        assert batched.compactness_metrics(part) == reference.compactness_metrics(part)
+
+def test_metric_timer():
+    graph = grid_graph()
+    timer = MetricTimer()
+    scores = plan_metrics(graph, timer=timer)
+    for part in random_partitions(graph):
+        scores.compactness_metrics(part)
+
+    assert set(timer.calls) == {"assignment", "county_splits", "municipal_splits", "num_cut_edges", "num_traversals"}
+    assert all(calls == 10 for calls in timer.calls.values())
+    summary = timer.summary()
+    assert abs(sum(label["seconds"] for label in summary["labels"].values()) - summary["total_seconds"]) < 1e-9
+    # Nested blocks are only charged to the innermost label.
+    with timer("outer"):
+        with timer("inner"):
+            pass
+    assert timer.seconds["outer"] >= 0 and timer.calls["inner"] == 1
@@ -0,0 +1,47 @@
+from region_aware import division_random_spanning_tree, division_find_balanced_edge_cuts_memoization, DivisionBipartition
+from test_plan_metrics import grid_graph
+import networkx as nx
+from gerrychain.tree import PopulatedGraph
+import numpy as np
+import random
+
+def test_division_random_spanning_tree():
+    graph = grid_graph()
+    region = graph.subgraph([n for n in graph.nodes if n[0] < 6])
+    np.random.seed(2022)
+    spanning_tree = division_random_spanning_tree(region, division_tuples=[("COUNTY", 10)])
+
+    assert set(spanning_tree.nodes) == set(region.nodes) and nx.is_tree(spanning_tree)
+    assert all("weight" not in data for _, _, data in graph.edges(data=True))
+    # With a large penalty, the tree crosses county lines only as often as needed to connect the counties.
+    crossings = sum(graph.nodes[u]["COUNTY"] != graph.nodes[v]["COUNTY"] for u, v in spanning_tree.edges)
+    assert crossings == len(set(region.nodes[n]["COUNTY"] for n in region.nodes)) - 1
+
+def test_balanced_cuts_are_lazy():
+    graph = grid_graph()
+    populations = {n: graph.nodes[n]["TOTPOP"] for n in graph.nodes}
+    ideal_pop = sum(populations.values()) / 2
+    np.random.seed(2022)
+    random.seed(2022)
+    h = PopulatedGraph(division_random_spanning_tree(graph, division_tuples=[("COUNTY", 1)]), populations, ideal_pop, 0.1)
+    cuts = division_find_balanced_edge_cuts_memoization(h, division_tuples=[("COUNTY", 1)], graph=graph)
+
+    assert len(cuts) > 0 and all("subset" not in cut.__dict__ for cut in cuts)
+    for cut in cuts:
+        assert graph.nodes[cut.edge[0]]["COUNTY"] != graph.nodes[cut.edge[1]]["COUNTY"]
+        assert abs(sum(populations[n] for n in cut.subset) - ideal_pop) <= 0.1 * ideal_pop
+        assert nx.is_connected(h.graph.subgraph(cut.subset))
+
+def test_division_bipartition_reads_populations_once():
+    graph = grid_graph()
+    method = DivisionBipartition(graph, "TOTPOP", [("COUNTY", 1)], first_check_division=True)
+    # The populations are read from the parent graph when the method is bound, not from the regions.
+    populations = {n: graph.nodes[n].pop("TOTPOP") for n in graph.nodes}
+    for left in range(2, 6):
+        region = graph.subgraph([n for n in graph.nodes if left <= n[0] < left + 4])
+        pop_target = sum(populations[n] for n in region.nodes) / 2
+        np.random.seed(left)
+        random.seed(left)
+        subset = method(region, "TOTPOP", pop_target, 0.1)
+        assert abs(sum(populations[n] for n in subset) - pop_target) <= 0.1 * pop_target
+        assert nx.is_connected(region.subgraph(subset))
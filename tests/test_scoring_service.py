@@ -0,0 +1,82 @@
+from scoring_service import ScoringService, StateScorer, make_server
+from scoring_specification import ScoringSpecification
+from test_plan_metrics import grid_graph, random_partitions
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+import threading
+import pytest
+import json
+
+SPEC = {
+    "districts": {"congress": 4},
+    "elections": [{"name": "ELEC", "candidates": [{"name": "Republican", "key": "REP"}, {"name": "Democratic", "key": "DEM"}]}],
+    "metrics": [{"id": "TOTPOP", "name": "Population", "type": "col_tally"},
+                {"id": "num_cut_edges", "name": "Cut Edges"}, {"id": "num_split_counties", "name": "Split Counties"},
+                {"id": "seats", "name": "Seats"}, {"id": "efficiency_gap", "name": "EG"}],
+    "dual_graph": None, "pop_col": "TOTPOP", "county_col": "COUNTY", "pov_party": "Democratic",
+}
+
+def scoring_graph():
+    graph = grid_graph()
+    for n in graph.nodes:
+        graph.nodes[n]["GEOID20"] = "51{}{}".format(*n)
+    return graph
+
+class GridService(ScoringService):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.loads = []
+
+    def load_scorer(self, state, plan_type):
+        self.loads.append((state, plan_type))
+        return StateScorer(SPEC, plan_type, graph=scoring_graph())
+
+def post(url, body):
+    try:
+        with urlopen(Request(url, data=body.encode(), method="POST")) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_scoring_service():
+    service = GridService(max_loaded=1)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+    try:
+        graph = scoring_graph()
+        reference = StateScorer(SPEC, "congress", graph=graph)
+        part = next(random_partitions(graph))
+        plan = {graph.nodes[n]["GEOID20"]: district for n, district in part.assignment.items()}
+        expected = json.loads(json.dumps(reference.score(plan, plan_name="test")))
+
+        csv_plan = "GEOID20,assignment\n" + "".join("{},{}\n".format(geoid, district) for geoid, district in plan.items())
+        assert post(url + "/score?state=Virginia&plan_type=congress&name=test", csv_plan) == (200, expected)
+        assert post(url + "/score?state=Virginia&plan_type=congress&name=test", json.dumps(plan)) == (200, expected)
+        assert service.loads == [("Virginia", "congress")]
+
+        del plan["5100"]
+        status, error = post(url + "/score?state=Virginia&plan_type=congress", json.dumps(plan))
+        assert status == 400 and "1 GEOIDs" in error["error"]
+
+        # Only one scorer stays loaded.
+        post(url + "/score?state=Michigan&plan_type=congress", csv_plan)
+        with urlopen(url + "/status") as response:
+            assert json.loads(response.read())["loaded"] == ["Michigan/congress"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_scoring_specification():
+    spec = {**SPEC, "metrics": SPEC["metrics"] + [{"id": "num_double_bunked", "name": "Double Bunked"}, {"id": "unknown", "name": "?"}],
+            "incumbent_cols": {"congress": "INC"}}
+    with pytest.warns(UserWarning, match="unknown"):
+        scoring_spec = ScoringSpecification(spec)
+    assert scoring_spec.demographic_cols == ["TOTPOP"]
+    assert [m["id"] for m in scoring_spec.state_metrics] == ["TOTPOP", "num_cut_edges", "num_split_counties", "seats",
+                                                             "efficiency_gap", "num_double_bunked"]
+    assert scoring_spec.municipality_col is None and scoring_spec.incumbent_col("congress") == "INC"
+    assert list(scoring_spec.demographic_updaters("congress")) == ["TOTPOP", "INC"]
+    # Candidates are sorted, so the Democratic column comes first.
+    assert scoring_spec.election_updaters["ELEC"].parties == ["Democratic", "Republican"]
+    assert ScoringSpecification(SPEC).incumbent_col("congress") is None
@@ -0,0 +1,52 @@
+from shared_graph import SharedGraph
+from region_aware import division_bipartition_tree
+from test_plan_metrics import grid_graph, random_partitions, METRICS
+from plan_metrics import PlanMetrics
+from gerrychain import Partition, Election
+from gerrychain.updaters import Tally
+import multiprocessing
+import numpy as np
+import random
+
+def test_plan_metrics_from_shared_columns():
+    graph = grid_graph()
+    for n in graph.nodes:
+        graph.nodes[n]["INC"] = int(graph.nodes[n]["TOTPOP"] > 145)
+    elections = {"ELEC": Election("ELEC", {"Democratic": "DEM", "Republican": "REP"})}
+    metrics = METRICS + [{"id": m, "name": m, "type": "plan_wide"} for m in ["num_double_bunked", "num_zero_bunked"]] + \
+              [{"id": m, "name": m, "type": "election_level"} for m in ["seats", "efficiency_gap", "eguia_county"]]
+    with SharedGraph.create(graph, numeric_cols=["TOTPOP", "INC", "DEM", "REP"], categorical_cols=["COUNTY", "MUNI"]) as shared:
+        shared_scores, reference = [PlanMetrics(graph, ["ELEC"], "Democratic", "TOTPOP", metrics, updaters=elections,
+                                                demographic_cols=["TOTPOP"], municipality_col="MUNI", incumbent_col="INC",
+                                                columns=columns) for columns in [shared, None]]
+
+        for part in random_partitions(graph, num_districts=6):
+            part = Partition(graph, part.assignment, updaters={**elections, "TOTPOP": Tally("TOTPOP", alias="TOTPOP")})
+            assert str(shared_scores.plan_summary(part)) == str(reference.plan_summary(part))
+
+def lean_graph(spec):
+    attached = SharedGraph.attach(spec)
+    lean = attached.to_graph(attributes=["TOTPOP", "MUNI"])
+    attached.close()
+    return list(lean.nodes(data=True)), set(map(frozenset, lean.edges))
+
+def test_attach_and_lean_graph():
+    graph = grid_graph()
+    with SharedGraph.create(graph, numeric_cols=["TOTPOP"], categorical_cols=["MUNI"]) as shared:
+        with multiprocessing.get_context("fork").Pool(1) as pool:
+            nodes, edges = pool.apply(lean_graph, (shared.spec,))
+
+    assert nodes == [(n, {"TOTPOP": d["TOTPOP"], "MUNI": d["MUNI"]}) for n, d in graph.nodes(data=True)]
+    assert edges == set(map(frozenset, graph.edges))
+
+def test_division_bipartition_from_shared_columns():
+    graph = grid_graph()
+    ideal_pop = sum(graph.nodes[n]["TOTPOP"] for n in graph.nodes) / 2
+    with SharedGraph.create(graph, numeric_cols=["TOTPOP"], categorical_cols=["COUNTY"]) as shared:
+        subsets = []
+        for columns in [shared, None]:
+            random.seed(2022)
+            np.random.seed(2022)
+            subsets.append(division_bipartition_tree(graph, "TOTPOP", ideal_pop, 0.1, division_tuples=[("COUNTY", 1)],
+                                                     first_check_division=True, columns=columns))
+        assert subsets[0] == subsets[1] and len(subsets[0]) > 0